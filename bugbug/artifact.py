@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import zlib
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+import numpy as np
+import xgboost
+from sklearn.base import BaseEstimator
+from sklearn.externals import joblib
+
+# Attributes which are only kept for introspection and can get very large (e.g.
+# the terms ignored by a TfidfVectorizer because of min_df).
+DROPPED_ATTRIBUTES = ("stop_words_",)
+
+# Attributes holding the boosters of XGBoost models and of the classifiers
+# trained out-of-core.
+BOOSTER_ATTRIBUTES = ("_Booster", "booster")
+
+
+class MappedVocabulary(Mapping):
+    """Read-only term -> index mapping, stored in arrays which can be memory-mapped.
+
+    The terms are stored sorted and UTF-8 encoded in a single buffer, so that
+    loading a model doesn't unpickle a huge dict. They are looked up through an
+    open addressing hash table (CRC32 of the term, linear probing), stored in an
+    array too, so that processes memory-mapping the same model share it instead
+    of each building a dict.
+    """
+
+    def __init__(self, vocabulary):
+        terms = sorted(
+            (term.encode("utf-8"), index) for term, index in vocabulary.items()
+        )
+
+        self.offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term, _ in terms], out=self.offsets[1:])
+        self.data = np.frombuffer(b"".join(term for term, _ in terms), dtype=np.uint8)
+        self.indices = np.array([index for _, index in terms], dtype=np.int64)
+
+        # At most half of the slots are used, so that probes stay short.
+        n_slots = 1 << max(1, 2 * len(terms) - 1).bit_length()
+        self.slots = np.full(n_slots, -1, dtype=np.int64)
+        mask = n_slots - 1
+        for i, (term, _) in enumerate(terms):
+            slot = zlib.crc32(term) & mask
+            while self.slots[slot] != -1:
+                slot = (slot + 1) & mask
+            self.slots[slot] = i
+
+        self._init_views()
+
+    def _init_views(self):
+        # Indexing and slicing memoryviews is much faster than indexing and
+        # slicing (memory-mapped) arrays.
+        self._data = memoryview(np.asarray(self.data))
+        self._offsets = memoryview(np.asarray(self.offsets))
+        self._indices = memoryview(np.asarray(self.indices))
+        self._slots = memoryview(np.asarray(self.slots))
+        self._mask = len(self.slots) - 1
+
+    def __getstate__(self):
+        return {
+            "offsets": self.offsets,
+            "data": self.data,
+            "indices": self.indices,
+            "slots": self.slots,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_views()
+
+    def _term(self, i):
+        return self._data[self._offsets[i] : self._offsets[i + 1]].tobytes()
+
+    def __getitem__(self, term):
+        if not isinstance(term, str):
+            raise KeyError(term)
+
+        # UTF-8 is the default encoding.
+        encoded = term.encode()
+        slots = self._slots
+        offsets = self._offsets
+        mask = self._mask
+
+        slot = zlib.crc32(encoded) & mask
+        i = slots[slot]
+        while i != -1:
+            if self._data[offsets[i] : offsets[i + 1]] == encoded:
+                return self._indices[i]
+
+            slot = (slot + 1) & mask
+            i = slots[slot]
+
+        raise KeyError(term)
+
+    def __iter__(self):
+        for i in range(len(self.indices)):
+            yield self._term(i).decode("utf-8")
+
+    def __len__(self):
+        return len(self.indices)
+
+    def items(self):
+        return zip(self, self.values())
+
+    def values(self):
+        return (int(index) for index in self.indices)
+
+
+class LazyBooster(xgboost.Booster):
+    """XGBoost booster which is only loaded from its raw model on first use."""
+
+    def __init__(self, raw, state):
+        self.__dict__.update(state)
+        self.raw = raw
+        self._handle = None
+
+    @classmethod
+    def from_booster(cls, booster):
+        state = {
+            name: value for name, value in vars(booster).items() if name != "handle"
+        }
+        return cls(np.frombuffer(booster.save_raw(), dtype=np.uint8), state)
+
+    @property
+    def handle(self):
+        if self._handle is None:
+            booster = xgboost.Booster(model_file=bytearray(self.raw))
+            self._handle = booster.handle
+            # The handle is now owned by this booster.
+            booster.handle = None
+
+        return self._handle
+
+    @handle.setter
+    def handle(self, handle):
+        self._handle = handle
+
+    def __del__(self):
+        if self._handle is not None:
+            super().__del__()
+
+    def __reduce__(self):
+        state = {
+            name: value
+            for name, value in vars(self).items()
+            if name not in ("raw", "_handle")
+        }
+        return (self.__class__, (self.raw, state))
+
+
+def iter_estimators(obj):
+    """Yield the estimators contained in obj (e.g. in pipelines or ensembles)."""
+    if isinstance(obj, BaseEstimator):
+        yield obj
+        values = list(vars(obj).values())
+    elif isinstance(obj, (list, tuple)):
+        values = obj
+    else:
+        return
+
+    for value in values:
+        if isinstance(value, (BaseEstimator, list, tuple)):
+            yield from iter_estimators(value)
+
+
+@contextmanager
+def mappable(estimators):
+    """Temporarily replace the parts of the estimators which are slow to unpickle
+    with their memory-mappable equivalents.
+    """
+    replaced = []
+
+    def replace(estimator, name, value):
+        replaced.append((estimator, name, getattr(estimator, name)))
+        if value is None:
+            delattr(estimator, name)
+        else:
+            setattr(estimator, name, value)
+
+    try:
+        for estimator in iter_estimators(estimators):
+            vocabulary = getattr(estimator, "vocabulary_", None)
+            if isinstance(vocabulary, dict) and all(
+                isinstance(term, str) for term in vocabulary
+            ):
+                replace(estimator, "vocabulary_", MappedVocabulary(vocabulary))
+
+            for name in DROPPED_ATTRIBUTES:
+                if hasattr(estimator, name):
+                    replace(estimator, name, None)
+
+            for name in BOOSTER_ATTRIBUTES:
+                booster = getattr(estimator, name, None)
+                if type(booster) is xgboost.Booster:
+                    replace(estimator, name, LazyBooster.from_booster(booster))
+
+        yield
+    finally:
+        for estimator, name, value in reversed(replaced):
+            setattr(estimator, name, value)
+
+
+def dump(model, path):
+    """Store a model so that it can be loaded lazily.
+
+    Vocabularies are stored as arrays, which are memory-mapped when loaded with
+    `load`, and looked up in place: processes loading the same file share them.
+    XGBoost boosters are stored in their native format and only loaded when
+    first used; each process still loads its own copy of them.
+    """
+    with mappable([model.extraction_pipeline, model.clf]):
+        joblib.dump(model, path)
+
+
+def load(path):
+    return joblib.load(path, mmap_mode="r")
@@ -4,7 +4,9 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import re
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 
 import pandas as pd
@@ -13,6 +15,7 @@ from libmozdata import versions
 from sklearn.base import BaseEstimator, TransformerMixin
 
 from bugbug import bug_snapshot, repository
+from bugbug.utils import get_config_fingerprint
 
 
 def field(bug, field):
@@ -542,6 +545,75 @@ def get_author_ids():
     return author_ids
 
 
+class SharedResults(object):
+    """Results computed from bugs (snapshots, features, cleaned up texts), which
+    are shared between the BugExtractors of different models.
+
+    Results are kept for the max_bugs bugs which were used most recently.
+    """
+
+    def __init__(self, max_bugs=1024):
+        self.max_bugs = max_bugs
+        self.lock = threading.Lock()
+        self.bugs = OrderedDict()
+
+    def get(self, bug, key, compute):
+        # Bugs can't be told apart without their ID.
+        if "id" not in bug:
+            return compute()
+
+        bug_key = (bug["id"], bug.get("last_change_time"), "commits" in bug)
+
+        with self.lock:
+            results = self.bugs.get(bug_key)
+            if results is None:
+                results = self.bugs[bug_key] = {}
+                if len(self.bugs) > self.max_bugs:
+                    self.bugs.popitem(last=False)
+            else:
+                self.bugs.move_to_end(bug_key)
+
+            if key in results:
+                return results[key]
+
+        result = compute()
+
+        with self.lock:
+            results[key] = result
+
+        return result
+
+
+shared_results = None
+
+
+@contextmanager
+def sharing_results(max_bugs=1024):
+    """Share the results computed by all the BugExtractors in this context."""
+    global shared_results
+
+    shared_results = SharedResults(max_bugs)
+    try:
+        yield shared_results
+    finally:
+        shared_results = None
+
+
+def get_sharing_key(obj):
+    # Lambdas and local functions can't be told apart by their name.
+    if callable(obj) and "<" in getattr(obj, "__qualname__", ""):
+        return None
+
+    return get_config_fingerprint(obj)
+
+
+def get_shared_result(bug, key, compute):
+    if shared_results is None or None in key:
+        return compute()
+
+    return shared_results.get(bug, key, compute)
+
+
 class BugExtractor(BaseEstimator, TransformerMixin):
     def __init__(
         self,
@@ -562,46 +634,74 @@ class BugExtractor(BaseEstimator, TransformerMixin):
     def fit(self, x, y=None):
         return self
 
+    def cleanup(self, bug):
+        """Return the title and the comments of a bug, cleaned up."""
+        title = bug["summary"]
+        comments = [c["text"] for c in bug["comments"]]
+
+        for cleanup_function in self.cleanup_functions:
+            title = cleanup_function(title)
+            comments = [cleanup_function(comment) for comment in comments]
+
+        return title, comments
+
     def transform(self, bugs):
         results = []
 
         reporter_experience_map = defaultdict(int)
         author_ids = get_author_ids() if self.commit_data else None
 
-        already_rollbacked = set()
+        if shared_results is not None:
+            if self.rollback:
+                snapshot_key = get_sharing_key(self.rollback_when)
+            else:
+                snapshot_key = "original"
+            extractor_keys = [
+                # The reporter experience depends on the bugs seen before.
+                get_sharing_key(feature_extractor)
+                if not isinstance(feature_extractor, reporter_experience)
+                else None
+                for feature_extractor in self.feature_extractors
+            ]
+            cleanup_key = get_sharing_key(self.cleanup_functions)
+        else:
+            snapshot_key = None
+            extractor_keys = [None] * len(self.feature_extractors)
+            cleanup_key = None
 
         def apply_transform(bug):
 
             is_couple = isinstance(bug, tuple)
-
-            if not is_couple:
-                bug_id = bug["id"]
-
-                if self.rollback and bug_id not in already_rollbacked:
-                    bug = bug_snapshot.rollback(bug, self.rollback_when)
-                    already_rollbacked.add(bug_id)
-
-            else:
-                bug1_id = bug[0]["id"]
-                bug2_id = bug[1]["id"]
-
-                if self.rollback:
-                    if bug1_id not in already_rollbacked:
-                        bug[0] = bug_snapshot.rollback(bug[0], self.rollback_when)
-                        already_rollbacked.add(bug1_id)
-                    if bug2_id not in already_rollbacked:
-                        bug[1] = bug_snapshot.rollback(bug[1], self.rollback_when)
-                        already_rollbacked.add(bug2_id)
+            original_bug = bug
+
+            if self.rollback:
+                if not is_couple:
+                    bug = get_shared_result(
+                        original_bug,
+                        ("snapshot", snapshot_key),
+                        lambda: bug_snapshot.snapshot_at(bug, self.rollback_when),
+                    )
+                else:
+                    bug = (
+                        bug_snapshot.snapshot_at(bug[0], self.rollback_when),
+                        bug_snapshot.snapshot_at(bug[1], self.rollback_when),
+                    )
 
             data = {}
 
-            for feature_extractor in self.feature_extractors:
+            for feature_extractor, extractor_key in zip(
+                self.feature_extractors, extractor_keys
+            ):
                 res = None
                 if isinstance(feature_extractor, single_bug_feature) and not is_couple:
-                    res = feature_extractor(
-                        bug,
-                        reporter_experience=reporter_experience_map[bug["creator"]],
-                        author_ids=author_ids,
+                    res = get_shared_result(
+                        original_bug,
+                        ("feature", snapshot_key, extractor_key),
+                        lambda: feature_extractor(
+                            bug,
+                            reporter_experience=reporter_experience_map[bug["creator"]],
+                            author_ids=author_ids,
+                        ),
                     )
 
                 elif isinstance(feature_extractor, couple_bug_feature) and is_couple:
@@ -636,16 +736,17 @@ class BugExtractor(BaseEstimator, TransformerMixin):
 
                 # TODO: Try simply using all possible fields instead of extracting features manually.
 
-                for cleanup_function in self.cleanup_functions:
-                    bug["summary"] = cleanup_function(bug["summary"])
-                    for c in bug["comments"]:
-                        c["text"] = cleanup_function(c["text"])
+                title, comments = get_shared_result(
+                    original_bug,
+                    ("cleanup", snapshot_key, cleanup_key),
+                    lambda: self.cleanup(bug),
+                )
 
                 return {
                     "data": data,
-                    "title": bug["summary"],
-                    "first_comment": bug["comments"][0]["text"],
-                    "comments": " ".join([c["text"] for c in bug["comments"]]),
+                    "title": title,
+                    "first_comment": comments[0],
+                    "comments": " ".join(comments),
                 }
 
         for bug in bugs():
@@ -3,10 +3,19 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import bisect
+import concurrent.futures
+import itertools
+import os
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+from datetime import datetime
+
 import dateutil.parser
+import orjson
 from dateutil.relativedelta import relativedelta
 
-from bugbug import bugzilla
+from bugbug import bugzilla, db
 
 
 def bool_str(val):
@@ -528,7 +537,7 @@ def is_expected_inconsistent_change_flag(flag, obj_id):
     )
 
 
-def rollback(bug, when=None, do_assert=False):
+def get_assert_or_log(bug, do_assert):
     def assert_or_log(msg):
         msg = f'{msg}, in bug {bug["id"]}'
         if do_assert:
@@ -536,291 +545,277 @@ def rollback(bug, when=None, do_assert=False):
         else:
             print(msg)
 
-    def parse_flag_change(change):
-        parts = change.split("(")
-        if len(parts) != 1 and len(parts) != 2:
-            assert_or_log(f"Too many parts for {change}")
-            return None, None, None
+    return assert_or_log
 
-        name_and_status = parts[0]
-        name = name_and_status[:-1]
-        status = name_and_status[-1]
-        if status not in ["?", "+", "-"]:
-            assert_or_log(f"unexpected status: {status}")
-            return None, None, None
 
-        requestee = None if len(parts) != 2 else parts[1][:-1]
-        return name, status, requestee
+def parse_flag_change(change, assert_or_log):
+    parts = change.split("(")
+    if len(parts) != 1 and len(parts) != 2:
+        assert_or_log(f"Too many parts for {change}")
+        return None, None, None
 
-    last_product = bug["product"]
+    name_and_status = parts[0]
+    name = name_and_status[:-1]
+    status = name_and_status[-1]
+    if status not in ["?", "+", "-"]:
+        assert_or_log(f"unexpected status: {status}")
+        return None, None, None
 
-    change_to_return = None
-    if when is not None:
-        for history in bug["history"]:
-            for change in history["changes"]:
-                if when(change):
-                    change_to_return = change
-                    rollback_date = dateutil.parser.parse(history["when"])
-                    break
+    requestee = None if len(parts) != 2 else parts[1][:-1]
+    return name, status, requestee
 
-            if change_to_return is not None:
-                break
 
-        if change_to_return is None:
-            return bug
-    else:
-        rollback_date = dateutil.parser.parse(bug["creation_time"])
+def get_changes(bug):
+    """Return the changes of a bug, in the order they have to be reverted."""
+    return [
+        change for history in reversed(bug["history"]) for change in history["changes"]
+    ]
 
-    ret = False
 
-    for history in reversed(bug["history"]):
-        # TODO: Handle changes to product and component.
-        # TODO: This code might be removed when https://bugzilla.mozilla.org/show_bug.cgi?id=1513952 is fixed.
+def revert_change(bug, change, last_product, assert_or_log):
+    """Revert a change from the history of a bug, modifying the bug in place.
 
-        if ret:
-            break
+    Returns the location modified by the change (a ("field", name), ("flags",
+    attachment_id) or ("comment", comment_id) tuple), or None if the change
+    was ignored.
+    """
+    # TODO: Handle changes to product and component.
+    # TODO: This code might be removed when https://bugzilla.mozilla.org/show_bug.cgi?id=1513952 is fixed.
 
-        for change in history["changes"]:
-            if change is change_to_return:
-                ret = True
-                break
+    field = change["field_name"]
 
-            field = change["field_name"]
+    if field in "component":
+        # TODO: Ignore this for now, not so easy to make it work https://bugzilla.mozilla.org/show_bug.cgi?id=1513952.
+        return None
 
-            if field in "component":
-                # TODO: Ignore this for now, not so easy to make it work https://bugzilla.mozilla.org/show_bug.cgi?id=1513952.
-                continue
+    if field == "qa_contact":
+        # TODO: Ignore this for now. Example usage in 92144.
+        return None
 
-            if field == "qa_contact":
-                # TODO: Ignore this for now. Example usage in 92144.
-                continue
+    if field == "cf_fx_iteration":
+        # TODO: Ignore this for now. Example usage in 1101478.
+        return None
 
-            if field == "cf_fx_iteration":
-                # TODO: Ignore this for now. Example usage in 1101478.
-                continue
+    if field == "cf_crash_signature":
+        # TODO: Ignore this for now. Example usage in 1437575.
+        return None
 
-            if field == "cf_crash_signature":
-                # TODO: Ignore this for now. Example usage in 1437575.
-                continue
+    if field == "cf_backlog":
+        # TODO: Ignore this for now. Example usage in 1048455.
+        return None
 
-            if field == "cf_backlog":
-                # TODO: Ignore this for now. Example usage in 1048455.
-                continue
+    if field == "bug_mentor":
+        # TODO: Ignore this for now. Example usage in 1042103.
+        return None
 
-            if field == "bug_mentor":
-                # TODO: Ignore this for now. Example usage in 1042103.
-                continue
+    if field == "cf_user_story":
+        # TODO: Ignore this for now. Example usage in 1369255.
+        # Seems to be broken in Bugzilla.
+        return None
 
-            if field == "cf_user_story":
-                # TODO: Ignore this for now. Example usage in 1369255.
-                # Seems to be broken in Bugzilla.
-                continue
+    if field == "cf_rank":
+        # TODO: Ignore this for now. Example usage in 1475099.
+        return None
 
-            if field == "cf_rank":
-                # TODO: Ignore this for now. Example usage in 1475099.
-                continue
+    if field in ["alias", "restrict_comments"]:
+        return None
 
-            if field in ["alias", "restrict_comments"]:
-                continue
+    if field == "longdescs.isprivate":
+        # Ignore for now.
+        return None
 
-            if field == "longdescs.isprivate":
-                # Ignore for now.
-                continue
+    if field == "version":
+        # TODO: Ignore this for now. Example usage in 1162372 or 1389926.
+        return None
 
-            if field == "version":
-                # TODO: Ignore this for now. Example usage in 1162372 or 1389926.
-                continue
+    if "attachment_id" in change and field.startswith("attachments"):
+        # TODO: Ignore changes to attachments for now.
+        return None
 
-            if "attachment_id" in change and field.startswith("attachments"):
-                # TODO: Ignore changes to attachments for now.
-                continue
+    if field == "flagtypes.name":
+        if "attachment_id" in change:
+            # https://bugzilla.mozilla.org/show_bug.cgi?id=1516172
+            if bug["id"] == 1_421_395:
+                return None
 
-            if field == "flagtypes.name":
-                if "attachment_id" in change:
-                    # https://bugzilla.mozilla.org/show_bug.cgi?id=1516172
-                    if bug["id"] == 1_421_395:
-                        continue
-
-                    obj = None
-                    for attachment in bug["attachments"]:
-                        if attachment["id"] == change["attachment_id"]:
-                            obj = attachment
-                            break
-
-                    if obj is None:
-                        assert_or_log(f'Attachment {change["attachment_id"]} not found')
-                        continue
-                else:
-                    obj = bug
-
-                if change["added"]:
-                    for to_remove in change["added"].split(", "):
-                        # TODO: Skip needinfo/reviews for now, we need a way to match them precisely when there are multiple needinfos/reviews requested.
-                        is_question_flag = any(
-                            to_remove.startswith(s)
-                            for s in [
-                                "needinfo",
-                                "review",
-                                "feedback",
-                                "ui-review",
-                                "sec-approval",
-                                "sec-review",
-                                "data-review",
-                                "approval-mozilla-",
-                            ]
-                        )
+            obj = None
+            for attachment in bug["attachments"]:
+                if attachment["id"] == change["attachment_id"]:
+                    obj = attachment
+                    break
 
-                        name, status, requestee = parse_flag_change(to_remove)
-
-                        found_flag = None
-                        for f in obj["flags"]:
-                            if (
-                                f["name"] == name
-                                and f["status"] == status
-                                and (
-                                    requestee is None
-                                    or (
-                                        "requestee" in f and f["requestee"] == requestee
-                                    )
-                                )
-                            ):
-                                if (
-                                    found_flag is not None
-                                    and not is_expected_inconsistent_change_flag(
-                                        to_remove, obj["id"]
-                                    )
-                                    and not is_question_flag
-                                ):
-                                    flag_text = "{}{}".format(f["name"], f["status"])
-                                    if "requestee" in f:
-                                        flag_text = "{}{}".format(
-                                            flag_text, f["requestee"]
-                                        )
-                                    assert_or_log(f"{flag_text} found twice!")
-                                found_flag = f
-
-                        if found_flag is not None:
-                            obj["flags"].remove(found_flag)
-                        elif (
-                            not is_expected_inconsistent_change_flag(
+            if obj is None:
+                assert_or_log(f'Attachment {change["attachment_id"]} not found')
+                return None
+        else:
+            obj = bug
+
+        location = ("flags", change.get("attachment_id"))
+
+        if change["added"]:
+            for to_remove in change["added"].split(", "):
+                # TODO: Skip needinfo/reviews for now, we need a way to match them precisely when there are multiple needinfos/reviews requested.
+                is_question_flag = any(
+                    to_remove.startswith(s)
+                    for s in [
+                        "needinfo",
+                        "review",
+                        "feedback",
+                        "ui-review",
+                        "sec-approval",
+                        "sec-review",
+                        "data-review",
+                        "approval-mozilla-",
+                    ]
+                )
+
+                name, status, requestee = parse_flag_change(to_remove, assert_or_log)
+
+                found_flag = None
+                for f in obj["flags"]:
+                    if (
+                        f["name"] == name
+                        and f["status"] == status
+                        and (
+                            requestee is None
+                            or ("requestee" in f and f["requestee"] == requestee)
+                        )
+                    ):
+                        if (
+                            found_flag is not None
+                            and not is_expected_inconsistent_change_flag(
                                 to_remove, obj["id"]
                             )
                             and not is_question_flag
                         ):
-                            assert_or_log(
-                                f"flag {to_remove} not found, in obj {obj['id']}"
-                            )
+                            flag_text = "{}{}".format(f["name"], f["status"])
+                            if "requestee" in f:
+                                flag_text = "{}{}".format(flag_text, f["requestee"])
+                            assert_or_log(f"{flag_text} found twice!")
+                        found_flag = f
+
+                if found_flag is not None:
+                    obj["flags"].remove(found_flag)
+                elif (
+                    not is_expected_inconsistent_change_flag(to_remove, obj["id"])
+                    and not is_question_flag
+                ):
+                    assert_or_log(f"flag {to_remove} not found, in obj {obj['id']}")
 
-                if change["removed"]:
-                    # Inconsistent review and needinfo flags.
-                    if bug["id"] in [785931, 1_342_178]:
-                        continue
+        if change["removed"]:
+            # Inconsistent review and needinfo flags.
+            if bug["id"] in [785931, 1_342_178]:
+                return location
 
-                    for to_add in change["removed"].split(", "):
-                        name, status, requestee = parse_flag_change(to_add)
+            for to_add in change["removed"].split(", "):
+                name, status, requestee = parse_flag_change(to_add, assert_or_log)
 
-                        new_flag = {"name": name, "status": status}
-                        if requestee is not None:
-                            new_flag["requestee"] = requestee
+                new_flag = {"name": name, "status": status}
+                if requestee is not None:
+                    new_flag["requestee"] = requestee
 
-                        obj["flags"].append(new_flag)
+                obj["flags"].append(new_flag)
 
-                continue
+        return location
 
-            # We don't support comment tags yet.
-            if field == "comment_tag":
-                continue
+    # We don't support comment tags yet.
+    if field == "comment_tag":
+        return None
 
-            if field == "comment_revision":
-                obj = None
-                for comment in bug["comments"]:
-                    if comment["id"] == change["comment_id"]:
-                        obj = comment
-                        break
+    if field == "comment_revision":
+        obj = None
+        for comment in bug["comments"]:
+            if comment["id"] == change["comment_id"]:
+                obj = comment
+                break
 
-                if obj is None:
-                    if change["comment_id"] != 14096735:
-                        assert_or_log(f'Comment {change["comment_id"]} not found')
-                    continue
+        if obj is None:
+            if change["comment_id"] != 14096735:
+                assert_or_log(f'Comment {change["comment_id"]} not found')
+            return None
 
-                if obj["count"] != change["comment_count"]:
-                    assert_or_log("Wrong comment count")
+        if obj["count"] != change["comment_count"]:
+            assert_or_log("Wrong comment count")
 
-                # TODO: It should actually be applied on "raw_text".
-                # if obj["text"] != change["added"]:
-                #     assert_or_log(f"Current value for comment: ({obj['text']}) is different from previous value: ({change['added']}")
+        # TODO: It should actually be applied on "raw_text".
+        # if obj["text"] != change["added"]:
+        #     assert_or_log(f"Current value for comment: ({obj['text']}) is different from previous value: ({change['added']}")
 
-                obj["text"] = change["removed"]
+        obj["text"] = change["removed"]
 
-                continue
+        return ("comment", obj["id"])
 
-            if change["added"] != "---":
-                if field not in bug and not is_expected_inconsistent_field(
-                    field, last_product, bug["id"]
-                ):
-                    assert_or_log(f"{field} is not present")
-
-            if field in bug and isinstance(bug[field], list):
-                if change["added"]:
-                    for to_remove in change["added"].split(", "):
-                        if field in FIELD_TYPES:
-                            try:
-                                to_remove = FIELD_TYPES[field](to_remove)
-                            except Exception:
-                                assert_or_log(
-                                    f"Exception while transforming {to_remove} from {bug[field]} (field {field})"
-                                )
-
-                        if to_remove in bug[field]:
-                            bug[field].remove(to_remove)
-                        elif not is_expected_inconsistent_change_list_field(
-                            field, bug["id"], to_remove
-                        ):
-                            assert_or_log(
-                                f"{to_remove} is not in {bug[field]}, for field {field}"
-                            )
+    if change["added"] != "---":
+        if field not in bug and not is_expected_inconsistent_field(
+            field, last_product, bug["id"]
+        ):
+            assert_or_log(f"{field} is not present")
 
-                if change["removed"]:
-                    for to_add in change["removed"].split(", "):
-                        if field in FIELD_TYPES:
-                            try:
-                                to_add = FIELD_TYPES[field](to_add)
-                            except Exception:
-                                assert_or_log(
-                                    f"Exception while transforming {to_add} from {bug[field]} (field {field})"
-                                )
-                        bug[field].append(to_add)
-            else:
+    if field in bug and isinstance(bug[field], list):
+        if change["added"]:
+            for to_remove in change["added"].split(", "):
                 if field in FIELD_TYPES:
                     try:
-                        old_value = FIELD_TYPES[field](change["removed"])
+                        to_remove = FIELD_TYPES[field](to_remove)
                     except Exception:
                         assert_or_log(
-                            f"Exception while transforming {change['removed']} from {bug[field]} (field {field})"
+                            f"Exception while transforming {to_remove} from {bug[field]} (field {field})"
                         )
+
+                if to_remove in bug[field]:
+                    bug[field].remove(to_remove)
+                elif not is_expected_inconsistent_change_list_field(
+                    field, bug["id"], to_remove
+                ):
+                    assert_or_log(
+                        f"{to_remove} is not in {bug[field]}, for field {field}"
+                    )
+
+        if change["removed"]:
+            for to_add in change["removed"].split(", "):
+                if field in FIELD_TYPES:
                     try:
-                        new_value = FIELD_TYPES[field](change["added"])
+                        to_add = FIELD_TYPES[field](to_add)
                     except Exception:
                         assert_or_log(
-                            f"Exception while transforming {change['added']} from {bug[field]} (field {field})"
+                            f"Exception while transforming {to_add} from {bug[field]} (field {field})"
                         )
-                else:
-                    old_value = change["removed"]
-                    new_value = change["added"]
-
-                if (
-                    field in bug
-                    and bug[field] != new_value
-                    and not is_expected_inconsistent_change_field(
-                        field, bug["id"], new_value, bug[field]
-                    )
-                ):
-                    assert_or_log(
-                        f"Current value for field {field}: ({bug[field]}) is different from previous value: ({new_value})"
-                    )
+                bug[field].append(to_add)
+    else:
+        if field in FIELD_TYPES:
+            try:
+                old_value = FIELD_TYPES[field](change["removed"])
+            except Exception:
+                assert_or_log(
+                    f"Exception while transforming {change['removed']} from {bug[field]} (field {field})"
+                )
+            try:
+                new_value = FIELD_TYPES[field](change["added"])
+            except Exception:
+                assert_or_log(
+                    f"Exception while transforming {change['added']} from {bug[field]} (field {field})"
+                )
+        else:
+            old_value = change["removed"]
+            new_value = change["added"]
+
+        if (
+            field in bug
+            and bug[field] != new_value
+            and not is_expected_inconsistent_change_field(
+                field, bug["id"], new_value, bug[field]
+            )
+        ):
+            assert_or_log(
+                f"Current value for field {field}: ({bug[field]}) is different from previous value: ({new_value})"
+            )
+
+        bug[field] = old_value
 
-                bug[field] = old_value
+    return ("field", field)
 
+
+def add_first_comment(bug, assert_or_log):
     if len(bug["comments"]) == 0:
         assert_or_log("There must be at least one comment")
         bug["comments"] = [
@@ -845,36 +840,423 @@ def rollback(bug, when=None, do_assert=False):
             },
         )
 
+
+def parse_creation_time(creation_time):
+    return dateutil.parser.parse(creation_time) - relativedelta(seconds=3)
+
+
+def rollback(bug, when=None, do_assert=False):
+    assert_or_log = get_assert_or_log(bug, do_assert)
+
+    last_product = bug["product"]
+
+    change_to_return = None
+    if when is not None:
+        for history in bug["history"]:
+            for change in history["changes"]:
+                if when(change):
+                    change_to_return = change
+                    rollback_date = dateutil.parser.parse(history["when"])
+                    break
+
+            if change_to_return is not None:
+                break
+
+        if change_to_return is None:
+            return bug
+    else:
+        rollback_date = dateutil.parser.parse(bug["creation_time"])
+
+    for change in get_changes(bug):
+        if change is change_to_return:
+            break
+
+        revert_change(bug, change, last_product, assert_or_log)
+
+    add_first_comment(bug, assert_or_log)
+
     bug["comments"] = [
         c
         for c in bug["comments"]
-        if dateutil.parser.parse(c["creation_time"]) - relativedelta(seconds=3)
-        <= rollback_date
+        if parse_creation_time(c["creation_time"]) <= rollback_date
     ]
     bug["attachments"] = [
         a
         for a in bug["attachments"]
-        if dateutil.parser.parse(a["creation_time"]) - relativedelta(seconds=3)
-        <= rollback_date
+        if parse_creation_time(a["creation_time"]) <= rollback_date
     ]
 
     return bug
 
 
-def get_inconsistencies(bugs):
+# Change to a list made by reverting a change: the indexes of the items which
+# were removed from the list, and the items which were appended to it.
+ListDelta = namedtuple("ListDelta", ["removed", "appended"])
+
+
+def get_list_delta(before, after):
+    # revert_change removes items from lists and appends items to them, so after
+    # is made of some of the items of before, in the same order, followed by the
+    # appended items.
+    kept = 0
+    removed = []
+    for i, item in enumerate(before):
+        if kept < len(after) and after[kept] == item:
+            kept += 1
+        else:
+            removed.append(i)
+
+    return ListDelta(frozenset(removed), tuple(after[kept:]))
+
+
+def apply_list_delta(value, delta):
+    if delta.removed:
+        value = [item for i, item in enumerate(value) if i not in delta.removed]
+
+    value.extend(
+        dict(item) if isinstance(item, dict) else item for item in delta.appended
+    )
+
+    return value
+
+
+class BugTimeline(object):
+    """Index of the history of a bug, to get snapshots of it at any point in time.
+
+    The history is replayed only once, storing the successive values of the
+    scalar fields it modifies and the items removed from and appended to the
+    list fields, so that a snapshot is rebuilt by bisecting those values instead
+    of replaying the history again.
+
+    Snapshots are deep copies, they can be modified without changing the
+    timeline.
+    """
+
+    def __init__(self, bug):
+        # The bug is kept serialized, each snapshot is a new deep copy of it.
+        self.bug_json = orjson.dumps(bug)
+        bug = orjson.loads(self.bug_json)
+
+        self.creation_time = bug["creation_time"]
+        self.histories = histories = bug["history"]
+        self.dates = [dateutil.parser.parse(history["when"]) for history in histories]
+
+        # Number of changes made by each entry of the history and the following ones.
+        self.following_changes = [0] * (len(histories) + 1)
+        for i in range(len(histories) - 1, -1, -1):
+            self.following_changes[i] = self.following_changes[i + 1] + len(
+                histories[i]["changes"]
+            )
+
+        self.attachment_indexes = {}
+        for i, attachment in enumerate(bug["attachments"]):
+            self.attachment_indexes.setdefault(attachment["id"], i)
+        self.comment_indexes = {}
+        for i, comment in enumerate(bug["comments"]):
+            self.comment_indexes.setdefault(comment["id"], i)
+
+        self.steps = defaultdict(list)
+        self.values = defaultdict(list)
+        # Full copies of the list fields after some of the changes, as (index
+        # of the change in values, items) pairs, so that a snapshot doesn't
+        # need to apply all the deltas since the current value of the bug.
+        self.checkpoints = defaultdict(list)
+        self.broken_at = None
+        self.error = None
+        self.rollback_points = {}
+        self.creation_times = {}
+
+        working_bug = orjson.loads(self.bug_json)
+        assert_or_log = get_assert_or_log(working_bug, False)
+        last_product = working_bug["product"]
+
+        # Value of the list fields after the last change reverted, to compute
+        # the delta of the next one, and size of the deltas since their last
+        # checkpoint.
+        last_lists = {}
+        pending_sizes = defaultdict(int)
+
+        for i, change in enumerate(get_changes(working_bug)):
+            try:
+                location = revert_change(
+                    working_bug, change, last_product, assert_or_log
+                )
+            except Exception as e:
+                # Snapshots after this point fail like rollback would.
+                self.broken_at = i
+                self.error = e
+                break
+
+            if location is None:
+                continue
+
+            value = self._get_value(working_bug, location)
+            if isinstance(value, list):
+                if location not in last_lists:
+                    last_lists[location] = self._get_value(bug, location)
+
+                delta = get_list_delta(last_lists[location], value)
+                last_lists[location] = value
+
+                # A copy is only stored once the deltas since the previous one
+                # are as big as it, so the copies take at most as much memory
+                # as the deltas.
+                pending_sizes[location] += len(delta.removed) + len(delta.appended)
+                if pending_sizes[location] >= len(value):
+                    self.checkpoints[location].append(
+                        (len(self.values[location]), tuple(value))
+                    )
+                    pending_sizes[location] = 0
+
+                value = delta
+
+            self.steps[location].append(i + 1)
+            self.values[location].append(value)
+
+    def _get_value(self, bug, location):
+        kind, key = location
+
+        if kind == "field":
+            value = bug[key]
+            return list(value) if isinstance(value, list) else value
+        elif kind == "flags":
+            if key is None:
+                return list(bug["flags"])
+            return list(bug["attachments"][self.attachment_indexes[key]]["flags"])
+        elif kind == "comment":
+            return bug["comments"][self.comment_indexes[key]]["text"]
+
+    def _set_value(self, bug, location, value):
+        kind, key = location
+
+        if kind == "field":
+            bug[key] = value
+        elif kind == "flags":
+            if key is None:
+                bug["flags"] = value
+            else:
+                bug["attachments"][self.attachment_indexes[key]]["flags"] = value
+        elif kind == "comment":
+            bug["comments"][self.comment_indexes[key]]["text"] = value
+
+    def _parse_creation_time(self, creation_time):
+        if creation_time not in self.creation_times:
+            self.creation_times[creation_time] = parse_creation_time(creation_time)
+
+        return self.creation_times[creation_time]
+
+    def get_rollback_point(self, when=None):
+        """Return the number of changes to revert and the date of the snapshot.
+
+        Returns None if when is a function which doesn't match any change.
+        """
+        if when is None:
+            return (
+                self.following_changes[0],
+                dateutil.parser.parse(self.creation_time),
+            )
+
+        if isinstance(when, datetime):
+            i = bisect.bisect_right(self.dates, when)
+            return self.following_changes[i], when
+
+        if when not in self.rollback_points:
+            self.rollback_points[when] = None
+            for i, history in enumerate(self.histories):
+                for j, change in enumerate(history["changes"]):
+                    if when(change):
+                        self.rollback_points[when] = (
+                            self.following_changes[i + 1] + j,
+                            self.dates[i],
+                        )
+                        break
+
+                if self.rollback_points[when] is not None:
+                    break
+
+        return self.rollback_points[when]
+
+    def _copy(self):
+        return orjson.loads(self.bug_json)
+
+    def snapshot_at(self, when=None):
+        """Return a copy of the bug as it was at the given point of its history.
+
+        when can be None (the creation of the bug), a timezone-aware datetime (the
+        changes made after it are reverted) or a function selecting the first
+        change to roll back to, like in rollback.
+        """
+        rollback_point = self.get_rollback_point(when)
+        if rollback_point is None:
+            return self._copy()
+
+        reverted, rollback_date = rollback_point
+
+        if self.broken_at is not None and reverted > self.broken_at:
+            raise self.error
+
+        bug = self._copy()
+
+        for location, steps in self.steps.items():
+            i = bisect.bisect_right(steps, reverted)
+            if i == 0:
+                continue
+
+            values = self.values[location]
+            if isinstance(values[0], ListDelta):
+                start = 0
+                value = self._get_value(bug, location)
+                for index, items in reversed(self.checkpoints[location]):
+                    if index < i:
+                        start = index + 1
+                        value = [
+                            dict(item) if isinstance(item, dict) else item
+                            for item in items
+                        ]
+                        break
+
+                for delta in values[start:i]:
+                    value = apply_list_delta(value, delta)
+            else:
+                value = values[i - 1]
+
+            self._set_value(bug, location, value)
+
+        add_first_comment(bug, get_assert_or_log(bug, False))
+
+        bug["comments"] = [
+            c
+            for c in bug["comments"]
+            if self._parse_creation_time(c["creation_time"]) <= rollback_date
+        ]
+        bug["attachments"] = [
+            a
+            for a in bug["attachments"]
+            if self._parse_creation_time(a["creation_time"]) <= rollback_date
+        ]
+
+        return bug
+
+
+TIMELINE_CACHE_SIZE = 1024
+timelines = OrderedDict()
+timelines_lock = threading.Lock()
+
+
+def get_timeline(bug):
+    # Some models add the commits linked to the bug, which are then part of the
+    # snapshots.
+    key = (bug["id"], bug.get("last_change_time"), "commits" in bug)
+
+    with timelines_lock:
+        if key in timelines:
+            timelines.move_to_end(key)
+            return timelines[key]
+
+    timeline = BugTimeline(bug)
+
+    with timelines_lock:
+        timelines[key] = timeline
+        if len(timelines) > TIMELINE_CACHE_SIZE:
+            timelines.popitem(last=False)
+
+    return timeline
+
+
+def snapshot_at(bug, when=None):
+    """Return a copy of the bug as it was at the given point of its history.
+
+    Contrary to rollback, the bug is not modified, and its history is replayed
+    only once even when snapshots are requested multiple times (e.g. by
+    different models).
+    """
+    return get_timeline(bug).snapshot_at(when)
+
+
+Inconsistency = namedtuple("Inconsistency", ["bug_id", "field", "reason"])
+
+
+def find_inconsistency(bug):
+    """Return the first inconsistency found in the history of a bug, or None.
+
+    The bug is rolled back to its creation in the process.
+    """
+    assert_or_log = get_assert_or_log(bug, True)
+    last_product = bug["product"]
+
+    field = None
+    try:
+        for change in get_changes(bug):
+            field = change["field_name"]
+            revert_change(bug, change, last_product, assert_or_log)
+
+        field = "comments"
+        add_first_comment(bug, assert_or_log)
+    except Exception as e:
+        return Inconsistency(bug["id"], field, str(e))
+
+    return None
+
+
+INCONSISTENCIES_CHUNK_SIZE = 100
+
+
+def get_chunk_inconsistencies(lines, bug_ids=None):
     inconsistencies = []
 
-    for bug in bugs:
-        try:
-            rollback(bug, do_assert=True)
-        except Exception as e:
-            print(bug["id"])
-            print(e)
-            inconsistencies.append(bug)
+    for line in lines:
+        bug = orjson.loads(line)
+        # Like bugzilla.get_bugs.
+        if bug["product"] == "Invalid Bugs":
+            continue
+
+        if bug_ids is not None and bug["id"] not in bug_ids:
+            continue
+
+        inconsistency = find_inconsistency(bug)
+        if inconsistency is not None:
+            inconsistencies.append(inconsistency)
 
     return inconsistencies
 
 
+def get_inconsistencies(bug_ids=None, processes=None):
+    """Look for inconsistencies in the histories of the bugs in the bugs DB.
+
+    The DB is decompressed once, in this process, which deals chunks of its
+    serialized bugs to the worker processes parsing and checking them. If
+    bug_ids is given, only those bugs are checked.
+    Returns a list of Inconsistency, sorted by bug ID.
+    """
+    if processes is None:
+        processes = os.cpu_count()
+    if bug_ids is not None:
+        bug_ids = set(bug_ids)
+
+    lines = db.read_lines(bugzilla.BUGS_DB)
+    chunks = iter(lambda: list(itertools.islice(lines, INCONSISTENCIES_CHUNK_SIZE)), [])
+
+    inconsistencies = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = set()
+        for chunk in chunks:
+            # Only a few chunks wait for a worker, so the DB is not read in
+            # memory faster than it is checked.
+            if len(pending) >= 2 * processes:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    inconsistencies += future.result()
+
+            pending.add(executor.submit(get_chunk_inconsistencies, chunk, bug_ids))
+
+        for future in concurrent.futures.as_completed(pending):
+            inconsistencies += future.result()
+
+    return sorted(inconsistencies)
+
+
 if __name__ == "__main__":
     import argparse
     from tqdm import tqdm
@@ -2,11 +2,16 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
+import itertools
 import sys
+from array import array
 from collections import defaultdict
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import murmurhash3_32
 
 EXPERIENCE_TIMESPAN = 90
 EXPERIENCE_TIMESPAN_TEXT = f"{EXPERIENCE_TIMESPAN}_days"
@@ -106,53 +111,35 @@ class test_deleted(object):
 
 
 def get_exps(exp_type, commit):
+    """Returns the experience values for exp_type, in the order expected by
+    exp_feature_names: sum, max, min and average of the total experience, of
+    the total backouts, of the recent experience and of the recent backouts.
+    """
     items_key = f"{exp_type}s" if exp_type != "directory" else "directories"
     items_num = len(commit[items_key])
 
-    return {
-        "sum": commit[f"touched_prev_total_{exp_type}_sum"],
-        "max": commit[f"touched_prev_total_{exp_type}_max"],
-        "min": commit[f"touched_prev_total_{exp_type}_min"],
-        "avg": commit[f"touched_prev_total_{exp_type}_sum"] / items_num
-        if items_num > 0
-        else 0,
-        "sum backout": commit[f"touched_prev_total_{exp_type}_backout_sum"],
-        "max backout": commit[f"touched_prev_total_{exp_type}_backout_max"],
-        "min backout": commit[f"touched_prev_total_{exp_type}_backout_min"],
-        "avg backout": commit[f"touched_prev_total_{exp_type}_backout_sum"] / items_num
-        if items_num > 0
-        else 0,
-        f"sum {EXPERIENCE_TIMESPAN_TEXT}": commit[
-            f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}_sum"
-        ],
-        f"max {EXPERIENCE_TIMESPAN_TEXT}": commit[
-            f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}_max"
-        ],
-        f"min {EXPERIENCE_TIMESPAN_TEXT}": commit[
-            f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}_min"
-        ],
-        f"avg {EXPERIENCE_TIMESPAN_TEXT}": commit[
-            f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}_sum"
-        ]
-        / items_num
-        if items_num > 0
-        else 0,
-        f"sum {EXPERIENCE_TIMESPAN_TEXT} backout": commit[
-            f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}_backout_sum"
-        ],
-        f"max {EXPERIENCE_TIMESPAN_TEXT} backout": commit[
-            f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}_backout_max"
-        ],
-        f"min {EXPERIENCE_TIMESPAN_TEXT} backout": commit[
-            f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}_backout_min"
-        ],
-        f"avg {EXPERIENCE_TIMESPAN_TEXT} backout": commit[
-            f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}_backout_sum"
-        ]
-        / items_num
-        if items_num > 0
-        else 0,
-    }
+    exps = []
+    for prefix in (
+        f"touched_prev_total_{exp_type}",
+        f"touched_prev_total_{exp_type}_backout",
+        f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}",
+        f"touched_prev_{EXPERIENCE_TIMESPAN_TEXT}_{exp_type}_backout",
+    ):
+        exp_sum = commit[f"{prefix}_sum"]
+        exps.append(exp_sum)
+        exps.append(commit[f"{prefix}_max"])
+        exps.append(commit[f"{prefix}_min"])
+        exps.append(exp_sum / items_num if items_num > 0 else 0)
+
+    return exps
+
+
+def exp_feature_names(total, backouts, recent_total, recent_backouts):
+    return tuple(
+        f"{aggregation} {description}"
+        for description in (total, backouts, recent_total, recent_backouts)
+        for aggregation in ("Total", "Maximum", "Minimum", "Average")
+    )
 
 
 class author_experience(object):
@@ -173,40 +160,15 @@ class author_experience(object):
 
 
 class reviewer_experience(object):
+    feature_names = exp_feature_names(
+        "reviewer experience",
+        "reviewer backouts",
+        "recent reviewer experience",
+        "recent reviewer backouts",
+    )
+
     def __call__(self, commit, **kwargs):
-        exps = get_exps("reviewer", commit)
-        return {
-            "Total reviewer experience": exps["sum"],
-            "Maximum reviewer experience": exps["max"],
-            "Minimum reviewer experience": exps["min"],
-            "Average reviewer experience": exps["avg"],
-            "Total reviewer backouts": exps["sum backout"],
-            "Maximum reviewer backouts": exps["max backout"],
-            "Minimum reviewer backouts": exps["min backout"],
-            "Average reviewer backouts": exps["avg backout"],
-            "Total recent reviewer experience": exps[f"sum {EXPERIENCE_TIMESPAN_TEXT}"],
-            "Maximum recent reviewer experience": exps[
-                f"max {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Minimum recent reviewer experience": exps[
-                f"min {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Average recent reviewer experience": exps[
-                f"avg {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Total recent reviewer backouts": exps[
-                f"sum {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Maximum recent reviewer backouts": exps[
-                f"max {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Minimum recent reviewer backouts": exps[
-                f"min {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Average recent reviewer backouts": exps[
-                f"avg {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-        }
+        return dict(zip(self.feature_names, get_exps("reviewer", commit)))
 
 
 class reviewers_num(object):
@@ -229,42 +191,15 @@ class components_modified_num(object):
 
 
 class component_touched_prev(object):
+    feature_names = exp_feature_names(
+        "# of times these components have been touched before",
+        "# of backouts in these components",
+        "# of times these components have recently been touched",
+        "# of recent backouts in these components",
+    )
+
     def __call__(self, commit, **kwargs):
-        exps = get_exps("component", commit)
-        return {
-            "Total # of times these components have been touched before": exps["sum"],
-            "Maximum # of times these components have been touched before": exps["max"],
-            "Minimum # of times these components have been touched before": exps["min"],
-            "Average # of times these components have been touched before": exps["avg"],
-            "Total # of backouts in these components": exps["sum backout"],
-            "Maximum # of backouts in these components": exps["max backout"],
-            "Minimum # of backouts in these components": exps["min backout"],
-            "Average # of backouts in these components": exps["avg backout"],
-            "Total # of times these components have recently been touched": exps[
-                f"sum {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Maximum # of times these components have recently been touched": exps[
-                f"max {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Minimum # of times these components have recently been touched": exps[
-                f"min {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Average # of times these components have recently been touched": exps[
-                f"avg {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Total # of recent backouts in these components": exps[
-                f"sum {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Maximum # of recent backouts in these components": exps[
-                f"max {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Minimum # of recent backouts in these components": exps[
-                f"min {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Average # of recent backouts in these components": exps[
-                f"avg {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-        }
+        return dict(zip(self.feature_names, get_exps("component", commit)))
 
 
 class directories(object):
@@ -280,48 +215,15 @@ class directories_modified_num(object):
 
 
 class directory_touched_prev(object):
+    feature_names = exp_feature_names(
+        "# of times these directories have been touched before",
+        "# of backouts in these directories",
+        "# of times these directories have recently been touched",
+        "# of recent backouts in these directories",
+    )
+
     def __call__(self, commit, **kwargs):
-        exps = get_exps("directory", commit)
-        return {
-            "Total # of times these directories have been touched before": exps["sum"],
-            "Maximum # of times these directories have been touched before": exps[
-                "max"
-            ],
-            "Minimum # of times these directories have been touched before": exps[
-                "min"
-            ],
-            "Average # of times these directories have been touched before": exps[
-                "avg"
-            ],
-            "Total # of backouts in these directories": exps["sum backout"],
-            "Maximum # of backouts in these directories": exps["max backout"],
-            "Minimum # of backouts in these directories": exps["min backout"],
-            "Average # of backouts in these directories": exps["avg backout"],
-            "Total # of times these directories have recently been touched": exps[
-                f"sum {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Maximum # of times these directories have recently been touched": exps[
-                f"max {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Minimum # of times these directories have recently been touched": exps[
-                f"min {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Average # of times these directories have recently been touched": exps[
-                f"avg {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Total # of recent backouts in these directories": exps[
-                f"sum {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Maximum # of recent backouts in these directories": exps[
-                f"max {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Minimum # of recent backouts in these directories": exps[
-                f"min {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Average # of recent backouts in these directories": exps[
-                f"avg {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-        }
+        return dict(zip(self.feature_names, get_exps("directory", commit)))
 
 
 class files(object):
@@ -357,42 +259,15 @@ class files(object):
 
 
 class file_touched_prev(object):
+    feature_names = exp_feature_names(
+        "# of times these files have been touched before",
+        "# of backouts in these files",
+        "# of times these files have recently been touched",
+        "# of recent backouts in these files",
+    )
+
     def __call__(self, commit, **kwargs):
-        exps = get_exps("component", commit)
-        return {
-            "Total # of times these files have been touched before": exps["sum"],
-            "Maximum # of times these files have been touched before": exps["max"],
-            "Minimum # of times these files have been touched before": exps["min"],
-            "Average # of times these files have been touched before": exps["avg"],
-            "Total # of backouts in these files": exps["sum backout"],
-            "Maximum # of backouts in these files": exps["max backout"],
-            "Minimum # of backouts in these files": exps["min backout"],
-            "Average # of backouts in these files": exps["avg backout"],
-            "Total # of times these files have recently been touched": exps[
-                f"sum {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Maximum # of times these files have recently been touched": exps[
-                f"max {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Minimum # of times these files have recently been touched": exps[
-                f"min {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Average # of times these files have recently been touched": exps[
-                f"avg {EXPERIENCE_TIMESPAN_TEXT}"
-            ],
-            "Total # of recent backouts in these files": exps[
-                f"sum {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Maximum # of recent backouts in these files": exps[
-                f"max {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Minimum # of recent backouts in these files": exps[
-                f"min {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-            "Average # of recent backouts in these files": exps[
-                f"avg {EXPERIENCE_TIMESPAN_TEXT} backout"
-            ],
-        }
+        return dict(zip(self.feature_names, get_exps("component", commit)))
 
 
 class types(object):
@@ -403,16 +278,17 @@ class types(object):
 
 
 def merge_commits(commits):
+    def union(field):
+        return list(set(itertools.chain.from_iterable(c[field] for c in commits)))
+
     return {
         "nodes": list(commit["node"] for commit in commits),
         "pushdate": commits[0]["pushdate"],
-        "types": list(set(sum((commit["types"] for commit in commits), []))),
-        "files": list(set(sum((commit["files"] for commit in commits), []))),
-        "directories": list(
-            set(sum((commit["directories"] for commit in commits), []))
-        ),
-        "components": list(set(sum((commit["components"] for commit in commits), []))),
-        "reviewers": list(set(sum((commit["reviewers"] for commit in commits), []))),
+        "types": union("types"),
+        "files": union("files"),
+        "directories": union("directories"),
+        "components": union("components"),
+        "reviewers": union("reviewers"),
         "source_code_files_modified_num": sum(
             commit["source_code_files_modified_num"] for commit in commits
         ),
@@ -524,13 +400,235 @@ class CommitExtractor(BaseEstimator, TransformerMixin):
 
             # TODO: Try simply using all possible fields instead of extracting features manually.
 
-            for cleanup_function in self.cleanup_functions:
-                commit["desc"] = cleanup_function(commit["desc"])
-
             result = {"data": data}
             if "desc" in commit:
-                result["desc"] = commit["desc"]
+                desc = commit["desc"]
+                for cleanup_function in self.cleanup_functions:
+                    desc = cleanup_function(desc)
+
+                result["desc"] = desc
 
             results.append(result)
 
         return pd.DataFrame(results)
+
+
+def drop_duplicate_features(matrix):
+    """Keep the last value of the features repeated in a row of a CSR matrix.
+
+    This matches the dict built by CommitExtractor, where a feature extracted
+    twice for a commit (e.g. an item repeated in a list) overwrites the
+    previous value instead of being added to it.
+    """
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    # lexsort is stable, so the last entry of each (row, column) group is the
+    # last value which was added.
+    order = np.lexsort((matrix.indices, rows))
+    rows = rows[order]
+    columns = matrix.indices[order]
+
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+
+    indptr = np.zeros(matrix.shape[0] + 1, dtype=matrix.indptr.dtype)
+    np.cumsum(np.bincount(rows[last], minlength=matrix.shape[0]), out=indptr[1:])
+
+    return sparse.csr_matrix(
+        (matrix.data[order][last], columns[last], indptr), shape=matrix.shape
+    )
+
+
+class CommitMatrixExtractor(BaseEstimator, TransformerMixin):
+    """Extracts commit features straight into a sparse matrix.
+
+    This is equivalent to a CommitExtractor followed by a ColumnTransformer
+    with a DictVectorizer on "data" (and optionally a text vectorizer on
+    "desc"), but the features are written into the CSR buffers as they are
+    extracted, without building a dict per commit, a DataFrame or re-hashing
+    every key in a DictVectorizer.
+
+    If n_features is set, feature names are hashed into a fixed number of
+    columns instead of being looked up in a fitted vocabulary, so the
+    transformer doesn't need to be fitted and never grows. Features hashed
+    into the same column of a commit then keep the last value, like repeated
+    features do.
+    """
+
+    def __init__(
+        self,
+        feature_extractors,
+        cleanup_functions,
+        text_vectorizer=None,
+        n_features=None,
+        sparse_threshold=0.3,
+    ):
+        self.feature_extractors = feature_extractors
+        self.cleanup_functions = cleanup_functions
+        self.text_vectorizer = text_vectorizer
+        self.n_features = n_features
+        self.sparse_threshold = sparse_threshold
+
+    def _get_extractors(self):
+        extractors = []
+        for feature_extractor in self.feature_extractors:
+            if "bug_features" in feature_extractor.__module__:
+                source = "bug"
+            elif "test_scheduling_features" in feature_extractor.__module__:
+                source = "test_job"
+            else:
+                source = None
+
+            if hasattr(feature_extractor, "name"):
+                feature_extractor_name = feature_extractor.name
+            else:
+                feature_extractor_name = feature_extractor.__class__.__name__
+
+            extractors.append((feature_extractor, source, feature_extractor_name))
+
+        return extractors
+
+    def _build_matrix(self, commits, fitting):
+        n_features = self.n_features
+        if fitting or n_features is not None:
+            vocab = {}
+        else:
+            vocab = self.vocabulary_
+        extractors = self._get_extractors()
+        use_text = self.text_vectorizer is not None
+
+        indices = array("i")
+        values = array("d")
+        indptr = array("l", [0])
+        descs = []
+
+        def add(feature_name, value):
+            if n_features is not None:
+                indices.append(murmurhash3_32(feature_name, positive=True) % n_features)
+                values.append(value)
+                return
+
+            index = vocab.get(feature_name)
+            if index is None:
+                if not fitting:
+                    return
+
+                index = vocab[feature_name] = len(vocab)
+
+            indices.append(index)
+            values.append(value)
+
+        for commit in commits():
+            for feature_extractor, source, feature_extractor_name in extractors:
+                if source == "bug":
+                    if not commit["bug"]:
+                        continue
+
+                    res = feature_extractor(commit["bug"])
+                elif source == "test_job":
+                    res = feature_extractor(commit["test_job"])
+                else:
+                    res = feature_extractor(commit)
+
+                if res is None:
+                    continue
+
+                if isinstance(res, dict):
+                    for key, value in res.items():
+                        if isinstance(value, str):
+                            add(f"{key}={value}", 1)
+                        else:
+                            add(key, value)
+                    continue
+
+                if isinstance(res, list):
+                    for item in res:
+                        add(f"{item} in {feature_extractor_name}=True", 1)
+                    continue
+
+                if isinstance(res, (bool, str)):
+                    add(f"{feature_extractor_name}={res}", 1)
+                    continue
+
+                add(feature_extractor_name, res)
+
+            indptr.append(len(indices))
+
+            if use_text:
+                desc = commit["desc"]
+                for cleanup_function in self.cleanup_functions:
+                    desc = cleanup_function(desc)
+
+                descs.append(desc)
+
+        if n_features is not None:
+            n_columns = n_features
+        else:
+            n_columns = len(vocab)
+
+        matrix = sparse.csr_matrix(
+            (
+                np.frombuffer(values, dtype=np.float64),
+                np.frombuffer(indices, dtype=np.intc),
+                np.frombuffer(indptr, dtype=np.int_),
+            ),
+            shape=(len(indptr) - 1, n_columns),
+        )
+
+        if fitting and n_features is None:
+            # Sort the columns by feature name, like DictVectorizer does.
+            self.feature_names_ = sorted(vocab)
+            map_index = np.empty(len(vocab), dtype=np.intc)
+            for new_index, feature_name in enumerate(self.feature_names_):
+                map_index[vocab[feature_name]] = new_index
+                vocab[feature_name] = new_index
+            matrix.indices = map_index[matrix.indices]
+            self.vocabulary_ = vocab
+
+        return drop_duplicate_features(matrix), descs
+
+    def fit(self, x, y=None):
+        self.fit_transform(x)
+        return self
+
+    def fit_extractors(self, x):
+        for feature in self.feature_extractors:
+            if hasattr(feature, "fit"):
+                feature.fit(x())
+
+    def fit_transform(self, x, y=None, fit_extractors=True):
+        if fit_extractors:
+            self.fit_extractors(x)
+
+        matrix, descs = self._build_matrix(x, True)
+        if self.text_vectorizer is not None:
+            matrix = sparse.hstack(
+                [matrix, self.text_vectorizer.fit_transform(descs)]
+            ).tocsr()
+
+        # Like ColumnTransformer, only return a sparse matrix if it is sparse enough.
+        density = matrix.nnz / max(1, matrix.shape[0] * matrix.shape[1])
+        self.sparse_output_ = density < self.sparse_threshold
+
+        return matrix if self.sparse_output_ else matrix.toarray()
+
+    def transform(self, commits):
+        matrix, descs = self._build_matrix(commits, False)
+        if self.text_vectorizer is not None:
+            matrix = sparse.hstack(
+                [matrix, self.text_vectorizer.transform(descs)]
+            ).tocsr()
+
+        return matrix if self.sparse_output_ else matrix.toarray()
+
+    def get_feature_names(self):
+        assert (
+            self.n_features is None
+        ), "Feature names are not available when hashing features"
+
+        feature_names = [f"data__{name}" for name in self.feature_names_]
+        if self.text_vectorizer is not None:
+            feature_names += [
+                f"desc__{name}" for name in self.text_vectorizer.get_feature_names()
+            ]
+
+        return feature_names
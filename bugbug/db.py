@@ -8,6 +8,10 @@ import io
 import logging
 import os
 import pickle
+import queue
+import threading
+import time
+from collections import defaultdict
 from contextlib import contextmanager
 from urllib.parse import urljoin
 
@@ -122,6 +126,28 @@ def last_modified(path):
     return last_modified
 
 
+def get_fingerprint(path):
+    """Return a string identifying the current state of a DB.
+
+    It is based on the DB version, the ETag of the last downloaded artifact
+    and the size and modification time of the DB on disk.
+    """
+    assert path in DATABASES
+
+    etag = None
+    if os.path.exists(f"{path}.zst.etag"):
+        with open(f"{path}.zst.etag", "r") as f:
+            etag = f.read()
+
+    if os.path.exists(path):
+        stat = os.stat(path)
+        size, mtime = stat.st_size, stat.st_mtime_ns
+    else:
+        size, mtime = None, None
+
+    return f"{path}:{DATABASES[path]['version']}:{etag}:{size}:{mtime}"
+
+
 class Store:
     def __init__(self, fh):
         self.fh = fh
@@ -132,8 +158,11 @@ class JSONStore(Store):
         for elem in elems:
             self.fh.write(orjson.dumps(elem) + b"\n")
 
+    def read_lines(self):
+        yield from io.TextIOWrapper(self.fh, encoding="utf-8")
+
     def read(self):
-        for line in io.TextIOWrapper(self.fh, encoding="utf-8"):
+        for line in self.read_lines():
             yield orjson.loads(line)
 
 
@@ -189,9 +218,209 @@ def _db_open(path, mode):
             yield store_constructor(f)
 
 
+class SharedScanConsumer(object):
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(queue_size)
+        self.closed = threading.Event()
+        self.stalled = threading.Event()
+
+    def put(self, elem, timeout):
+        # Stop sending elements to consumers which stopped reading, or which
+        # didn't read anything for too long.
+        deadline = time.monotonic() + timeout
+        while not self.closed.is_set():
+            try:
+                self.queue.put(elem, timeout=0.1)
+                return True
+            except queue.Full:
+                if time.monotonic() > deadline:
+                    self.stalled.set()
+                    return False
+
+        return False
+
+
+class SharedScanError(object):
+    def __init__(self, exception):
+        self.exception = exception
+
+
+SHARED_SCAN_END = object()
+
+shared_scan_local = threading.local()
+
+
+class SharedScan(object):
+    """Run functions in threads, reading each DB only once for all of them.
+
+    When one of the threads reads a DB, it waits until all the other threads are
+    either reading a DB too or done. Then, each DB is read once, and its elements
+    are sent to all the threads reading it. The elements are shared between the
+    threads, so they must not be modified.
+
+    DBs read by a thread while it is reading another one are read directly: the
+    thread would otherwise stop consuming the elements of the first DB while it
+    waits, and block the other threads reading it.
+
+    A thread which doesn't consume the elements of a DB for stall_timeout
+    seconds (e.g. because it left a read unfinished without closing it) stops
+    receiving them, so that it doesn't block the other threads, and gets an
+    error if it reads again. The reads left unfinished by a function are closed
+    when it returns.
+    """
+
+    def __init__(self, queue_size=1000, stall_timeout=600):
+        self.queue_size = queue_size
+        self.stall_timeout = stall_timeout
+        self.condition = threading.Condition()
+        self.running = set()
+        self.waiting = defaultdict(list)
+
+    def run(self, functions):
+        """Run the functions and return their results, in order."""
+        results = [None] * len(functions)
+        for i, result in self.as_completed(functions):
+            results[i] = result
+
+        return results
+
+    def as_completed(self, functions):
+        """Run the functions and yield (index, result) tuples as they complete.
+
+        If some of the functions fail, the first error is raised once all of
+        them are done.
+        """
+        done = queue.Queue()
+
+        def target(i, function):
+            shared_scan_local.scan = self
+            shared_scan_local.consumers = []
+            try:
+                done.put((i, function(), None))
+            except Exception as e:
+                done.put((i, None, e))
+            finally:
+                for consumer in list(shared_scan_local.consumers):
+                    consumer.closed.set()
+
+                with self.condition:
+                    self.running.remove(threading.current_thread())
+                    self.start_scans()
+
+        threads = [
+            threading.Thread(target=target, args=(i, function))
+            for i, function in enumerate(functions)
+        ]
+        # Don't keep the functions (and what they reference) alive once their
+        # threads are done.
+        del functions
+
+        with self.condition:
+            self.running.update(threads)
+
+        for thread in threads:
+            thread.start()
+
+        error = None
+        for _ in range(len(threads)):
+            i, result, e = done.get()
+            if e is not None:
+                error = e if error is None else error
+                continue
+
+            yield i, result
+            del result
+
+        for thread in threads:
+            thread.join()
+
+        if error is not None:
+            raise error
+
+    def start_scans(self):
+        if len(self.running) > 0:
+            return
+
+        for path, consumers in self.waiting.items():
+            for thread, _ in consumers:
+                self.running.add(thread)
+
+            threading.Thread(
+                target=self.scan,
+                args=(path, [consumer for _, consumer in consumers]),
+                daemon=True,
+            ).start()
+
+        self.waiting.clear()
+
+    def scan(self, path, consumers):
+        try:
+            for elem in read(path):
+                consumers = [
+                    consumer
+                    for consumer in consumers
+                    if consumer.put(elem, self.stall_timeout)
+                ]
+                if len(consumers) == 0:
+                    return
+
+            end = SHARED_SCAN_END
+        except Exception as e:
+            end = SharedScanError(e)
+
+        for consumer in consumers:
+            consumer.put(end, self.stall_timeout)
+
+    def is_reading(self):
+        # The thread is reading as long as some of its shared reads are
+        # unfinished, not only until the first of them finishes.
+        return len(getattr(shared_scan_local, "consumers", ())) > 0
+
+    def read(self, path):
+        consumer = SharedScanConsumer(self.queue_size)
+
+        with self.condition:
+            thread = threading.current_thread()
+            self.running.remove(thread)
+            self.waiting[path].append((thread, consumer))
+            self.start_scans()
+
+        # The generator can be closed from another thread, when it is garbage
+        # collected.
+        consumers = shared_scan_local.consumers
+        consumers.append(consumer)
+        try:
+            while True:
+                try:
+                    elem = consumer.queue.get(timeout=0.1)
+                except queue.Empty:
+                    if consumer.stalled.is_set():
+                        raise Exception(
+                            f"Stopped reading {path} for more than {self.stall_timeout} seconds"
+                        )
+
+                    continue
+
+                if elem is SHARED_SCAN_END:
+                    break
+
+                if isinstance(elem, SharedScanError):
+                    raise elem.exception
+
+                yield elem
+        finally:
+            consumers.remove(consumer)
+            consumer.closed.set()
+
+
 def read(path):
     assert path in DATABASES
 
+    scan = getattr(shared_scan_local, "scan", None)
+    if scan is not None and not scan.is_reading():
+        yield from scan.read(path)
+        return
+
     if not os.path.exists(path):
         return ()
 
@@ -200,6 +429,22 @@ def read(path):
             yield elem
 
 
+def read_lines(path):
+    """Read the serialized elements of a JSON DB, without parsing them.
+
+    The DB is decompressed once by the reader, while the elements can be parsed
+    by other processes.
+    """
+    assert path in DATABASES
+
+    if not os.path.exists(path):
+        return ()
+
+    with _db_open(path, "rb") as store:
+        assert isinstance(store, JSONStore), "Only JSON DBs can be read by lines"
+        yield from store.read_lines()
+
+
 def write(path, elems):
     assert path in DATABASES
 
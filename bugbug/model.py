@@ -3,11 +3,17 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
+import inspect
+import itertools
+import os
+import tempfile
 from collections import defaultdict
 
 import matplotlib
 import numpy as np
 import shap
+import xgboost
 from imblearn.metrics import (
     classification_report_imbalanced,
     geometric_mean_score,
@@ -15,16 +21,19 @@ from imblearn.metrics import (
     specificity_score,
 )
 from imblearn.pipeline import make_pipeline
+from scipy import sparse
 from sklearn import metrics
+from sklearn.base import clone
 from sklearn.externals import joblib
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 from sklearn.metrics.classification import precision_recall_fscore_support
 from sklearn.model_selection import cross_validate, train_test_split
 from tabulate import tabulate
 
-from bugbug import bugzilla, repository
+from bugbug import artifact, bugzilla, db, out_of_core, repository
 from bugbug.nlp import SpacyVectorizer
-from bugbug.utils import split_tuple_generator, to_array
+from bugbug.profiler import StageProfiler
+from bugbug.utils import get_config_fingerprint, split_tuple_generator, to_array
 
 
 def classification_report_imbalanced_values(
@@ -122,6 +131,86 @@ def print_labeled_confusion_matrix(confusion_matrix, labels, is_multilabel=False
         )
 
 
+def get_stratified_sample(y, size, random_state=0):
+    """Return the sorted indices of a random sample of at most size elements of
+    y, with the same class proportions.
+    """
+    if size is None or len(y) <= size:
+        return np.arange(len(y))
+
+    rng = np.random.RandomState(random_state)
+
+    # Multilabel targets can't be stratified.
+    if isinstance(y[0], np.ndarray):
+        return np.sort(rng.choice(len(y), size, replace=False))
+
+    _, y_indices = np.unique(y, return_inverse=True)
+    counts = np.bincount(y_indices)
+
+    sample = []
+    for class_index, count in enumerate(counts):
+        class_size = min(count, max(1, int(round(size * count / len(y)))))
+        sample.append(
+            rng.choice(np.flatnonzero(y_indices == class_index), class_size, False)
+        )
+
+    return np.sort(np.concatenate(sample))
+
+
+def get_threshold_predictions(y_pred_probas, threshold, is_binary):
+    """Return the predicted class indices and whether they pass the confidence threshold."""
+    if is_binary:
+        argmax = (y_pred_probas[:, 1] > threshold).astype(int)
+    else:
+        argmax = np.argmax(y_pred_probas, axis=1)
+
+    confidence = y_pred_probas[np.arange(len(y_pred_probas)), argmax]
+    return argmax, confidence >= threshold
+
+
+def get_threshold_curve(y_true, y_pred_probas, thresholds, is_binary, class_names):
+    """Compute the coverage and the precision and recall of each class for a set
+    of confidence thresholds, from the probabilities computed once.
+
+    y_true contains the indices of the actual classes.
+    """
+    curve = {
+        "thresholds": [],
+        "classified": [],
+        "coverage": [],
+        "classes": {
+            class_name: {"precision": [], "recall": []} for class_name in class_names
+        },
+    }
+
+    actual = [y_true == i for i in range(len(class_names))]
+    actual_counts = [a.sum() for a in actual]
+
+    for threshold in thresholds:
+        argmax, classified = get_threshold_predictions(
+            y_pred_probas, threshold, is_binary
+        )
+
+        curve["thresholds"].append(float(threshold))
+        curve["classified"].append(int(classified.sum()))
+        curve["coverage"].append(float(classified.mean()) if len(classified) else 0.0)
+
+        for i, class_name in enumerate(class_names):
+            predicted = classified & (argmax == i)
+            predicted_count = predicted.sum()
+            true_positives = (predicted & actual[i]).sum()
+
+            class_curve = curve["classes"][class_name]
+            class_curve["precision"].append(
+                float(true_positives / predicted_count) if predicted_count else 0.0
+            )
+            class_curve["recall"].append(
+                float(true_positives / actual_counts[i]) if actual_counts[i] else 0.0
+            )
+
+    return curve
+
+
 def sort_class_names(class_names):
     if len(class_names) == 2:
         class_names = sorted(list(class_names), reverse=True)
@@ -139,14 +228,39 @@ class Model:
             self.text_vectorizer = TfidfVectorizer
 
         self.cross_validation_enabled = True
+        # Number of CPUs to use for cross validation (None to use all of them).
+        self.cpu_budget = None
+        # Whether to trace the memory allocated during each training stage.
+        self.trace_memory = False
         self.sampler = None
+        # Whether to split the labels and apply the sampler to the training ones,
+        # before extracting the features, so that the features of the items which
+        # would be dropped by the sampler are not extracted. This is only possible
+        # for samplers which select items without looking at them (e.g.
+        # RandomUnderSampler), and for models whose labels are in the same order
+        # as their items.
+        self.sample_before_extraction = False
 
         self.calculate_importance = True
+        # Number of training examples to use to compute the feature importances
+        # (None to use the whole training set).
+        self.importance_sample_size = 5000
 
         self.store_dataset = False
 
         self.entire_dataset_training = False
 
+        # Out-of-core training extracts features in chunks, spilling them to
+        # disk, and trains with XGBoost's external memory, so that the memory
+        # usage depends on memory_budget (in bytes) and not on the dataset size.
+        self.out_of_core = False
+        self.memory_budget = 4 * 1024 ** 3
+        self.hashing_n_features = 2 ** 20
+
+        # If set, the extracted features are cached in this directory, and
+        # reused as long as the DBs, labels and extraction pipeline don't change.
+        self.feature_cache_dir = None
+
     @property
     def le(self):
         """Classifier agnostic getter for the label encoder property"""
@@ -158,6 +272,60 @@ class Model:
     def get_feature_names(self):
         return []
 
+    def get_shap_values(self, X, batch_size=256):
+        """Compute the SHAP values of the rows of X, one batch at a time.
+
+        The values are only returned for the columns which contribute to some
+        prediction, together with the indices of those columns, so that the
+        result stays small even when X has a lot of (sparse) features. Like
+        shap, a single matrix is returned for binary XGBoost models, a list of
+        matrices (one per class) otherwise.
+        """
+        if isinstance(self.clf, xgboost.XGBModel):
+            # XGBoost computes the same values as shap.TreeExplainer natively,
+            # and without densifying the matrix.
+            booster = self.clf.get_booster()
+
+            def contributions(batch):
+                values = booster.predict(
+                    xgboost.DMatrix(batch, missing=self.clf.missing),
+                    pred_contribs=True,
+                )
+
+                # The last column is the bias.
+                if values.ndim == 2:
+                    return [values[:, :-1]]
+
+                return [values[:, i, :-1] for i in range(values.shape[1])]
+
+        else:
+            explainer = shap.TreeExplainer(self.clf)
+
+            def contributions(batch):
+                values = explainer.shap_values(to_array(batch))
+                return values if isinstance(values, list) else [values]
+
+        batches = [
+            [
+                sparse.csr_matrix(values)
+                for values in contributions(X[start : start + batch_size])
+            ]
+            for start in range(0, X.shape[0], batch_size)
+        ]
+
+        class_values = [
+            sparse.vstack([batch[i] for batch in batches]).tocsr()
+            for i in range(len(batches[0]))
+        ]
+
+        columns = np.unique(np.concatenate([values.indices for values in class_values]))
+
+        shap_values = [values[:, columns].toarray() for values in class_values]
+        if len(shap_values) == 1:
+            shap_values = shap_values[0]
+
+        return shap_values, columns
+
     def get_human_readable_feature_names(self):
         feature_names = self.get_feature_names()
 
@@ -315,119 +483,48 @@ class Model:
     def train_test_split(self, X, y):
         return train_test_split(X, y, test_size=0.1, random_state=0)
 
-    def train(self, importance_cutoff=0.15, limit=None):
-        classes, self.class_names = self.get_labels()
-        self.class_names = sort_class_names(self.class_names)
-
-        # Get items and labels, filtering out those for which we have no labels.
-        X_gen, y = split_tuple_generator(lambda: self.items_gen(classes))
-
-        # Extract features from the items.
-        X = self.extraction_pipeline.fit_transform(X_gen)
-
-        # Calculate labels.
-        y = np.array(y)
-
-        if limit:
-            X = X[:limit]
-            y = y[:limit]
-
-        print(f"X: {X.shape}, y: {y.shape}")
-
-        is_multilabel = isinstance(y[0], np.ndarray)
-        is_binary = len(self.class_names) == 2
-
-        # Split dataset in training and test.
-        X_train, X_test, y_train, y_test = self.train_test_split(X, y)
-        if self.sampler is not None:
-            pipeline = make_pipeline(self.sampler, self.clf)
-        else:
-            pipeline = self.clf
-
-        tracking_metrics = {}
-
-        # Use k-fold cross validation to evaluate results.
-        if self.cross_validation_enabled:
-            scorings = ["accuracy"]
-            if len(self.class_names) == 2:
-                scorings += ["precision", "recall"]
-
-            scores = cross_validate(pipeline, X_train, y_train, scoring=scorings, cv=5)
-
-            print("Cross Validation scores:")
-            for scoring in scorings:
-                score = scores[f"test_{scoring}"]
-                tracking_metrics[f"test_{scoring}"] = {
-                    "mean": score.mean(),
-                    "std": score.std() * 2,
-                }
-                print(
-                    f"{scoring.capitalize()}: f{score.mean()} (+/- {score.std() * 2})"
-                )
-
-        # Training on the resampled dataset if sampler is provided.
-        if self.sampler is not None:
-            X_train, y_train = self.sampler.fit_resample(X_train, y_train)
+    def get_cross_validation_jobs(self, folds):
+        """Split the CPU budget between concurrent folds and threads per fold."""
+        cpu_budget = self.cpu_budget if self.cpu_budget is not None else os.cpu_count()
 
-        print(f"X_train: {X_train.shape}, y_train: {y_train.shape}")
-        print(f"X_test: {X_test.shape}, y_test: {y_test.shape}")
+        fold_jobs = max(1, min(folds, cpu_budget))
+        return fold_jobs, max(1, cpu_budget // fold_jobs)
 
-        self.clf.fit(X_train, y_train)
+    def run_cross_validation(self, pipeline, X, y, scorings, folds=5):
+        fold_jobs, thread_jobs = self.get_cross_validation_jobs(folds)
 
-        print("Model trained")
-
-        feature_names = self.get_human_readable_feature_names()
-        if self.calculate_importance and len(feature_names):
-            explainer = shap.TreeExplainer(self.clf)
-            shap_values = explainer.shap_values(X_train)
-
-            # In the binary case, sometimes shap returns a single shap values matrix.
-            if is_binary and not isinstance(shap_values, list):
-                shap_values = [-shap_values, shap_values]
-                summary_plot_value = shap_values[1]
-                summary_plot_type = "layered_violin"
-            else:
-                summary_plot_value = shap_values
-                summary_plot_type = None
-
-            shap.summary_plot(
-                summary_plot_value,
-                to_array(X_train),
-                feature_names=feature_names,
-                class_names=self.class_names,
-                plot_type=summary_plot_type,
-                show=False,
-            )
-
-            matplotlib.pyplot.savefig("feature_importance.png", bbox_inches="tight")
-            matplotlib.pyplot.xlabel("Impact on model output")
-            matplotlib.pyplot.clf()
-
-            important_features = self.get_important_features(
-                importance_cutoff, shap_values
-            )
+        # Limit the threads used by each fold (e.g. XGBoost's), without
+        # touching the classifier which is trained afterwards.
+        pipeline = clone(pipeline)
+        pipeline.set_params(
+            **{
+                name: thread_jobs
+                for name in pipeline.get_params()
+                if name == "n_jobs" or name.endswith("__n_jobs")
+            }
+        )
 
-            self.print_feature_importances(important_features)
+        print(
+            f"Running {folds} cross validation folds, {fold_jobs} at a time with {thread_jobs} threads each"
+        )
 
-            # Save the important features in the metric report too
-            feature_report = self.save_feature_importances(
-                important_features, feature_names
-            )
+        if fold_jobs == 1:
+            return cross_validate(pipeline, X, y, scoring=scorings, cv=folds)
 
-            tracking_metrics["feature_report"] = feature_report
+        # Store the matrix in a memory-mapped file, so that the workers running
+        # the folds share it instead of receiving a copy each.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            X_path = os.path.join(tmp_dir, "X")
+            joblib.dump(X, X_path)
+            X = joblib.load(X_path, mmap_mode="r")
 
-        print("Training Set scores:")
-        y_pred = self.clf.predict(X_train)
-        if not is_multilabel:
-            print(
-                classification_report_imbalanced(
-                    y_train, y_pred, labels=self.class_names
-                )
+            return cross_validate(
+                pipeline, X, y, scoring=scorings, cv=folds, n_jobs=fold_jobs
             )
 
-        print("Test Set scores:")
-        # Evaluate results on the test set.
-        y_pred = self.clf.predict(X_test)
+    def evaluate(self, y_test, y_pred, y_pred_probas, tracking_metrics):
+        is_multilabel = isinstance(y_test[0], np.ndarray)
+        is_binary = len(self.class_names) == 2
 
         if is_multilabel:
             assert isinstance(
@@ -466,38 +563,24 @@ class Model:
 
         # Evaluate results on the test set for some confidence thresholds.
         for confidence_threshold in confidence_thresholds:
-            y_pred_probas = self.clf.predict_proba(X_test)
             confidence_class_names = self.class_names + ["__NOT_CLASSIFIED__"]
 
-            y_pred_filter = []
-            classified_indices = []
-            for i in range(0, len(y_test)):
-                if not is_binary:
-                    argmax = np.argmax(y_pred_probas[i])
-                else:
-                    argmax = 1 if y_pred_probas[i][1] > confidence_threshold else 0
-
-                if y_pred_probas[i][argmax] < confidence_threshold:
-                    if not is_multilabel:
-                        y_pred_filter.append("__NOT_CLASSIFIED__")
-                    continue
-
-                classified_indices.append(i)
-                if is_multilabel:
-                    y_pred_filter.append(y_pred[i])
-                else:
-                    y_pred_filter.append(argmax)
+            argmax, classified = get_threshold_predictions(
+                y_pred_probas, confidence_threshold, is_binary
+            )
+            classified_indices = np.flatnonzero(classified)
 
-            if not is_multilabel:
-                y_pred_filter = np.array(y_pred_filter)
-                y_pred_filter[classified_indices] = self.le.inverse_transform(
-                    np.array(y_pred_filter[classified_indices], dtype=int)
+            if is_multilabel:
+                y_pred_filter = y_pred[classified_indices]
+            else:
+                y_pred_filter = np.where(
+                    classified,
+                    self.le.inverse_transform(argmax).astype(str),
+                    "__NOT_CLASSIFIED__",
                 )
 
-            classified_num = sum(1 for v in y_pred_filter if v != "__NOT_CLASSIFIED__")
-
             print(
-                f"\nConfidence threshold > {confidence_threshold} - {classified_num} classified"
+                f"\nConfidence threshold > {confidence_threshold} - {len(classified_indices)} classified"
             )
             if is_multilabel:
                 confusion_matrix = metrics.multilabel_confusion_matrix(
@@ -505,14 +588,12 @@ class Model:
                 )
             else:
                 confusion_matrix = metrics.confusion_matrix(
-                    y_test.astype(str),
-                    y_pred_filter.astype(str),
-                    labels=confidence_class_names,
+                    y_test.astype(str), y_pred_filter, labels=confidence_class_names,
                 )
                 print(
                     classification_report_imbalanced(
                         y_test.astype(str),
-                        y_pred_filter.astype(str),
+                        y_pred_filter,
                         labels=confidence_class_names,
                     )
                 )
@@ -520,29 +601,532 @@ class Model:
                 confusion_matrix, confidence_class_names, is_multilabel=is_multilabel
             )
 
-        if self.entire_dataset_training:
-            print("Retraining on the entire dataset...")
+        if not is_multilabel:
+            tracking_metrics["threshold_curve"] = get_threshold_curve(
+                self.le.transform(y_test),
+                y_pred_probas,
+                np.linspace(0, 1, 101),
+                is_binary,
+                [str(class_name) for class_name in self.le.classes_],
+            )
+
+    def make_hashing_pipeline(self):
+        for _, step in self.extraction_pipeline.steps:
+            params = step.get_params(deep=False)
+            assert (
+                "n_features" in params
+            ), f"{step.__class__.__name__} can't extract features in chunks"
+
+            if params["n_features"] is None:
+                step.set_params(n_features=self.hashing_n_features)
+
+            text_vectorizer = params.get("text_vectorizer")
+            if text_vectorizer is not None and not isinstance(
+                text_vectorizer, HashingVectorizer
+            ):
+                step.set_params(
+                    text_vectorizer=HashingVectorizer(
+                        n_features=self.hashing_n_features, alternate_sign=False
+                    )
+                )
+
+    def train_out_of_core(self, limit=None):
+        profiler = StageProfiler(self.trace_memory)
+
+        with profiler.stage("get_labels"):
+            classes = self.get_training_labels()
+
+        self.make_hashing_pipeline()
+
+        # The hashed features can't be mapped back to their names.
+        self.calculate_importance = False
+
+        # The XGBClassifier only holds the parameters of the boosters, which are
+        # trained directly on the files.
+        clf = self.clf
+
+        tracking_metrics = {}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with profiler.stage("extraction"):
+                chunks = out_of_core.ChunkStore(tmp_dir)
+                y = []
+
+                # The extractors which learn something from the items (e.g. the
+                # most common files) need to see all of them, they are fit before
+                # the features are extracted one chunk at a time.
+                for _, step in self.extraction_pipeline.steps:
+                    step.fit_extractors(
+                        lambda: (
+                            item for item, _ in self.get_training_items(classes, limit)
+                        )
+                    )
+
+                items = self.get_training_items(classes, limit)
+
+                # Extract features from the items, one chunk at a time. The size of
+                # the chunks is derived from the memory budget, using the size of
+                # the first chunk.
+                chunk_size = out_of_core.INITIAL_CHUNK_SIZE
+                while True:
+                    chunk = list(itertools.islice(items, chunk_size))
+                    if len(chunk) == 0:
+                        break
+
+                    chunk_items, chunk_labels = zip(*chunk)
+                    del chunk
+
+                    # Besides the extractors, the hashing pipeline has nothing to
+                    # learn, it is fit on the first chunk only.
+                    if len(chunks) == 0:
+                        X_chunk = self.extraction_pipeline.fit_transform(
+                            lambda: chunk_items,
+                            **{
+                                f"{name}__fit_extractors": False
+                                for name, _ in self.extraction_pipeline.steps
+                            },
+                        )
+                    else:
+                        X_chunk = self.extraction_pipeline.transform(
+                            lambda: chunk_items
+                        )
+
+                    chunks.append(X_chunk)
+                    y += chunk_labels
+
+                    chunk_size = out_of_core.get_chunk_size(X_chunk, self.memory_budget)
+
+            y = np.array(y)
+
+            assert not isinstance(
+                y[0], np.ndarray
+            ), "Multilabel models can't be trained out-of-core"
+
+            print(f"X: ({chunks.rows}, {X_chunk.shape[1]}) in {len(chunks)} chunks")
+            print(f"y: {y.shape}")
+
+            classes = np.unique(y)
+            y_indices = np.searchsorted(classes, y)
+
+            # Split dataset in training and test, using the model's own split on
+            # the row indices.
+            indices = np.arange(len(y))
+            train_indices, test_indices, _, _ = self.train_test_split(indices, indices)
+            is_train = np.zeros(len(y), dtype=bool)
+            is_train[train_indices] = True
+            is_test = ~is_train
+
+            with profiler.stage("sampling"):
+                is_train = self.undersample(is_train, y_indices)
+                if self.entire_dataset_training:
+                    is_entire = self.undersample(np.ones(len(y), dtype=bool), y_indices)
+
+                train_path = os.path.join(tmp_dir, "train.libsvm")
+                entire_path = os.path.join(tmp_dir, "entire.libsvm")
+                start = 0
+                for X_chunk in chunks:
+                    end = start + X_chunk.shape[0]
+                    mask = is_train[start:end]
+                    out_of_core.dump_libsvm(
+                        train_path, X_chunk[mask], y_indices[start:end][mask]
+                    )
+
+                    if self.entire_dataset_training:
+                        mask = is_entire[start:end]
+                        out_of_core.dump_libsvm(
+                            entire_path, X_chunk[mask], y_indices[start:end][mask]
+                        )
+
+                    start = end
+
+            print(f"X_train: {is_train.sum()}, X_test: {is_test.sum()}")
+
+            with profiler.stage("fit"):
+                self.clf = out_of_core.fit_external_memory(
+                    clf, train_path, classes, os.path.join(tmp_dir, "train.cache")
+                )
 
-            if self.sampler is not None:
-                X_train, y_train = self.sampler.fit_resample(X, y)
+            print("Model trained")
+
+            with profiler.stage("evaluation"):
+                print("Test Set scores:")
+                # Evaluate results on the test set, one chunk at a time.
+                y_pred_probas = np.concatenate(
+                    [
+                        self.clf.predict_proba(X_test_chunk)
+                        for X_test_chunk in chunks.iter_rows(is_test)
+                        if X_test_chunk.shape[0] > 0
+                    ]
+                )
+                y_pred = classes[np.argmax(y_pred_probas, axis=1)]
+
+                self.evaluate(y[is_test], y_pred, y_pred_probas, tracking_metrics)
+
+            if self.entire_dataset_training:
+                with profiler.stage("entire_dataset_fit"):
+                    print("Retraining on the entire dataset...")
+
+                    print(f"X_train: {is_entire.sum()}")
+
+                    self.clf = out_of_core.fit_external_memory(
+                        clf, entire_path, classes, os.path.join(tmp_dir, "entire.cache")
+                    )
+
+        with profiler.stage("dump"):
+            artifact.dump(self, self.__class__.__name__.lower())
+
+        tracking_metrics["stages"] = profiler.stages
+
+        return tracking_metrics
+
+    def get_training_labels(self):
+        classes, self.class_names = self.get_labels()
+        self.class_names = sort_class_names(self.class_names)
+
+        return classes
+
+    def split_labels(self, classes):
+        """Split the labelled items in training and test, as train_test_split
+        would split the rows of their features.
+
+        The items are kept in the order of the split, so that the sampler selects
+        the same training items as it would from their features.
+        """
+        keys = list(classes)
+
+        indices = np.arange(len(keys))
+        train_indices, test_indices, _, _ = self.train_test_split(indices, indices)
+
+        return (
+            {keys[i]: classes[keys[i]] for i in train_indices},
+            {keys[i]: classes[keys[i]] for i in test_indices},
+        )
+
+    def sample_labels(self, classes):
+        """Restrict the labelled items to those selected by the sampler.
+
+        The sampler only looks at the labels, so it selects the same items (for
+        the same random_state) as it would from the features of all of them.
+        """
+        keys = list(classes)
+        labels = [classes[key] for key in keys]
+
+        sampler = clone(self.sampler)
+        sampler.fit_resample(np.arange(len(keys)).reshape(-1, 1), labels)
+
+        # Keep the original order, as some models split the dataset by time.
+        selected = np.sort(sampler.sample_indices_)
+
+        print(f"Sampled {len(selected)} out of {len(keys)} labelled items")
+
+        return {keys[i]: labels[i] for i in selected}
+
+    def get_training_items(self, classes, limit=None, test_classes=None):
+        """Generate the training items, with their labels.
+
+        When test_classes is given, the items of classes come first and then
+        those of test_classes, their labels tagged with whether they are
+        training items.
+        """
+        if test_classes is None:
+            items = self.items_gen(classes)
+        else:
+            items = itertools.chain(
+                ((item, (label, True)) for item, label in self.items_gen(classes)),
+                (
+                    (item, (label, False))
+                    for item, label in self.items_gen(test_classes)
+                ),
+            )
+
+        if limit:
+            items = itertools.islice(items, limit)
+
+        return items
+
+    def undersample(self, mask, y_indices):
+        """Restrict a mask of rows to a random undersampling of the majority classes.
+
+        This is the out-of-core counterpart of the sampler, which needs the
+        whole matrix in memory.
+        """
+        if self.sampler is None:
+            return mask
+
+        random_state = getattr(self.sampler, "random_state", None)
+        rng = np.random.RandomState(random_state if random_state is not None else 0)
+
+        counts = np.bincount(y_indices[mask])
+        min_count = counts[counts > 0].min()
+
+        sampled = np.zeros(len(mask), dtype=bool)
+        for class_index in np.flatnonzero(counts):
+            rows = np.flatnonzero(mask & (y_indices == class_index))
+            sampled[rng.choice(rows, min_count, replace=False)] = True
+
+        return sampled
+
+    def get_feature_cache_path(self, classes, limit=None, test_classes=None):
+        key = hashlib.sha256()
+
+        key.update(repr(limit).encode("utf-8"))
+
+        for path in sorted(getattr(self, "required_dbs", [])):
+            key.update(db.get_fingerprint(path).encode("utf-8"))
+
+        for item in classes.items():
+            key.update(repr(item).encode("utf-8"))
+
+        if test_classes is not None:
+            key.update(b"test")
+            for item in test_classes.items():
+                key.update(repr(item).encode("utf-8"))
+
+        # The fingerprint has to be computed before fitting the pipeline.
+        key.update(get_config_fingerprint(self.extraction_pipeline).encode("utf-8"))
+
+        # The items and their labels are defined by the code of the model and
+        # of its base classes (e.g. items_gen and get_labels).
+        key.update(get_config_fingerprint(type(self).__mro__).encode("utf-8"))
+
+        return os.path.join(
+            self.feature_cache_dir,
+            f"{self.__class__.__name__.lower()}_{key.hexdigest()}",
+        )
+
+    def save_feature_cache(self, cache_path, X, y, train_size):
+        os.makedirs(self.feature_cache_dir, exist_ok=True)
+
+        # Only keep the latest features for a given model.
+        prefix = f"{self.__class__.__name__.lower()}_"
+        for file_name in os.listdir(self.feature_cache_dir):
+            if file_name.startswith(prefix):
+                os.remove(os.path.join(self.feature_cache_dir, file_name))
+
+        joblib.dump((X, y, train_size, self.extraction_pipeline), cache_path)
+
+    def rebind_extraction_pipeline(self):
+        # Methods of the model used by the cached pipeline (e.g. rollback_when)
+        # are bound to the model which was pickled with it, bind them to this one.
+        for _, step in self.extraction_pipeline.steps:
+            for name, value in step.get_params(deep=False).items():
+                if inspect.ismethod(value) and isinstance(value.__self__, Model):
+                    step.set_params(**{name: getattr(self, value.__name__)})
+
+    def extract_features(self, profiler, limit=None):
+        """Get the labels and extract the features of the training items.
+
+        Only the features of the first limit items are extracted. Return the
+        features, the labels and the size of the training set when it was split
+        and sampled before the extraction (None otherwise): the first rows are
+        then the sampled training set, and the others the test set.
+        """
+        with profiler.stage("get_labels"):
+            classes = self.get_training_labels()
+
+        test_classes = None
+        if self.sampler is not None and self.sample_before_extraction:
+            with profiler.stage("sampling"):
+                classes, test_classes = self.split_labels(classes)
+                classes = self.sample_labels(classes)
+
+        with profiler.stage("extraction"):
+            cache_path = None
+            if self.feature_cache_dir is not None:
+                cache_path = self.get_feature_cache_path(classes, limit, test_classes)
+
+            if cache_path is not None and os.path.exists(cache_path):
+                print(f"Loading features from {cache_path}")
+                X, y, train_size, self.extraction_pipeline = joblib.load(cache_path)
+                self.rebind_extraction_pipeline()
             else:
-                X_train = X
-                y_train = y
+                # Get items and labels, filtering out those for which we have no labels.
+                X_gen, y = split_tuple_generator(
+                    lambda: self.get_training_items(classes, limit, test_classes)
+                )
+
+                # Extract features from the items.
+                X = self.extraction_pipeline.fit_transform(X_gen)
+
+                # Calculate labels.
+                train_size = None
+                if test_classes is not None:
+                    train_size = sum(is_train for _, is_train in y)
+                    y = [label for label, _ in y]
+                y = np.array(y)
+
+                if cache_path is not None:
+                    self.save_feature_cache(cache_path, X, y, train_size)
+
+        return X, y, train_size
+
+    def train(self, importance_cutoff=0.15, limit=None, features=None):
+        """Train the model.
 
-            print(f"X_train: {X_train.shape}, y_train: {y_train.shape}")
+        features can be the tuple returned by a previous call to extract_features
+        (with the same limit), to skip the extraction.
+        """
+        if self.out_of_core:
+            return self.train_out_of_core(limit)
+
+        profiler = StageProfiler(self.trace_memory)
+
+        if features is None:
+            X, y, train_size = self.extract_features(profiler, limit)
+        else:
+            X, y, train_size = features
+
+        print(f"X: {X.shape}, y: {y.shape}")
+
+        is_multilabel = isinstance(y[0], np.ndarray)
+        is_binary = len(self.class_names) == 2
+
+        # Split dataset in training and test, unless it was split (and the
+        # training set sampled) before the extraction.
+        if train_size is None:
+            X_train, X_test, y_train, y_test = self.train_test_split(X, y)
+        else:
+            X_train, X_test = X[:train_size], X[train_size:]
+            y_train, y_test = y[:train_size], y[train_size:]
+        if self.sampler is not None:
+            pipeline = make_pipeline(self.sampler, self.clf)
+        else:
+            pipeline = self.clf
+
+        tracking_metrics = {}
 
+        # Use k-fold cross validation to evaluate results.
+        if self.cross_validation_enabled:
+            with profiler.stage("cross_validation"):
+                scorings = ["accuracy"]
+                if len(self.class_names) == 2:
+                    scorings += ["precision", "recall"]
+
+                # When the training set was sampled before the extraction, the
+                # validation folds are sampled too.
+                scores = self.run_cross_validation(pipeline, X_train, y_train, scorings)
+
+                print("Cross Validation scores:")
+                for scoring in scorings:
+                    score = scores[f"test_{scoring}"]
+                    tracking_metrics[f"test_{scoring}"] = {
+                        "mean": score.mean(),
+                        "std": score.std() * 2,
+                    }
+                    print(
+                        f"{scoring.capitalize()}: f{score.mean()} (+/- {score.std() * 2})"
+                    )
+
+        # Training on the resampled dataset if sampler is provided.
+        if self.sampler is not None and train_size is None:
+            with profiler.stage("sampling"):
+                X_train, y_train = self.sampler.fit_resample(X_train, y_train)
+
+        print(f"X_train: {X_train.shape}, y_train: {y_train.shape}")
+        print(f"X_test: {X_test.shape}, y_test: {y_test.shape}")
+
+        with profiler.stage("fit"):
             self.clf.fit(X_train, y_train)
 
-        joblib.dump(self, self.__class__.__name__.lower())
-        if self.store_dataset:
-            joblib.dump(X, f"{self.__class__.__name__.lower()}_data_X")
-            joblib.dump(y, f"{self.__class__.__name__.lower()}_data_y")
+        print("Model trained")
+
+        feature_names = self.get_human_readable_feature_names()
+        if self.calculate_importance and len(feature_names):
+            with profiler.stage("importance"):
+                X_sample = X_train[
+                    get_stratified_sample(y_train, self.importance_sample_size)
+                ]
+                shap_values, columns = self.get_shap_values(X_sample)
+
+                # In the binary case, sometimes shap returns a single shap values matrix.
+                if is_binary and not isinstance(shap_values, list):
+                    shap_values = [-shap_values, shap_values]
+                    summary_plot_value = shap_values[1]
+                    summary_plot_type = "layered_violin"
+                else:
+                    summary_plot_value = shap_values
+                    summary_plot_type = None
+
+                shap.summary_plot(
+                    summary_plot_value,
+                    to_array(X_sample[:, columns]),
+                    feature_names=[feature_names[i] for i in columns],
+                    class_names=self.class_names,
+                    plot_type=summary_plot_type,
+                    show=False,
+                )
+
+                matplotlib.pyplot.savefig("feature_importance.png", bbox_inches="tight")
+                matplotlib.pyplot.xlabel("Impact on model output")
+                matplotlib.pyplot.clf()
+
+                important_features = self.get_important_features(
+                    importance_cutoff, shap_values
+                )
+
+                # Map the indices of the top features back to the whole feature set.
+                top_features = [important_features["average"]] + [
+                    top_item_features
+                    for top_item_features, _ in important_features["classes"].values()
+                ]
+                for top in top_features:
+                    top[:, 1] = columns[top[:, 1].astype(int)]
+
+                self.print_feature_importances(important_features)
+
+                # Save the important features in the metric report too
+                feature_report = self.save_feature_importances(
+                    important_features, feature_names
+                )
+
+                tracking_metrics["feature_report"] = feature_report
+
+        with profiler.stage("evaluation"):
+            print("Training Set scores:")
+            y_pred = self.clf.predict(X_train)
+            if not is_multilabel:
+                print(
+                    classification_report_imbalanced(
+                        y_train, y_pred, labels=self.class_names
+                    )
+                )
+
+            print("Test Set scores:")
+            # Evaluate results on the test set.
+            y_pred = self.clf.predict(X_test)
+            y_pred_probas = self.clf.predict_proba(X_test)
+
+            self.evaluate(y_test, y_pred, y_pred_probas, tracking_metrics)
+
+        if self.entire_dataset_training:
+            with profiler.stage("entire_dataset_fit"):
+                print("Retraining on the entire dataset...")
+
+                # The training items dropped by the sampler before the extraction
+                # are missing from the entire dataset.
+                if self.sampler is not None:
+                    X_train, y_train = self.sampler.fit_resample(X, y)
+                else:
+                    X_train = X
+                    y_train = y
+
+                print(f"X_train: {X_train.shape}, y_train: {y_train.shape}")
+
+                self.clf.fit(X_train, y_train)
+
+        with profiler.stage("dump"):
+            artifact.dump(self, self.__class__.__name__.lower())
+            if self.store_dataset:
+                joblib.dump(X, f"{self.__class__.__name__.lower()}_data_X")
+                joblib.dump(y, f"{self.__class__.__name__.lower()}_data_y")
+
+        tracking_metrics["stages"] = profiler.stages
 
         return tracking_metrics
 
     @staticmethod
     def load(model_file_name):
-        return joblib.load(model_file_name)
+        return artifact.load(model_file_name)
 
     def overwrite_classes(self, items, classes, probabilities):
         return classes
@@ -565,6 +1149,10 @@ class Model:
 
         assert isinstance(items[0], dict) or isinstance(items[0], tuple)
 
+        assert (
+            not importances or self.calculate_importance
+        ), "Feature importances are not available for this model"
+
         X = self.extraction_pipeline.transform(lambda: items)
         if probabilities:
             classes = self.clf.predict_proba(X)
@@ -616,6 +1204,20 @@ class Model:
 
         return classes
 
+    def classify_iter(self, items, batch_size=1000, probabilities=False):
+        """Classify the items of an iterable, batch_size items at a time.
+
+        Yields (item, prediction) tuples, in the same order as the items.
+        """
+        items = iter(items)
+
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if len(batch) == 0:
+                return
+
+            yield from zip(batch, self.classify(batch, probabilities=probabilities))
+
     def check(self):
         """ Subclasses can implement their own check, the base model doesn't
         check anything at the moment
@@ -659,10 +1261,8 @@ class BugModel(Model):
                 continue
 
             if self.commit_data:
-                if bug_id in commit_map:
-                    bug["commits"] = commit_map[bug_id]
-                else:
-                    bug["commits"] = []
+                # Don't modify the bug, as it could be shared with other models.
+                bug = dict(bug, commits=commit_map.get(bug_id, []))
 
             yield bug, classes[bug_id]
 
@@ -700,10 +1300,8 @@ class CommitModel(Model):
                 continue
 
             if self.bug_data:
-                if commit["bug_id"] in bug_map:
-                    commit["bug"] = bug_map[commit["bug_id"]]
-                else:
-                    commit["bug"] = {}
+                # Don't modify the commit, as it could be shared with other models.
+                commit = dict(commit, bug=bug_map.get(commit["bug_id"], {}))
 
             yield commit, classes[commit["node"]]
 
@@ -9,8 +9,6 @@ import dateutil.parser
 import xgboost
 from dateutil.relativedelta import relativedelta
 from imblearn.under_sampling import RandomUnderSampler
-from sklearn.compose import ColumnTransformer
-from sklearn.feature_extraction import DictVectorizer
 from sklearn.pipeline import Pipeline
 
 from bugbug import bug_features, commit_features, feature_cleanup, repository
@@ -74,17 +72,8 @@ class BackoutModel(CommitModel):
             [
                 (
                     "commit_extractor",
-                    commit_features.CommitExtractor(
-                        feature_extractors, cleanup_functions
-                    ),
-                ),
-                (
-                    "union",
-                    ColumnTransformer(
-                        [
-                            ("data", DictVectorizer(), "data"),
-                            ("desc", self.text_vectorizer(), "desc"),
-                        ]
+                    commit_features.CommitMatrixExtractor(
+                        feature_extractors, cleanup_functions, self.text_vectorizer()
                     ),
                 ),
             ]
@@ -121,4 +110,6 @@ class BackoutModel(CommitModel):
         return classes, [0, 1]
 
     def get_feature_names(self):
-        return self.extraction_pipeline.named_steps["union"].get_feature_names()
+        return self.extraction_pipeline.named_steps[
+            "commit_extractor"
+        ].get_feature_names()
@@ -9,8 +9,6 @@ import dateutil.parser
 import xgboost
 from dateutil.relativedelta import relativedelta
 from imblearn.under_sampling import RandomUnderSampler
-from sklearn.compose import ColumnTransformer
-from sklearn.feature_extraction import DictVectorizer
 from sklearn.pipeline import Pipeline
 
 from bugbug import commit_features, db, feature_cleanup, repository
@@ -39,6 +37,7 @@ class RegressorModel(CommitModel):
 
         self.store_dataset = True
         self.sampler = RandomUnderSampler(random_state=0)
+        self.sample_before_extraction = True
 
         feature_extractors = [
             commit_features.source_code_file_size(),
@@ -73,22 +72,19 @@ class RegressorModel(CommitModel):
             feature_cleanup.synonyms(),
         ]
 
-        column_transformers = [("data", DictVectorizer(), "data")]
-
         if not interpretable:
-            column_transformers.append(
-                ("desc", self.text_vectorizer(min_df=0.0001), "desc")
-            )
+            text_vectorizer = self.text_vectorizer(min_df=0.0001)
+        else:
+            text_vectorizer = None
 
         self.extraction_pipeline = Pipeline(
             [
                 (
                     "commit_extractor",
-                    commit_features.CommitExtractor(
-                        feature_extractors, cleanup_functions
+                    commit_features.CommitMatrixExtractor(
+                        feature_extractors, cleanup_functions, text_vectorizer
                     ),
                 ),
-                ("union", ColumnTransformer(column_transformers)),
             ]
         )
 
@@ -139,4 +135,6 @@ class RegressorModel(CommitModel):
         return classes, [0, 1]
 
     def get_feature_names(self):
-        return self.extraction_pipeline.named_steps["union"].get_feature_names()
+        return self.extraction_pipeline.named_steps[
+            "commit_extractor"
+        ].get_feature_names()
@@ -9,7 +9,7 @@ from sklearn.compose import ColumnTransformer
 from sklearn.feature_extraction import DictVectorizer
 from sklearn.pipeline import Pipeline
 
-from bugbug import commit_features, repository, test_scheduling
+from bugbug import commit_features, test_scheduling
 from bugbug.model import CommitModel
 
 
@@ -18,6 +18,7 @@ class TestFailureModel(CommitModel):
         CommitModel.__init__(self, lemmatization)
 
         self.required_dbs.append(test_scheduling.TEST_SCHEDULING_DB)
+        self.required_dbs.append(test_scheduling.PUSH_COMMITS_DB)
 
         self.sampler = RandomUnderSampler(random_state=0)
 
@@ -62,12 +63,7 @@ class TestFailureModel(CommitModel):
         self.clf.set_params(predictor="cpu_predictor")
 
     def items_gen(self, classes):
-        commit_map = {}
-
-        for commit in repository.get_commits():
-            commit_map[commit["node"]] = commit
-
-        assert len(commit_map) > 0
+        push_commits = test_scheduling.PushCommits()
 
         done = set()
         for test_data in test_scheduling.get_test_scheduling_history():
@@ -81,13 +77,10 @@ class TestFailureModel(CommitModel):
 
             done.add(revs[0])
 
-            commits = tuple(
-                commit_map[revision] for revision in revs if revision in commit_map
-            )
-            if len(commits) == 0:
+            commit_data = push_commits.get(revs)
+            if commit_data is None:
                 continue
 
-            commit_data = commit_features.merge_commits(commits)
             yield commit_data, classes[revs[0]]
 
     def get_labels(self):
@@ -7,8 +7,6 @@ import math
 
 import xgboost
 from imblearn.under_sampling import RandomUnderSampler
-from sklearn.compose import ColumnTransformer
-from sklearn.feature_extraction import DictVectorizer
 from sklearn.pipeline import Pipeline
 
 from bugbug import (
@@ -24,13 +22,18 @@ class TestSelectModel(Model):
     def __init__(self, lemmatization=False):
         Model.__init__(self, lemmatization)
 
-        self.required_dbs = [repository.COMMITS_DB, test_scheduling.TEST_SCHEDULING_DB]
+        self.required_dbs = [
+            repository.COMMITS_DB,
+            test_scheduling.TEST_SCHEDULING_DB,
+            test_scheduling.PUSH_COMMITS_DB,
+        ]
 
         self.cross_validation_enabled = False
 
         self.entire_dataset_training = True
 
         self.sampler = RandomUnderSampler(random_state=0)
+        self.sample_before_extraction = True
 
         feature_extractors = [
             commit_features.source_code_files_modified_num(),
@@ -56,9 +59,8 @@ class TestSelectModel(Model):
             [
                 (
                     "commit_extractor",
-                    commit_features.CommitExtractor(feature_extractors, []),
+                    commit_features.CommitMatrixExtractor(feature_extractors, []),
                 ),
-                ("union", ColumnTransformer([("data", DictVectorizer(), "data")])),
             ]
         )
 
@@ -72,12 +74,7 @@ class TestSelectModel(Model):
         return X[:train_len], X[train_len:], y[:train_len], y[train_len:]
 
     def items_gen(self, classes):
-        commit_map = {}
-
-        for commit in repository.get_commits():
-            commit_map[commit["node"]] = commit
-
-        assert len(commit_map) > 0
+        push_commits = test_scheduling.PushCommits()
 
         for test_data in test_scheduling.get_test_scheduling_history():
             revs = test_data["revs"]
@@ -86,15 +83,12 @@ class TestSelectModel(Model):
             if (revs[0], name) not in classes:
                 continue
 
-            commits = tuple(
-                commit_map[revision]
-                for revision in test_data["revs"]
-                if revision in commit_map
-            )
-            if len(commits) == 0:
+            merged_commits = push_commits.get(revs)
+            if merged_commits is None:
                 continue
 
-            commit_data = commit_features.merge_commits(commits)
+            # The merged commits are shared by all the tasks of the push.
+            commit_data = dict(merged_commits)
             commit_data["test_job"] = test_data
             yield commit_data, classes[(revs[0], name)]
 
@@ -127,4 +121,6 @@ class TestSelectModel(Model):
         return classes, [0, 1]
 
     def get_feature_names(self):
-        return self.extraction_pipeline.named_steps["union"].get_feature_names()
+        return self.extraction_pipeline.named_steps[
+            "commit_extractor"
+        ].get_feature_names()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+import numpy as np
+import xgboost
+from scipy import sparse
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.datasets import dump_svmlight_file
+from sklearn.preprocessing import LabelEncoder
+
+INITIAL_CHUNK_SIZE = 1000
+
+
+class ChunkStore(object):
+    """Feature matrix spilled to disk, one sparse chunk at a time."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = []
+        self.rows = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def append(self, X):
+        path = os.path.join(self.directory, f"chunk_{len(self.paths)}.npz")
+        sparse.save_npz(path, sparse.csr_matrix(X))
+        self.paths.append(path)
+        self.rows += X.shape[0]
+
+    def __iter__(self):
+        for path in self.paths:
+            yield sparse.load_npz(path)
+
+    def iter_rows(self, mask):
+        """Yield the rows selected by a boolean mask over the whole matrix, chunk by chunk."""
+        start = 0
+        for X in self:
+            end = start + X.shape[0]
+            yield X[mask[start:end]]
+            start = end
+
+
+def get_chunk_size(X, memory_budget, budget_fraction=0.125):
+    """Number of rows which can be held in memory in a fraction of the budget,
+    estimated from the size of an already extracted chunk.
+    """
+    if sparse.issparse(X):
+        size = X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    else:
+        size = X.nbytes
+
+    bytes_per_row = max(1, size / max(1, X.shape[0]))
+    return max(1, int(memory_budget * budget_fraction / bytes_per_row))
+
+
+def dump_libsvm(path, X, y):
+    with open(path, "ab") as f:
+        dump_svmlight_file(X, y, f, zero_based=True)
+
+
+class BoosterClassifier(BaseEstimator, ClassifierMixin):
+    """Classifier predicting with a booster trained by fit_external_memory.
+
+    It has the subset of the XGBClassifier interface the models use to classify
+    items and evaluate them.
+    """
+
+    def __init__(self, booster, classes, missing=None):
+        self.booster = booster
+        self.classes = classes
+        self.missing = missing
+
+    @property
+    def classes_(self):
+        return np.asarray(self.classes)
+
+    @property
+    def le_(self):
+        return LabelEncoder().fit(self.classes_)
+
+    def predict_proba(self, X):
+        probas = self.booster.predict(xgboost.DMatrix(X, missing=self.missing))
+
+        # Binary models only predict the probability of the positive class.
+        if probas.ndim == 1:
+            return np.vstack((1 - probas, probas)).transpose()
+
+        return probas
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def fit_external_memory(clf, path, classes, cache_prefix):
+    """Train a booster with the parameters of a XGBClassifier on a libsvm file,
+    using XGBoost's external memory.
+
+    The labels in the file must be the indices of the classes. Returns a
+    BoosterClassifier, clf is left untouched.
+    """
+    xgb_options = clf.get_xgb_params()
+    if len(classes) > 2:
+        xgb_options["objective"] = "multi:softprob"
+        xgb_options["num_class"] = len(classes)
+
+    train_dmatrix = xgboost.DMatrix(f"{path}#{cache_prefix}")
+    booster = xgboost.train(xgb_options, train_dmatrix, clf.get_num_boosting_rounds())
+
+    # The matrix read from the file only knows about the columns it contains,
+    # let the booster take the feature names from the matrices to predict.
+    booster.feature_names = None
+    booster.feature_types = None
+
+    return BoosterClassifier(booster, classes, clf.missing)
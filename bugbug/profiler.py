@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+def get_max_rss():
+    """Peak resident set size of the current process since it started, in MB."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere.
+    if sys.platform == "darwin":
+        max_rss /= 1024
+    return max_rss / 1024
+
+
+def get_rss_peak():
+    """Peak resident set size of the current process since it was last reset,
+    in MB, or None when it isn't available (i.e. not on Linux).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return None
+
+
+def reset_rss_peak():
+    """Reset the peak resident set size to the current one, if possible."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+class StageProfiler(object):
+    """Record the wall time, CPU time and peak memory of the stages of a run.
+
+    The CPU time only accounts for the current process (e.g. not for the
+    workers running cross validation folds). The peak resident set size of each
+    stage is recorded when the peak can be reset (on Linux), along with the peak
+    of the whole process so far. When trace_memory is set, the peak of the
+    memory allocated by Python during each stage is also recorded using
+    tracemalloc, which slows down allocations noticeably (stages can't be nested
+    in this case).
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        # Peak resident set size of the running stages, which has to be
+        # updated before the peak is reset by a nested stage.
+        self.rss_peaks = []
+        # Resetting the peak also resets the one reported by getrusage.
+        self.max_rss = get_max_rss()
+
+    def reset_rss_peak(self):
+        rss_peak = get_rss_peak()
+        if rss_peak is None or not reset_rss_peak():
+            return None
+
+        self.max_rss = max(self.max_rss, rss_peak)
+        for i, peak in enumerate(self.rss_peaks):
+            if peak is not None:
+                self.rss_peaks[i] = max(peak, rss_peak)
+
+        return get_rss_peak()
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.start()
+
+        rss_peak = self.reset_rss_peak()
+        self.rss_peaks.append(rss_peak)
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        try:
+            yield
+        finally:
+            measures = {
+                "wall_time": time.perf_counter() - wall_start,
+                "cpu_time": time.process_time() - cpu_start,
+            }
+
+            rss_peak = self.rss_peaks.pop()
+            if rss_peak is not None:
+                measures["max_rss"] = max(rss_peak, get_rss_peak())
+
+            self.max_rss = max(self.max_rss, get_max_rss())
+            measures["process_max_rss"] = self.max_rss
+
+            if self.trace_memory:
+                measures["tracemalloc_peak"] = (
+                    tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                )
+                tracemalloc.stop()
+
+            self.stages[name] = measures
+
+            logger.info(
+                f"Stage {name}: "
+                + ", ".join(f"{key}={value:.2f}" for key, value in measures.items())
+            )
@@ -3,10 +3,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import itertools
 import pickle
 import shelve
 
-from bugbug import db
+import dateutil.parser
+
+from bugbug import commit_features, db
 from bugbug.utils import ExpQueue, LMDBDict
 
 TEST_SCHEDULING_DB = "data/test_scheduling_history.pickle"
@@ -18,6 +21,13 @@ db.register(
     [PAST_FAILURES_DB],
 )
 
+PUSH_COMMITS_DB = "data/push_commits.json"
+db.register(
+    PUSH_COMMITS_DB,
+    "https://community-tc.services.mozilla.com/api/index/v1/task/project.relman.bugbug.data_test_scheduling_history.latest/artifacts/public/push_commits.json.zst",
+    1,
+)
+
 HISTORICAL_TIMESPAN = 56
 
 
@@ -25,6 +35,51 @@ def get_test_scheduling_history():
     return db.read(TEST_SCHEDULING_DB)
 
 
+class PushCommits(object):
+    """Map from the first revision of a push to the merged features of the
+    commits in the push (see commit_features.merge_commits).
+
+    The merged features are read from the push commits DB, which is built
+    incrementally by the test scheduling history retriever and only holds the
+    pushes of the training window. Pushes that are not in the DB map to None.
+    """
+
+    def __init__(self):
+        self.pushes = {push["revs"][0]: push for push in db.read(PUSH_COMMITS_DB)}
+
+    def get(self, revs):
+        return self.pushes.get(revs[0])
+
+
+def merge_push_commits(pushes_revs, commits):
+    """Merge the commits of the given pushes, each given by its revisions, in
+    the format of the push commits DB. Pushes none of whose commits are in
+    commits are skipped.
+    """
+    revisions = set(itertools.chain.from_iterable(pushes_revs))
+    commit_map = {
+        commit["node"]: commit for commit in commits if commit["node"] in revisions
+    }
+
+    for revs in pushes_revs:
+        push_commits = tuple(
+            commit_map[revision] for revision in revs if revision in commit_map
+        )
+        if len(push_commits) == 0:
+            continue
+
+        merged_commits = commit_features.merge_commits(push_commits)
+        merged_commits["revs"] = revs
+        yield merged_commits
+
+
+def prune_push_commits(pushes, start_date):
+    """Drop the pushes which were pushed before start_date."""
+    return (
+        push for push in pushes if dateutil.parser.parse(push["pushdate"]) > start_date
+    )
+
+
 def get_past_failures():
     return shelve.Shelf(
         LMDBDict("data/past_failures.lmdb"),
@@ -3,26 +3,38 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from functools import lru_cache
+
 
 class name(object):
     def __call__(self, test_job, **kwargs):
         return test_job["name"]
 
 
+# Task names are parsed once: there are only a few thousands distinct ones,
+# against millions of (push, task) rows.
+
+
+@lru_cache(maxsize=None)
+def get_platform(name):
+    prefix = name[: name.index("/")]
+
+    platforms = []
+    for ps in (("linux",), ("windows", "win"), ("android",), ("macosx",)):
+        for p in ps:
+            if p in prefix:
+                platforms.append(ps[0])
+                break
+    assert len(platforms) == 1, "Wrong platforms ({}) in {}".format(platforms, name)
+    return platforms[0]
+
+
 class platform(object):
     def __call__(self, test_job, **kwargs):
-        platforms = []
-        for ps in (("linux",), ("windows", "win"), ("android",), ("macosx",)):
-            for p in ps:
-                if p in test_job["name"][: test_job["name"].index("/")]:
-                    platforms.append(ps[0])
-                    break
-        assert len(platforms) == 1, "Wrong platforms ({}) in {}".format(
-            platforms, test_job["name"]
-        )
-        return platforms[0]
+        return get_platform(test_job["name"])
 
 
+@lru_cache(maxsize=None)
 def get_chunk(name):
     if name.startswith("build-"):
         return "build"
@@ -46,11 +58,14 @@ class chunk(object):
         return get_chunk(test_job["name"])
 
 
+@lru_cache(maxsize=None)
+def get_suite(name):
+    return "-".join(p for p in get_chunk(name).split("-") if not p.isdigit())
+
+
 class suite(object):
     def __call__(self, test_job, **kwargs):
-        return "-".join(
-            p for p in get_chunk(test_job["name"]).split("-") if not p.isdigit()
-        )
+        return get_suite(test_job["name"])
 
 
 class is_test(object):
@@ -110,25 +125,33 @@ class prev_failures(object):
         }
 
 
+@lru_cache(maxsize=None)
+def get_arch(name):
+    prefix = name[: name.index("/")]
+
+    archs = set()  # Used set to eliminate duplicates like in case of aarch64
+    for arcs in (
+        ("arm", "arm7"),
+        ("aarch64", "arm64"),
+        ("64", "x86_64"),
+        ("32", "x86", "i386"),
+    ):
+        for a in arcs:
+            if a in prefix:
+                if a == "64" and "aarch64" in archs:
+                    continue
+                elif a == "x86" and "64" in archs:
+                    continue
+                archs.add(arcs[0])
+    assert len(archs) == 1, "Wrong architectures ({}) in {}".format(archs, name)
+    return archs.pop()
+
+
 class arch(object):
     def __call__(self, test_job, **kwargs):
+        # Builds have no architecture. The empty list is not cached, so that
+        # callers mutating it don't change the feature of the other builds.
         if "build-" in test_job["name"]:
             return []
-        archs = set()  # Used set to eliminate duplicates like in case of aarch64
-        for arcs in (
-            ("arm", "arm7"),
-            ("aarch64", "arm64"),
-            ("64", "x86_64"),
-            ("32", "x86", "i386"),
-        ):
-            for a in arcs:
-                if a in test_job["name"][: test_job["name"].index("/")]:
-                    if a == "64" and "aarch64" in archs:
-                        continue
-                    elif a == "x86" and "64" in archs:
-                        continue
-                    archs.add(arcs[0])
-        assert len(archs) == 1, "Wrong architectures ({}) in {}".format(
-            archs, test_job["name"]
-        )
-        return archs.pop()
+
+        return get_arch(test_job["name"])
@@ -3,8 +3,11 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
+import inspect
 import json
 import os
+import sys
 import tarfile
 import time
 from collections import deque
@@ -216,6 +219,62 @@ def extract_tar_zst(path):
                 tar.extractall()
 
 
+def get_config_fingerprint(obj):
+    """Return a stable description of the configuration of an object.
+
+    Contrary to repr, it doesn't depend on memory addresses and it includes the
+    source code of the modules defining the objects, so that it changes when
+    either the configuration or the code changes.
+    """
+    modules = set()
+
+    def describe(obj):
+        if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+            return repr(obj)
+
+        if isinstance(obj, dict):
+            items = sorted((describe(k), describe(v)) for k, v in obj.items())
+            return "{" + ", ".join(f"{k}: {v}" for k, v in items) + "}"
+
+        if isinstance(obj, (list, tuple)):
+            return "[" + ", ".join(describe(elem) for elem in obj) + "]"
+
+        if isinstance(obj, (set, frozenset)):
+            return "{" + ", ".join(sorted(describe(elem) for elem in obj)) + "}"
+
+        if inspect.ismethod(obj):
+            # Don't describe the instance the method is bound to.
+            obj = obj.__func__
+
+        if inspect.isroutine(obj) or inspect.isclass(obj):
+            modules.add(obj.__module__)
+            return f"{obj.__module__}.{obj.__qualname__}"
+
+        cls = type(obj)
+        modules.add(cls.__module__)
+        name = f"{cls.__module__}.{cls.__qualname__}"
+
+        if isinstance(obj, BaseEstimator):
+            return f"{name}({describe(obj.get_params(deep=False))})"
+
+        if hasattr(obj, "__dict__"):
+            return f"{name}({describe(vars(obj))})"
+
+        return f"{name}({obj!r})"
+
+    description = describe(obj)
+
+    fingerprint = hashlib.sha256(description.encode("utf-8"))
+    for module_name in sorted(modules):
+        module = sys.modules.get(module_name)
+        if module is None or not module_name.startswith("bugbug"):
+            continue
+
+        fingerprint.update(inspect.getsource(module).encode("utf-8"))
+
+    return fingerprint.hexdigest()
+
+
 class CustomJsonEncoder(json.JSONEncoder):
     """ A custom Json Encoder to support Numpy types
     """
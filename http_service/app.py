@@ -3,27 +3,29 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import functools
 import json
 import logging
 import os
-import uuid
+import time
 from datetime import datetime, timedelta
 
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
 from apispec_webframeworks.flask import FlaskPlugin
 from cerberus import Validator
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, g, jsonify, render_template, request
 from flask_cors import cross_origin
 from marshmallow import Schema, fields
 from redis import Redis
 from rq import Queue
-from rq.exceptions import NoSuchJobError
 from rq.job import Job
 
 from bugbug import get_bugbug_version
 
-from .models import MODELS_NAMES, change_time_key, classify_bug, result_key
+from . import metrics
+from .batcher import ClassificationBatcher
+from .models import MODELS_NAMES, change_time_key, classify_bugs, result_key
 from .utils import get_bugzilla_http_client
 
 API_TOKEN = "X-Api-Key"
@@ -52,18 +54,60 @@ redis_url = os.environ.get("REDIS_URL", "redis://localhost/0")
 redis_conn = Redis.from_url(redis_url)
 
 JOB_TIMEOUT = 1800  # 30 minutes in seconds
-q = Queue(
-    connection=redis_conn, default_timeout=JOB_TIMEOUT
-)  # no args implies the default queue
+
+# Bugs requested one at a time are classified from the high priority queue,
+# which the workers drain first, so that they don't wait behind batches.
+HIGH_PRIORITY = "high"
+LOW_PRIORITY = "low"
+PRIORITIES = (HIGH_PRIORITY, LOW_PRIORITY)
+
+
+def create_queues(connection):
+    return {
+        priority: Queue(priority, connection=connection, default_timeout=JOB_TIMEOUT)
+        for priority in PRIORITIES
+    }
+
+
+queues = create_queues(redis_conn)
 VALIDATOR = Validator()
 
 BUGZILLA_TOKEN = os.environ.get("BUGBUG_BUGZILLA_TOKEN")
 
+# Classifications scheduled within BATCH_LATENCY seconds of each other are run
+# by the same job, up to BATCH_SIZE bugs. Larger batches are split into several
+# jobs, which can be run by different workers.
+BATCH_LATENCY = float(os.environ.get("BUGBUG_BATCH_LATENCY", "0.2"))
+BATCH_SIZE = int(os.environ.get("BUGBUG_BATCH_SIZE", "200"))
+
+# Number of seconds during which the last change time of a bug is cached.
+LAST_CHANGE_TIME_TTL = 2 * 60
+
+# Schema of the list of models of multi-model requests.
+MODELS_SCHEMA = {
+    "models": {
+        "type": "list",
+        "minlength": 1,
+        "schema": {"type": "string", "allowed": MODELS_NAMES},
+    }
+}
+
+# Schema of the bodies of the requests containing a list of bugs.
+BUGS_SCHEMA = {
+    "bugs": {
+        "type": "list",
+        "minlength": 1,
+        "maxlength": 1000,
+        "schema": {"type": "integer"},
+    }
+}
+
 # Keep an HTTP client around for persistent connections
 BUGBUG_HTTP_CLIENT, BUGZILLA_API_URL = get_bugzilla_http_client()
+BUGZILLA_HEADERS = {"X-Bugzilla-API-Key": "", "User-Agent": "bugbug"}
 
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get("BUGBUG_LOG_LEVEL", "INFO"))
 LOGGER = logging.getLogger()
 
 
@@ -98,79 +142,180 @@ api_key_scheme = {"type": "apiKey", "in": "header", "name": "X-API-Key"}
 spec.components.security_scheme("api_key", api_key_scheme)
 
 
-def get_job_id():
-    return uuid.uuid4().hex
+# The depth of the queues is collected when the metrics are scraped.
+METRICS_REGISTRY = metrics.get_registry()
+METRICS_REGISTRY.register(metrics.QueueCollector(lambda: queues.values()))
 
 
 def get_mapping_key(model_name, bug_id):
     return f"bugbug:mapping_{model_name}_{bug_id}"
 
 
-def schedule_bug_classification(model_name, bug_ids):
+def enqueue_bugs_classification(priority, job_id, model_bug_ids):
+    queues[priority].enqueue(
+        classify_bugs, model_bug_ids, BUGZILLA_TOKEN, job_id=job_id
+    )
+
+
+def create_batchers():
+    return {
+        priority: ClassificationBatcher(
+            BATCH_LATENCY,
+            BATCH_SIZE,
+            functools.partial(enqueue_bugs_classification, priority),
+        )
+        for priority in PRIORITIES
+    }
+
+
+# Classifications scheduled by concurrent requests are run by the same job.
+batchers = create_batchers()
+
+
+def schedule_bug_classification(model_name, bug_ids, priority):
     """ Schedule the classification of a bug_id list
     """
+    schedule_bugs_classification({model_name: bug_ids}, priority)
 
-    job_id = get_job_id()
 
-    # Set the mapping before queuing to avoid some race conditions
-    job_id_mapping = {get_mapping_key(model_name, bug_id): job_id for bug_id in bug_ids}
-    redis_conn.mset(job_id_mapping)
+def schedule_bugs_classification(model_bug_ids, priority):
+    """ Schedule the classification of bugs with several models
 
-    q.enqueue(classify_bug, model_name, bug_ids, BUGZILLA_TOKEN, job_id=job_id)
+    The bugs are added to the current batch of the queue of the given priority,
+    which is classified by a single job once it is full or after BATCH_LATENCY
+    seconds.
+    """
 
+    # The mapping is set before the jobs are enqueued, so that they never run
+    # (or get checked by another request) without it.
+    def set_job_id_mapping(job_bug_ids):
+        job_id_mapping = {
+            get_mapping_key(model_name, bug_id): job_id
+            for job_id, job_model_bug_ids in job_bug_ids.items()
+            for model_name, bug_ids in job_model_bug_ids.items()
+            for bug_id in bug_ids
+        }
+        redis_conn.mset(job_id_mapping)
 
-def is_running(model_name, bug_id):
-    # Check if there is a job
-    mapping_key = get_mapping_key(model_name, bug_id)
+    batchers[priority].add(model_bug_ids, set_job_id_mapping)
 
-    job_id = redis_conn.get(mapping_key)
 
-    if not job_id:
-        LOGGER.debug("No job ID mapping %s, False", job_id)
-        return False
+def flush_batches():
+    """Submit the classifications which are waiting for their batch to be full."""
+    for batcher in batchers.values():
+        batcher.flush()
 
-    try:
-        job = Job.fetch(job_id.decode("utf-8"), connection=redis_conn)
-    except NoSuchJobError:
-        LOGGER.debug("No job in DB for %s, False", job_id)
-        # The job might have expired from redis
-        return False
 
-    job_status = job.get_status()
+def is_job_running(job, job_status):
     if job_status == "started":
-        LOGGER.debug("Job running %s, True", job_id)
+        LOGGER.debug("Job running %s, True", job.id)
         return True
 
+    LOGGER.debug("Job status %s, False", job_status)
+
+    return False
+
+
+def is_job_timed_out(job):
     # Enforce job timeout as RQ doesn't seems to do it https://github.com/rq/rq/issues/758
     timeout_datetime = job.enqueued_at + timedelta(seconds=job.timeout)
     utcnow = datetime.utcnow()
-    if timeout_datetime < utcnow:
-        # Remove the timeouted job so it will be requeued
-        job.cancel()
-        job.cleanup()
+    return timeout_datetime < utcnow
 
-        LOGGER.debug("Job timeout %s, False", job_id)
 
-        return False
+def cancel_job(job):
+    # Remove the timeouted job so it will be requeued
+    job.cancel()
+    job.cleanup()
 
-    LOGGER.debug("Job status %s, False", job_status)
+    LOGGER.debug("Job timeout %s", job.id)
 
-    return False
 
+def get_unique_job_ids(job_ids):
+    """Return the ids of the jobs to fetch, and the set of the ids of the jobs
+    which are not submitted yet, as they are running as far as the bugs are
+    concerned.
 
-def get_bugs_last_change_time(bug_ids):
-    query = {
+    Only the jobs of the batches of this process are known to be pending: the
+    bugs of a batch of another process can be scheduled again until it is
+    submitted, i.e. for up to BATCH_LATENCY seconds.
+    """
+    # Bugs classified together share the same job, fetch each job only once.
+    unique_job_ids = set(
+        job_id.decode("utf-8") for job_id in job_ids if job_id is not None
+    )
+
+    pending_job_ids = set(
+        job_id
+        for job_id in unique_job_ids
+        if any(batcher.is_pending(job_id) for batcher in batchers.values())
+    )
+
+    return list(unique_job_ids - pending_job_ids), pending_job_ids
+
+
+def get_bugs_of_jobs(bug_ids, job_ids, selected_job_ids):
+    return set(
+        bug_id
+        for bug_id, job_id in zip(bug_ids, job_ids)
+        if job_id is not None and job_id.decode("utf-8") in selected_job_ids
+    )
+
+
+def get_running_bugs(model_name, bug_ids):
+    """Return the set of bugs which are being classified by a running job."""
+    if not bug_ids:
+        return set()
+
+    # Check if there is a job
+    job_ids = redis_conn.mget(
+        [get_mapping_key(model_name, bug_id) for bug_id in bug_ids]
+    )
+
+    unique_job_ids, running_job_ids = get_unique_job_ids(job_ids)
+    jobs = Job.fetch_many(unique_job_ids, connection=redis_conn)
+
+    for job_id, job in zip(unique_job_ids, jobs):
+        if job is None:
+            LOGGER.debug("No job in DB for %s, False", job_id)
+            # The job might have expired from redis
+            continue
+
+        if is_job_running(job, job.get_status()):
+            running_job_ids.add(job_id)
+        elif is_job_timed_out(job):
+            cancel_job(job)
+
+    return get_bugs_of_jobs(bug_ids, job_ids, running_job_ids)
+
+
+def get_last_change_time_key(bug_id):
+    return f"bugbug:last_change_time_{bug_id}"
+
+
+def fetch_bugs_last_change_time(bug_ids):
+    query = get_last_change_time_query(bug_ids)
+    with metrics.BUGZILLA_REQUEST_DURATION.labels("service").time():
+        response = BUGBUG_HTTP_CLIENT.get(
+            BUGZILLA_API_URL,
+            params=query,
+            headers=BUGZILLA_HEADERS,
+            verify=True,
+            timeout=30,
+        )
+    response.raise_for_status()
+
+    return parse_bugs_last_change_time(response.json())
+
+
+def get_last_change_time_query(bug_ids):
+    return {
         "id": ",".join(map(str, bug_ids)),
         "include_fields": ["last_change_time", "id"],
     }
-    header = {"X-Bugzilla-API-Key": "", "User-Agent": "bugbug"}
-    response = BUGBUG_HTTP_CLIENT.get(
-        BUGZILLA_API_URL, params=query, headers=header, verify=True, timeout=30
-    )
-    response.raise_for_status()
 
-    raw_bugs = response.json()
 
+def parse_bugs_last_change_time(raw_bugs):
     bugs = {}
 
     for bug in raw_bugs["bugs"]:
@@ -179,39 +324,287 @@ def get_bugs_last_change_time(bug_ids):
     return bugs
 
 
-def is_prediction_invalidated(model_name, bug_id, change_time):
-    # First get the saved change time
-    change_key = change_time_key(model_name, bug_id)
+def parse_cached_last_change_times(bug_ids, cached_change_times):
+    """Return the cached change times, and the bugs which are not cached."""
+    bugs = {}
+    missing_bug_ids = []
+    for bug_id, change_time in zip(bug_ids, cached_change_times):
+        if change_time is None:
+            missing_bug_ids.append(bug_id)
+        # An empty change time means Bugzilla didn't return the bug (e.g. because
+        # it's a security bug).
+        elif change_time:
+            bugs[bug_id] = change_time.decode("utf-8")
+
+    metrics.count_last_change_time_cache(
+        len(bug_ids) - len(missing_bug_ids), len(missing_bug_ids)
+    )
+
+    return bugs, missing_bug_ids
+
 
-    saved_change_time = redis_conn.get(change_key)
+def cache_last_change_times(pipeline, bug_ids, fetched_bugs):
+    for bug_id in bug_ids:
+        pipeline.set(
+            get_last_change_time_key(bug_id),
+            fetched_bugs.get(bug_id, ""),
+            ex=LAST_CHANGE_TIME_TTL,
+        )
 
+
+def get_bugs_last_change_time(bug_ids):
+    """Get the last change time of bugs, from the cache when possible.
+
+    The change times are cached for LAST_CHANGE_TIME_TTL seconds and shared by
+    all models, so that answering with an already computed prediction doesn't
+    require querying Bugzilla. They can be invalidated sooner through the
+    /bugs/changed endpoint.
+    """
+    cached_change_times = redis_conn.mget(
+        [get_last_change_time_key(bug_id) for bug_id in bug_ids]
+    )
+
+    bugs, missing_bug_ids = parse_cached_last_change_times(bug_ids, cached_change_times)
+
+    if missing_bug_ids:
+        fetched_bugs = fetch_bugs_last_change_time(missing_bug_ids)
+
+        with redis_conn.pipeline(transaction=False) as pipeline:
+            cache_last_change_times(pipeline, missing_bug_ids, fetched_bugs)
+            pipeline.execute()
+
+        bugs.update(fetched_bugs)
+
+    return bugs
+
+
+def is_prediction_invalidated(saved_change_time, result, change_time):
     # If we have no last changed time, the bug was not classified yet or the bug was classified by an old worker
     if not saved_change_time:
         # We can have a result without a cache time
-        if redis_conn.exists(result_key(model_name, bug_id)):
-            return True
-
-        return False
+        return result is not None
 
     return saved_change_time.decode("utf-8") != change_time
 
 
-def clean_prediction_cache(model_name, bug_id):
-    # If the bug was modified since last time we classified it, clear the cache to avoid stale answer
-    LOGGER.debug("Cleaning results for bug id %s and model %s", bug_id, model_name)
+def get_bugs_classification(model_name, bug_ids, bug_change_dates):
+    """Get the stored classification of the bugs, or None for those which are
+    not classified yet.
+
+    The classifications made before the last change of a bug are removed from
+    the cache, to avoid stale answers.
+    """
+    values = redis_conn.mget(get_classification_keys(model_name, bug_ids))
+
+    classifications, invalidated_keys = parse_bugs_classification(
+        model_name, bug_ids, bug_change_dates, values
+    )
 
-    redis_conn.delete(result_key(model_name, bug_id))
-    redis_conn.delete(change_time_key(model_name, bug_id))
+    if invalidated_keys:
+        redis_conn.delete(*invalidated_keys)
 
+    return classifications
 
-def get_bug_classification(model_name, bug_id):
-    redis_key = f"result_{model_name}_{bug_id}"
-    result = redis_conn.get(redis_key)
 
-    if result:
-        return json.loads(result)
+def get_classification_keys(model_name, bug_ids):
+    return [change_time_key(model_name, bug_id) for bug_id in bug_ids] + [
+        result_key(model_name, bug_id) for bug_id in bug_ids
+    ]
 
-    return None
+
+def parse_bugs_classification(model_name, bug_ids, bug_change_dates, values):
+    """Return the classifications found in values (read from the keys returned
+    by get_classification_keys), and the keys of the invalidated ones.
+    """
+    change_keys = [change_time_key(model_name, bug_id) for bug_id in bug_ids]
+    keys = [result_key(model_name, bug_id) for bug_id in bug_ids]
+
+    saved_change_times = values[: len(bug_ids)]
+    results = values[len(bug_ids) :]
+
+    classifications = {}
+    invalidated_keys = []
+    hits = 0
+    for i, bug_id in enumerate(bug_ids):
+        # Change time could be None if it's a security bug
+        change_time = bug_change_dates.get(int(bug_id), None)
+        if change_time and is_prediction_invalidated(
+            saved_change_times[i], results[i], change_time
+        ):
+            LOGGER.debug(
+                "Cleaning results for bug id %s and model %s", bug_id, model_name
+            )
+            invalidated_keys += [keys[i], change_keys[i]]
+            classifications[bug_id] = None
+        elif results[i] is not None:
+            classifications[bug_id] = json.loads(results[i])
+            hits += 1
+        else:
+            classifications[bug_id] = None
+
+    invalidated = len(invalidated_keys) // 2
+    metrics.count_classification_cache(
+        model_name, hits, len(bug_ids) - hits - invalidated, invalidated
+    )
+
+    return classifications, invalidated_keys
+
+
+def get_batch_response(bug_ids, classifications, running_bugs):
+    """Return the response to a batch request, and the bugs to schedule."""
+    status_code = 200
+    data = {}
+    missing_bugs = []
+
+    for bug_id in bug_ids:
+        data[str(bug_id)] = classifications[bug_id]
+        if not data[str(bug_id)]:
+            if bug_id not in running_bugs:
+                missing_bugs.append(bug_id)
+            status_code = 202
+            data[str(bug_id)] = {"ready": False}
+
+    return {"bugs": data}, status_code, missing_bugs
+
+
+def get_known_model_names(model_names):
+    # Unknown models are left out of the metrics, to bound their time series.
+    return [model_name for model_name in model_names if model_name in MODELS_NAMES]
+
+
+def parse_model_names(models_param):
+    """Return the models listed in the comma separated models parameter, or the
+    validation errors.
+    """
+    model_names = list(
+        dict.fromkeys(name for name in (models_param or "").split(",") if name)
+    )
+
+    validator = Validator()
+    if not validator.validate({"models": model_names}, MODELS_SCHEMA):
+        return None, validator.errors
+
+    return model_names, None
+
+
+def get_models_classification(model_names, bug_ids, bug_change_dates):
+    """Get the stored classifications of the bugs by several models, as a dict
+    from model names to the classifications returned by get_bugs_classification.
+    """
+    values = redis_conn.mget(
+        [
+            key
+            for model_name in model_names
+            for key in get_classification_keys(model_name, bug_ids)
+        ]
+    )
+
+    classifications, invalidated_keys = parse_models_classification(
+        model_names, bug_ids, bug_change_dates, values
+    )
+
+    if invalidated_keys:
+        redis_conn.delete(*invalidated_keys)
+
+    return classifications
+
+
+def parse_models_classification(model_names, bug_ids, bug_change_dates, values):
+    classifications = {}
+    invalidated_keys = []
+
+    # Each model has a change time and a result key per bug.
+    model_values_len = 2 * len(bug_ids)
+    for i, model_name in enumerate(model_names):
+        (
+            classifications[model_name],
+            model_invalidated_keys,
+        ) = parse_bugs_classification(
+            model_name,
+            bug_ids,
+            bug_change_dates,
+            values[i * model_values_len : (i + 1) * model_values_len],
+        )
+        invalidated_keys += model_invalidated_keys
+
+    return classifications, invalidated_keys
+
+
+def get_not_ready_bugs(bug_ids, classifications):
+    return [bug_id for bug_id in bug_ids if not classifications[bug_id]]
+
+
+def get_models_batch_response(model_names, bug_ids, classifications, running_bugs):
+    """Return the response to a multi-model batch request, and the bugs to
+    schedule for each model.
+    """
+    status_code = 200
+    data = {str(bug_id): {} for bug_id in bug_ids}
+    missing_bugs = {}
+
+    for model_name in model_names:
+        model_data, model_status_code, model_missing_bugs = get_batch_response(
+            bug_ids, classifications[model_name], running_bugs[model_name]
+        )
+
+        for bug_id, bug_data in model_data["bugs"].items():
+            data[bug_id][model_name] = bug_data
+
+        if model_status_code == 202:
+            status_code = 202
+
+        if model_missing_bugs:
+            missing_bugs[model_name] = model_missing_bugs
+
+    return {"bugs": data}, status_code, missing_bugs
+
+
+def models_predictions(model_names, bug_ids, priority):
+    """Get the predictions of several models for bugs, scheduling a single job
+    for all the missing ones.
+    """
+    bug_change_dates = get_bugs_last_change_time(bug_ids)
+
+    classifications = get_models_classification(model_names, bug_ids, bug_change_dates)
+
+    running_bugs = {
+        model_name: get_running_bugs(
+            model_name, get_not_ready_bugs(bug_ids, classifications[model_name])
+        )
+        for model_name in model_names
+    }
+
+    data, status_code, missing_bugs = get_models_batch_response(
+        model_names, bug_ids, classifications, running_bugs
+    )
+
+    if missing_bugs:
+        schedule_bugs_classification(missing_bugs, priority)
+
+    return data, status_code
+
+
+@application.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@application.after_request
+def observe_request(response):
+    if request.url_rule is not None:
+        if "model_name" in request.view_args:
+            model_names = [request.view_args["model_name"]]
+        else:
+            model_names = request.args.get("models", "").split(",")
+
+        metrics.observe_request(
+            request.url_rule.rule,
+            get_known_model_names(model_names),
+            response.status_code,
+            time.perf_counter() - g.request_start,
+        )
+
+    return response
 
 
 @application.route("/<model_name>/predict/<int:bug_id>")
@@ -260,23 +653,16 @@ def model_prediction(model_name, bug_id):
 
     if not auth:
         return jsonify(UnauthorizedError().dump({}).data), 401
-    else:
-        LOGGER.info("Request with API TOKEN %r", auth)
 
     # Get the latest change from Bugzilla for the bug
     bug = get_bugs_last_change_time([bug_id])
 
-    # Change time could be None if it's a security bug
-    bug_change_time = bug.get(bug_id, None)
-    if bug_change_time and is_prediction_invalidated(model_name, bug_id, bug[bug_id]):
-        clean_prediction_cache(model_name, bug_id)
-
     status_code = 200
-    data = get_bug_classification(model_name, bug_id)
+    data = get_bugs_classification(model_name, [bug_id], bug)[bug_id]
 
     if not data:
-        if not is_running(model_name, bug_id):
-            schedule_bug_classification(model_name, [bug_id])
+        if not get_running_bugs(model_name, [bug_id]):
+            schedule_bug_classification(model_name, [bug_id], HIGH_PRIORITY)
         status_code = 202
         data = {"ready": False}
 
@@ -403,54 +789,268 @@ def batch_prediction(model_name):
 
     if not auth:
         return jsonify(UnauthorizedError().dump({}).data), 401
-    else:
-        LOGGER.info("Request with API TOKEN %r", auth)
 
     # TODO Check is JSON is valid and validate against a request schema
     batch_body = json.loads(request.data)
 
     # Validate
-    schema = {
-        "bugs": {
-            "type": "list",
-            "minlength": 1,
-            "maxlength": 1000,
-            "schema": {"type": "integer"},
-        }
-    }
     validator = Validator()
-    if not validator.validate(batch_body, schema):
+    if not validator.validate(batch_body, BUGS_SCHEMA):
         return jsonify({"errors": validator.errors}), 400
 
     bugs = batch_body["bugs"]
 
-    status_code = 200
-    data = {}
-    missing_bugs = []
-
     bug_change_dates = get_bugs_last_change_time(bugs)
 
-    for bug_id in bugs:
+    classifications = get_bugs_classification(model_name, bugs, bug_change_dates)
 
-        change_time = bug_change_dates.get(int(bug_id), None)
-        # Change time could be None if it's a security bug
-        if change_time and is_prediction_invalidated(model_name, bug_id, change_time):
-            clean_prediction_cache(model_name, bug_id)
+    running_bugs = get_running_bugs(
+        model_name, get_not_ready_bugs(bugs, classifications)
+    )
 
-        data[str(bug_id)] = get_bug_classification(model_name, bug_id)
-        if not data[str(bug_id)]:
-            if not is_running(model_name, bug_id):
-                missing_bugs.append(bug_id)
-            status_code = 202
-            data[str(bug_id)] = {"ready": False}
+    data, status_code, missing_bugs = get_batch_response(
+        bugs, classifications, running_bugs
+    )
 
     if missing_bugs:
-        # TODO: We should probably schedule chunks of bugs to avoid jobs that
-        # are running for too long and reduce pressure on bugzilla, it mights
-        # not like getting 1 million bug at a time
-        schedule_bug_classification(model_name, missing_bugs)
+        schedule_bug_classification(model_name, missing_bugs, LOW_PRIORITY)
+
+    return jsonify(data), status_code
+
+
+@application.route("/predict/<int:bug_id>")
+@cross_origin()
+def models_prediction(bug_id):
+    """
+    ---
+    get:
+      description: >
+        Classify a single bug using several models, answer either 200 if the bug
+        is processed by all of them or 202 if it is still being processed by at
+        least one. The bug is only fetched once for all models.
+      summary: Classify a single bug with several models
+      parameters:
+      - name: bug_id
+        in: path
+        schema:
+          type: integer
+          example: 123456
+      - name: models
+        in: query
+        description: A comma separated list of model names
+        schema:
+          type: string
+          example: defectenhancementtask,component
+      responses:
+        200:
+          description: The predictions of each model
+          content:
+            application/json:
+              schema:
+                type: object
+                additionalProperties: true
+                example:
+                  defectenhancementtask:
+                    extra_data: {}
+                    index: 0
+                    prob: [0]
+                    suggestion: string
+                  component:
+                    extra_data: {}
+                    index: 0
+                    prob: [0]
+                    suggestion: string
+        202:
+          description: A temporary answer for the models still processing the bug
+          content:
+            application/json:
+              schema:
+                type: object
+                additionalProperties: true
+                example:
+                  defectenhancementtask:
+                    extra_data: {}
+                    index: 0
+                    prob: [0]
+                    suggestion: string
+                  component: {ready: False}
+        401:
+          description: API key is missing
+          content:
+            application/json:
+              schema: UnauthorizedError
+    """
+    headers = request.headers
 
-    return jsonify({"bugs": data}), status_code
+    auth = headers.get(API_TOKEN)
+
+    if not auth:
+        return jsonify(UnauthorizedError().dump({}).data), 401
+
+    model_names, errors = parse_model_names(request.args.get("models"))
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    data, status_code = models_predictions(model_names, [bug_id], HIGH_PRIORITY)
+
+    return jsonify(data["bugs"][str(bug_id)]), status_code
+
+
+@application.route("/predict/batch", methods=["POST"])
+@cross_origin()
+def models_batch_prediction():
+    """
+    ---
+    post:
+      description: >
+        Post a batch of bug ids to classify with several models, answer either
+        200 if all bugs are processed by all models or 202 if at least one bug
+        is not processed. The bugs are only fetched once for all models.
+      summary: Classify a batch of bugs with several models
+      parameters:
+      - name: models
+        in: query
+        description: A comma separated list of model names
+        schema:
+          type: string
+          example: defectenhancementtask,component
+      requestBody:
+        description: The list of bugs to classify
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                bugs:
+                  type: array
+                  items:
+                    type: integer
+            examples:
+              cat:
+                summary: An example of payload
+                value:
+                  bugs:
+                    [123456, 789012]
+      responses:
+        200:
+          description: The predictions of each model for each bug
+          content:
+            application/json:
+              schema:
+                type: object
+                additionalProperties: true
+                example:
+                  bugs:
+                    123456:
+                      defectenhancementtask:
+                        extra_data: {}
+                        index: 0
+                        prob: [0]
+                        suggestion: string
+                      component:
+                        extra_data: {}
+                        index: 0
+                        prob: [0]
+                        suggestion: string
+        202:
+          description: A temporary answer for bugs being processed
+          content:
+            application/json:
+              schema:
+                type: object
+                additionalProperties: true
+                example:
+                  bugs:
+                    123456:
+                      defectenhancementtask:
+                        extra_data: {}
+                        index: 0
+                        prob: [0]
+                        suggestion: string
+                      component: {ready: False}
+        401:
+          description: API key is missing
+          content:
+            application/json:
+              schema: UnauthorizedError
+    """
+    headers = request.headers
+
+    auth = headers.get(API_TOKEN)
+
+    if not auth:
+        return jsonify(UnauthorizedError().dump({}).data), 401
+
+    model_names, errors = parse_model_names(request.args.get("models"))
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    batch_body = json.loads(request.data)
+
+    validator = Validator()
+    if not validator.validate(batch_body, BUGS_SCHEMA):
+        return jsonify({"errors": validator.errors}), 400
+
+    data, status_code = models_predictions(
+        model_names, batch_body["bugs"], LOW_PRIORITY
+    )
+
+    return jsonify(data), status_code
+
+
+@application.route("/bugs/changed", methods=["POST"])
+@cross_origin()
+def bugs_changed():
+    """
+    ---
+    post:
+      description: >
+        Notify the service that bugs were changed (e.g. from a Bugzilla webhook),
+        so that their predictions are recomputed on the next request instead of
+        once their cached change time expires.
+      summary: Notify that bugs were changed
+      requestBody:
+        description: The list of bugs which were changed
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                bugs:
+                  type: array
+                  items:
+                    type: integer
+            examples:
+              cat:
+                summary: An example of payload
+                value:
+                  bugs:
+                    [123456, 789012]
+      responses:
+        200:
+          description: The cached change times of the bugs were invalidated
+        401:
+          description: API key is missing
+          content:
+            application/json:
+              schema: UnauthorizedError
+    """
+    headers = request.headers
+
+    auth = headers.get(API_TOKEN)
+
+    if not auth:
+        return jsonify(UnauthorizedError().dump({}).data), 401
+
+    body = json.loads(request.data)
+
+    validator = Validator()
+    if not validator.validate(body, BUGS_SCHEMA):
+        return jsonify({"errors": validator.errors}), 400
+
+    redis_conn.delete(*[get_last_change_time_key(bug_id) for bug_id in body["bugs"]])
+
+    return jsonify({}), 200
 
 
 @application.route("/swagger")
@@ -465,6 +1065,12 @@ def swagger():
     return jsonify(spec.to_dict())
 
 
+@application.route("/metrics")
+def metrics_endpoint():
+    data, content_type = metrics.generate(METRICS_REGISTRY)
+    return Response(data, content_type=content_type)
+
+
 @application.route("/doc")
 def doc():
     return render_template("doc.html")
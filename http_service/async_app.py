@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""ASGI variant of the HTTP service, with the same routes and OpenAPI spec.
+
+Bugzilla and Redis are queried asynchronously, so that requests waiting for
+them don't hold a worker. It can be run with:
+
+    gunicorn http_service.async_app:application -k uvicorn.workers.UvicornWorker
+"""
+
+import functools
+import json
+import logging
+import os
+import time
+
+import httpx
+from cerberus import Validator
+from redis import asyncio as aioredis
+from rq.job import Job
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+
+from . import app, metrics
+
+LOGGER = logging.getLogger()
+
+redis_url = os.environ.get("REDIS_URL", "redis://localhost/0")
+redis_conn = aioredis.Redis.from_url(redis_url)
+
+# Keep an HTTP client around for persistent connections
+BUGBUG_HTTP_CLIENT = httpx.AsyncClient(timeout=30)
+
+templates = Jinja2Templates(
+    directory=os.path.join(os.path.dirname(__file__), "templates")
+)
+
+OPENAPI_SPEC = None
+
+
+def unauthorized():
+    return JSONResponse(app.UnauthorizedError().dump({}), 401)
+
+
+def check_auth(request):
+    return bool(request.headers.get(app.API_TOKEN))
+
+
+async def validate_bugs(request):
+    """Return the validated body of the request, or the error response."""
+    body = json.loads(await request.body())
+
+    validator = Validator()
+    if not validator.validate(body, app.BUGS_SCHEMA):
+        return None, JSONResponse({"errors": validator.errors}, 400)
+
+    return body, None
+
+
+async def fetch_bugs_last_change_time(bug_ids):
+    with metrics.BUGZILLA_REQUEST_DURATION.labels("service").time():
+        response = await BUGBUG_HTTP_CLIENT.get(
+            app.BUGZILLA_API_URL,
+            params=app.get_last_change_time_query(bug_ids),
+            headers=app.BUGZILLA_HEADERS,
+        )
+    response.raise_for_status()
+
+    return app.parse_bugs_last_change_time(response.json())
+
+
+async def get_bugs_last_change_time(bug_ids):
+    cached_change_times = await redis_conn.mget(
+        [app.get_last_change_time_key(bug_id) for bug_id in bug_ids]
+    )
+
+    bugs, missing_bug_ids = app.parse_cached_last_change_times(
+        bug_ids, cached_change_times
+    )
+
+    if missing_bug_ids:
+        fetched_bugs = await fetch_bugs_last_change_time(missing_bug_ids)
+
+        async with redis_conn.pipeline(transaction=False) as pipeline:
+            app.cache_last_change_times(pipeline, missing_bug_ids, fetched_bugs)
+            await pipeline.execute()
+
+        bugs.update(fetched_bugs)
+
+    return bugs
+
+
+async def get_bugs_classification(model_name, bug_ids, bug_change_dates):
+    values = await redis_conn.mget(app.get_classification_keys(model_name, bug_ids))
+
+    classifications, invalidated_keys = app.parse_bugs_classification(
+        model_name, bug_ids, bug_change_dates, values
+    )
+
+    if invalidated_keys:
+        await redis_conn.delete(*invalidated_keys)
+
+    return classifications
+
+
+async def get_running_bugs(model_name, bug_ids):
+    if not bug_ids:
+        return set()
+
+    job_ids = await redis_conn.mget(
+        [app.get_mapping_key(model_name, bug_id) for bug_id in bug_ids]
+    )
+
+    unique_job_ids, running_job_ids = app.get_unique_job_ids(job_ids)
+
+    async with redis_conn.pipeline(transaction=False) as pipeline:
+        for job_id in unique_job_ids:
+            pipeline.hgetall(Job.key_for(job_id))
+        raw_jobs = await pipeline.execute()
+
+    timed_out_jobs = []
+    for job_id, raw_job in zip(unique_job_ids, raw_jobs):
+        if not raw_job:
+            LOGGER.debug("No job in DB for %s, False", job_id)
+            # The job might have expired from redis
+            continue
+
+        job = Job(job_id, connection=app.redis_conn)
+        job.restore(raw_job)
+
+        if app.is_job_running(job, raw_job.get(b"status", b"").decode("utf-8")):
+            running_job_ids.add(job_id)
+        elif app.is_job_timed_out(job):
+            timed_out_jobs.append(job)
+
+    # RQ is synchronous, cancel the jobs from a thread.
+    for job in timed_out_jobs:
+        await run_in_threadpool(app.cancel_job, job)
+
+    return app.get_bugs_of_jobs(bug_ids, job_ids, running_job_ids)
+
+
+async def schedule_bug_classification(model_name, bug_ids, priority):
+    # RQ is synchronous, enqueue the job from a thread.
+    await run_in_threadpool(
+        app.schedule_bug_classification, model_name, bug_ids, priority
+    )
+
+
+async def get_models_classification(model_names, bug_ids, bug_change_dates):
+    values = await redis_conn.mget(
+        [
+            key
+            for model_name in model_names
+            for key in app.get_classification_keys(model_name, bug_ids)
+        ]
+    )
+
+    classifications, invalidated_keys = app.parse_models_classification(
+        model_names, bug_ids, bug_change_dates, values
+    )
+
+    if invalidated_keys:
+        await redis_conn.delete(*invalidated_keys)
+
+    return classifications
+
+
+async def models_predictions(model_names, bug_ids, priority):
+    bug_change_dates = await get_bugs_last_change_time(bug_ids)
+
+    classifications = await get_models_classification(
+        model_names, bug_ids, bug_change_dates
+    )
+
+    running_bugs = {}
+    for model_name in model_names:
+        running_bugs[model_name] = await get_running_bugs(
+            model_name, app.get_not_ready_bugs(bug_ids, classifications[model_name])
+        )
+
+    data, status_code, missing_bugs = app.get_models_batch_response(
+        model_names, bug_ids, classifications, running_bugs
+    )
+
+    if missing_bugs:
+        await run_in_threadpool(
+            app.schedule_bugs_classification, missing_bugs, priority
+        )
+
+    return data, status_code
+
+
+async def model_prediction(request):
+    model_name = request.path_params["model_name"]
+    bug_id = request.path_params["bug_id"]
+
+    if not check_auth(request):
+        return unauthorized()
+
+    # Get the latest change from Bugzilla for the bug
+    bug = await get_bugs_last_change_time([bug_id])
+
+    status_code = 200
+    data = (await get_bugs_classification(model_name, [bug_id], bug))[bug_id]
+
+    if not data:
+        if not await get_running_bugs(model_name, [bug_id]):
+            await schedule_bug_classification(model_name, [bug_id], app.HIGH_PRIORITY)
+        status_code = 202
+        data = {"ready": False}
+
+    return JSONResponse(data, status_code)
+
+
+async def batch_prediction(request):
+    model_name = request.path_params["model_name"]
+
+    if not check_auth(request):
+        return unauthorized()
+
+    batch_body, error = await validate_bugs(request)
+    if error is not None:
+        return error
+
+    bugs = batch_body["bugs"]
+
+    bug_change_dates = await get_bugs_last_change_time(bugs)
+
+    classifications = await get_bugs_classification(model_name, bugs, bug_change_dates)
+
+    running_bugs = await get_running_bugs(
+        model_name, app.get_not_ready_bugs(bugs, classifications)
+    )
+
+    data, status_code, missing_bugs = app.get_batch_response(
+        bugs, classifications, running_bugs
+    )
+
+    if missing_bugs:
+        await schedule_bug_classification(model_name, missing_bugs, app.LOW_PRIORITY)
+
+    return JSONResponse(data, status_code)
+
+
+async def models_prediction(request):
+    bug_id = request.path_params["bug_id"]
+
+    if not check_auth(request):
+        return unauthorized()
+
+    model_names, errors = app.parse_model_names(request.query_params.get("models"))
+    if errors:
+        return JSONResponse({"errors": errors}, 400)
+
+    data, status_code = await models_predictions(
+        model_names, [bug_id], app.HIGH_PRIORITY
+    )
+
+    return JSONResponse(data["bugs"][str(bug_id)], status_code)
+
+
+async def models_batch_prediction(request):
+    if not check_auth(request):
+        return unauthorized()
+
+    model_names, errors = app.parse_model_names(request.query_params.get("models"))
+    if errors:
+        return JSONResponse({"errors": errors}, 400)
+
+    batch_body, error = await validate_bugs(request)
+    if error is not None:
+        return error
+
+    data, status_code = await models_predictions(
+        model_names, batch_body["bugs"], app.LOW_PRIORITY
+    )
+
+    return JSONResponse(data, status_code)
+
+
+async def bugs_changed(request):
+    if not check_auth(request):
+        return unauthorized()
+
+    body, error = await validate_bugs(request)
+    if error is not None:
+        return error
+
+    await redis_conn.delete(
+        *[app.get_last_change_time_key(bug_id) for bug_id in body["bugs"]]
+    )
+
+    return JSONResponse({}, 200)
+
+
+async def swagger(request):
+    global OPENAPI_SPEC
+
+    # The spec is generated from the documentation of the routes of the
+    # synchronous app, which are the same.
+    if OPENAPI_SPEC is None:
+        with app.application.test_request_context():
+            OPENAPI_SPEC = app.swagger().get_json()
+
+    return JSONResponse(OPENAPI_SPEC)
+
+
+async def metrics_endpoint(request):
+    # Collecting the depth of the queue is synchronous.
+    data, content_type = await run_in_threadpool(metrics.generate, app.METRICS_REGISTRY)
+    return Response(data, headers={"Content-Type": content_type})
+
+
+async def doc(request):
+    return templates.TemplateResponse("doc.html", {"request": request})
+
+
+def observed(path, endpoint):
+    """Record the duration of the requests to endpoint in the metrics."""
+
+    @functools.wraps(endpoint)
+    async def observed_endpoint(request):
+        start = time.perf_counter()
+        response = await endpoint(request)
+
+        if "model_name" in request.path_params:
+            model_names = [request.path_params["model_name"]]
+        else:
+            model_names = request.query_params.get("models", "").split(",")
+
+        metrics.observe_request(
+            path,
+            app.get_known_model_names(model_names),
+            response.status_code,
+            time.perf_counter() - start,
+        )
+
+        return response
+
+    return observed_endpoint
+
+
+def route(path, endpoint, **kwargs):
+    return Route(path, observed(path, endpoint), **kwargs)
+
+
+async def close_clients():
+    await BUGBUG_HTTP_CLIENT.aclose()
+    await redis_conn.close()
+
+
+application = Starlette(
+    routes=[
+        route("/{model_name}/predict/{bug_id:int}", model_prediction),
+        route("/{model_name}/predict/batch", batch_prediction, methods=["POST"]),
+        route("/predict/{bug_id:int}", models_prediction),
+        route("/predict/batch", models_batch_prediction, methods=["POST"]),
+        route("/bugs/changed", bugs_changed, methods=["POST"]),
+        route("/swagger", swagger, name="swagger"),
+        route("/metrics", metrics_endpoint),
+        route("/doc", doc),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"])],
+    on_shutdown=[close_clients],
+)
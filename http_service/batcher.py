@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import threading
+import uuid
+
+LOGGER = logging.getLogger()
+
+
+class Batch(object):
+    def __init__(self):
+        self.job_id = uuid.uuid4().hex
+        self.model_bug_ids = {}
+        self.bug_ids = set()
+        self.timer = None
+        self.closed = False
+        # Number of calls to add recording the job of bugs of this batch, which
+        # must complete before it is submitted.
+        self.recording = 0
+
+    def add(self, bug_id, model_names):
+        for model_name in model_names:
+            self.model_bug_ids.setdefault(model_name, {})[bug_id] = True
+        self.bug_ids.add(bug_id)
+
+
+class ClassificationBatcher(object):
+    """Coalesce the classifications scheduled within a short delay of each
+    other, so that they are run by a single job.
+
+    A batch is opened when a classification is scheduled, and submitted with
+    `enqueue(job_id, model_bug_ids)` after `latency` seconds, or as soon as it
+    contains `max_size` bugs. Bugs which don't fit in the current batch are
+    added to the next ones, so that no job classifies more than `max_size` bugs.
+    The id of the job which will classify the bugs is known as soon as they are
+    added, so that it can be recorded before the job is submitted.
+
+    The batches are only known by the process which opened them: until they
+    are submitted, other processes don't know their jobs exist.
+    """
+
+    def __init__(self, latency, max_size, enqueue):
+        self.latency = latency
+        self.max_size = max_size
+        self.enqueue = enqueue
+        self.lock = threading.Lock()
+        self.batch = None
+        # Batches which aren't submitted yet, by job id.
+        self.pending = {}
+
+    def add(self, model_bug_ids, record=None):
+        """Add bugs to classify with some models to the current batch, and
+        return a dict from the ids of the jobs which will classify them to the
+        bugs classified by each job, in the same format as model_bug_ids.
+
+        When given, `record(job_bug_ids)` is called with the same dict before
+        any of these jobs is submitted.
+        """
+        # A bug classified by several models is only fetched once, so it is
+        # added to a single batch for all of them.
+        bug_models = {}
+        for model_name, bug_ids in model_bug_ids.items():
+            for bug_id in bug_ids:
+                bug_models.setdefault(bug_id, []).append(model_name)
+
+        job_bug_ids = {}
+        batches = {}
+
+        with self.lock:
+            for bug_id, model_names in bug_models.items():
+                batch = self.get_batch()
+                batch.add(bug_id, model_names)
+                if batch.job_id not in batches:
+                    batches[batch.job_id] = batch
+                    batch.recording += 1
+
+                job_model_bug_ids = job_bug_ids.setdefault(batch.job_id, {})
+                for model_name in model_names:
+                    job_model_bug_ids.setdefault(model_name, []).append(bug_id)
+
+                if len(batch.bug_ids) >= self.max_size:
+                    self.close_batch()
+
+            if self.latency <= 0 and self.batch is not None:
+                self.close_batch()
+
+        try:
+            if record is not None:
+                record(job_bug_ids)
+        finally:
+            with self.lock:
+                ready_batches = []
+                for batch in batches.values():
+                    batch.recording -= 1
+                    if self.is_ready(batch):
+                        ready_batches.append(batch)
+
+            for batch in ready_batches:
+                self.submit(batch)
+
+        return job_bug_ids
+
+    def get_batch(self):
+        if self.batch is None:
+            self.batch = Batch()
+            self.pending[self.batch.job_id] = self.batch
+            if self.latency > 0:
+                self.batch.timer = threading.Timer(
+                    self.latency, self.flush, (self.batch.job_id,)
+                )
+                self.batch.timer.daemon = True
+                self.batch.timer.start()
+
+        return self.batch
+
+    def close_batch(self):
+        batch = self.batch
+        self.batch = None
+        batch.closed = True
+        if batch.timer is not None:
+            batch.timer.cancel()
+
+        return batch
+
+    def is_ready(self, batch):
+        """Whether batch can be submitted, in which case it isn't pending
+        anymore (must be called with the lock held).
+        """
+        if not batch.closed or batch.recording > 0:
+            return False
+
+        del self.pending[batch.job_id]
+        return True
+
+    def flush(self, job_id=None):
+        """Submit the current batch, if it is the one of job_id (when given).
+
+        Batches are only submitted once the jobs of their bugs are recorded.
+        """
+        with self.lock:
+            if self.batch is None or (
+                job_id is not None and self.batch.job_id != job_id
+            ):
+                return
+
+            batch = self.close_batch()
+            if not self.is_ready(batch):
+                return
+
+        self.submit(batch)
+
+    def is_pending(self, job_id):
+        """Whether job_id is the job of a batch which isn't submitted yet."""
+        with self.lock:
+            return job_id in self.pending
+
+    def submit(self, batch):
+        model_bug_ids = {
+            model_name: list(bug_ids)
+            for model_name, bug_ids in batch.model_bug_ids.items()
+        }
+
+        try:
+            self.enqueue(batch.job_id, model_bug_ids)
+        except Exception:
+            # The bugs will be scheduled again on the next request, as their job
+            # doesn't exist.
+            LOGGER.exception(f"Failed to enqueue the classification job {batch.job_id}")
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Benchmark of the HTTP service against local stand-ins of its dependencies.
+
+The Flask app and RQ workers are started in this process, with fakeredis (or
+the Redis server given with --redis-url) and a stub Bugzilla REST server
+serving the bugs of tests/fixtures/bugs.json. A mix of single and batch
+requests is replayed against the app, and the latency percentiles, the number
+of jobs run per second and the number of Redis operations per request are
+reported. For example:
+
+    python -m http_service.bench --requests 1000 --concurrency 10 \
+        --batch-ratio 0.1 --cache-hit-ratio 0.8 --dummy-models
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import requests
+from libmozdata.bugzilla import Bugzilla
+from redis import Redis
+from rq import Queue, SimpleWorker
+from rq.registry import FailedJobRegistry, FinishedJobRegistry, StartedJobRegistry
+from rq.timeouts import BaseDeathPenalty
+from sklearn.preprocessing import LabelEncoder
+from werkzeug.serving import make_server
+
+from . import app, models
+
+BUGS_FIXTURE = os.path.join(
+    os.path.dirname(__file__), "..", "tests", "fixtures", "bugs.json"
+)
+
+# Bugs are only requested once from this id on, so they are never classified
+# when requested.
+COLD_BUG_ID = 10_000_000
+
+# Fields which Bugzilla only returns from their own endpoints.
+EXTRA_FIELDS = {"comments", "history", "attachments"}
+
+DRAIN_TIMEOUT = 5 * 60
+
+
+def load_fixture_bugs(path=BUGS_FIXTURE):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f]
+
+
+def filter_fields(bug, include_fields):
+    fields = set(include_fields or []) - {"_default", "_all"}
+    if not fields:
+        return {key: value for key, value in bug.items() if key not in EXTRA_FIELDS}
+
+    return {key: value for key, value in bug.items() if key in fields}
+
+
+class BugzillaHandler(BaseHTTPRequestHandler):
+    """Serve the part of the Bugzilla REST API used by the service and the
+    workers. Any bug id exists, as a copy of one of the fixture bugs.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def get_bug(self, bug_id):
+        bugs = self.server.bugs
+        return dict(bugs[bug_id % len(bugs)], id=bug_id)
+
+    def get_data(self, path, params):
+        if len(path) == 2:
+            bug_ids = ",".join(params.get("id", [])).split(",")
+        else:
+            bug_ids = [path[2]] + params.get("ids", [])
+        bugs = [self.get_bug(int(bug_id)) for bug_id in bug_ids if bug_id]
+
+        if len(path) == 2:
+            include_fields = params.get("include_fields")
+            return {"bugs": [filter_fields(bug, include_fields) for bug in bugs]}
+        elif path[3] == "history":
+            return {
+                "bugs": [
+                    {"id": bug["id"], "history": bug.get("history", [])} for bug in bugs
+                ]
+            }
+        elif path[3] == "comment":
+            return {
+                "bugs": {
+                    str(bug["id"]): {"comments": bug.get("comments", [])}
+                    for bug in bugs
+                }
+            }
+        elif path[3] == "attachment":
+            return {
+                "bugs": {str(bug["id"]): bug.get("attachments", []) for bug in bugs}
+            }
+
+        return None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.strip("/").split("/")
+
+        data = None
+        if path[:2] == ["rest", "bug"] and len(path) in (2, 4):
+            data = self.get_data(path, parse_qs(url.query))
+
+        if data is None:
+            self.send_error(404)
+            return
+
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_bugzilla_server(bugs):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BugzillaHandler)
+    server.daemon_threads = True
+    server.bugs = bugs
+    return server
+
+
+@contextmanager
+def serving(server):
+    """Serve requests from a thread, and yield the URL of the server."""
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield f"http://{server.server_address[0]}:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+class RedisOpsCounter(object):
+    """Count the commands sent by a Redis client, and the round trips they take.
+
+    It has to be created before the client opens any connection.
+    """
+
+    def __init__(self, redis):
+        self.lock = threading.Lock()
+        self.reset()
+
+        counter = self
+        connection_class = redis.connection_pool.connection_class
+
+        class CountingConnection(connection_class):
+            def send_packed_command(self, *args, **kwargs):
+                counter.increment("round_trips")
+                return super().send_packed_command(*args, **kwargs)
+
+            def read_response(self, *args, **kwargs):
+                # There is a response per command, pipelined or not.
+                counter.increment("commands")
+                return super().read_response(*args, **kwargs)
+
+        redis.connection_pool.connection_class = CountingConnection
+
+    def increment(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def reset(self):
+        with self.lock:
+            self.commands = 0
+            self.round_trips = 0
+
+
+class NoDeathPenalty(BaseDeathPenalty):
+    # Job timeouts rely on signals, which can't be used by the worker threads.
+    def setup_death_penalty(self):
+        pass
+
+    def cancel_death_penalty(self):
+        pass
+
+
+class ThreadWorker(SimpleWorker):
+    death_penalty_class = NoDeathPenalty
+
+    def _install_signal_handlers(self):
+        pass
+
+
+def run_worker(worker, stop):
+    # A worker waiting for jobs can't be interrupted, so they are polled.
+    while not stop.is_set():
+        if not worker.work(burst=True, logging_level="WARNING"):
+            stop.wait(0.01)
+
+
+class DummyModel(object):
+    """Stand-in for the trained models, classifying any bug in no time."""
+
+    def __init__(self):
+        self.le = LabelEncoder().fit(["no", "yes"])
+
+    def get_extra_data(self):
+        return {}
+
+    def classify(self, items, probabilities=False):
+        assert probabilities
+        return np.full((len(items), len(self.le.classes_)), 1 / len(self.le.classes_))
+
+
+@contextmanager
+def running_service(redis_conn, worker_redis_conn, bugzilla_url, workers, dummy_models):
+    """Point the app and its jobs to the given Redis and Bugzilla, and run RQ
+    workers in threads, until exiting the context.
+    """
+    patches = [
+        (app, "redis_conn", redis_conn),
+        (app, "queues", app.create_queues(redis_conn)),
+        (app, "BUGZILLA_API_URL", f"{bugzilla_url}/rest/bug"),
+        (Bugzilla, "API_URL", f"{bugzilla_url}/rest/bug"),
+        (models, "REDIS_CONNECTION", worker_redis_conn),
+    ]
+    if dummy_models:
+        patches.append(
+            (
+                models,
+                "MODEL_CACHE",
+                {model_name: DummyModel() for model_name in models.MODELS_NAMES},
+            )
+        )
+
+    originals = [(obj, name, getattr(obj, name)) for obj, name, value in patches]
+    for obj, name, value in patches:
+        setattr(obj, name, value)
+
+    # The workers drain the queues in order of priority.
+    worker_queues = [
+        Queue(priority, connection=worker_redis_conn) for priority in app.PRIORITIES
+    ]
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=run_worker,
+            args=(ThreadWorker(worker_queues, connection=worker_redis_conn), stop),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        yield
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        for obj, name, value in originals:
+            setattr(obj, name, value)
+
+
+def generate_requests(
+    rng, count, batch_ratio, batch_size, cache_hit_ratio, hot_bug_ids
+):
+    """Generate the bugs of single and batch requests, each bug being one of
+    hot_bug_ids with a probability of cache_hit_ratio, or a new one otherwise.
+    """
+    cold_bug_ids = itertools.count(COLD_BUG_ID)
+
+    def pick_bug():
+        if rng.random() < cache_hit_ratio:
+            return rng.choice(hot_bug_ids)
+
+        return next(cold_bug_ids)
+
+    for i in range(count):
+        if rng.random() < batch_ratio:
+            bug_ids = list(dict.fromkeys(pick_bug() for j in range(batch_size)))
+            yield True, bug_ids
+        else:
+            yield False, [pick_bug()]
+
+
+def send_request(session, url, model_name, batch, bug_ids):
+    headers = {app.API_TOKEN: "bench"}
+
+    if batch:
+        return session.post(
+            f"{url}/{model_name}/predict/batch",
+            json={"bugs": bug_ids},
+            headers=headers,
+        )
+
+    return session.get(f"{url}/{model_name}/predict/{bug_ids[0]}", headers=headers)
+
+
+def warm_up(url, model_name, bug_ids, timeout=DRAIN_TIMEOUT):
+    """Classify the bugs, so that the requests for them hit the cache."""
+    deadline = time.monotonic() + timeout
+
+    with requests.Session() as session:
+        for i in range(0, len(bug_ids), 1000):
+            chunk = bug_ids[i : i + 1000]
+            while (
+                send_request(session, url, model_name, True, chunk).status_code != 200
+            ):
+                if time.monotonic() > deadline:
+                    raise Exception(f"Couldn't warm up the cache in {timeout} seconds")
+
+                time.sleep(0.1)
+
+
+def replay(url, model_name, bench_requests, concurrency):
+    """Send the requests from concurrent clients, and return the latency and
+    status code of each one.
+    """
+    local = threading.local()
+
+    def send(bench_request):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+
+        start = time.perf_counter()
+        response = send_request(local.session, url, model_name, *bench_request)
+        return time.perf_counter() - start, response.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(send, bench_requests))
+
+
+def drain(timeout=DRAIN_TIMEOUT):
+    """Wait for the scheduled jobs to be run."""
+    app.flush_batches()
+
+    deadline = time.monotonic() + timeout
+    while any(
+        queue.count or StartedJobRegistry(queue=queue).count
+        for queue in app.queues.values()
+    ):
+        if time.monotonic() > deadline:
+            raise Exception(f"The jobs weren't run in {timeout} seconds")
+
+        time.sleep(0.05)
+
+
+def count_jobs():
+    return sum(
+        FinishedJobRegistry(queue=queue).count + FailedJobRegistry(queue=queue).count
+        for queue in app.queues.values()
+    )
+
+
+def benchmark(
+    model_name="component",
+    request_count=1000,
+    concurrency=10,
+    batch_ratio=0.1,
+    batch_size=100,
+    cache_hit_ratio=0.5,
+    hot_bugs=100,
+    workers=1,
+    redis_url=None,
+    dummy_models=False,
+    seed=0,
+):
+    if redis_url is not None:
+        redis_conn = Redis.from_url(redis_url)
+        worker_redis_conn = Redis.from_url(redis_url)
+        worker_redis_conn.flushdb()
+    else:
+        # Only needed when no Redis server is given.
+        import fakeredis
+
+        server = fakeredis.FakeServer()
+        redis_conn = fakeredis.FakeRedis(server=server)
+        worker_redis_conn = fakeredis.FakeRedis(server=server)
+
+    redis_ops = RedisOpsCounter(redis_conn)
+
+    rng = random.Random(seed)
+    hot_bug_ids = list(range(1, hot_bugs + 1))
+    bench_requests = list(
+        generate_requests(
+            rng, request_count, batch_ratio, batch_size, cache_hit_ratio, hot_bug_ids
+        )
+    )
+
+    bugzilla_server = get_bugzilla_server(load_fixture_bugs())
+    app_server = make_server("127.0.0.1", 0, app.application, threaded=True)
+
+    with serving(bugzilla_server) as bugzilla_url, serving(app_server) as url:
+        with running_service(
+            redis_conn, worker_redis_conn, bugzilla_url, workers, dummy_models
+        ):
+            if cache_hit_ratio > 0:
+                warm_up(url, model_name, hot_bug_ids)
+            drain()
+
+            redis_ops.reset()
+            jobs_before = count_jobs()
+
+            start = time.perf_counter()
+            results = replay(url, model_name, bench_requests, concurrency)
+            requests_elapsed = time.perf_counter() - start
+
+            drain()
+            elapsed = time.perf_counter() - start
+
+            jobs = count_jobs() - jobs_before
+
+    latencies = np.array([latency for latency, status_code in results]) * 1000
+
+    return {
+        "requests": len(results),
+        "requests_per_second": len(results) / requests_elapsed,
+        "status_codes": dict(Counter(status_code for latency, status_code in results)),
+        "latency_ms": {
+            f"p{percentile}": float(np.percentile(latencies, percentile))
+            for percentile in (50, 95, 99)
+        },
+        "jobs": jobs,
+        "jobs_per_second": jobs / elapsed,
+        "redis_commands_per_request": redis_ops.commands / len(results),
+        "redis_round_trips_per_request": redis_ops.round_trips / len(results),
+    }
+
+
+def main():
+    description = (
+        "Benchmark the HTTP service against local stand-ins of Redis and Bugzilla"
+    )
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument("--model", default="component", help="Model to request.")
+    parser.add_argument(
+        "--requests", type=int, default=1000, help="Number of requests to send."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="Number of concurrent clients."
+    )
+    parser.add_argument(
+        "--batch-ratio",
+        type=float,
+        default=0.1,
+        help="Ratio of batch requests, the others requesting a single bug.",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=100, help="Number of bugs per batch request."
+    )
+    parser.add_argument(
+        "--cache-hit-ratio",
+        type=float,
+        default=0.5,
+        help="Ratio of requested bugs which are already classified.",
+    )
+    parser.add_argument(
+        "--hot-bugs",
+        type=int,
+        default=100,
+        help="Number of bugs classified before the benchmark, to hit the cache.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of RQ workers, run in threads of the benchmark process.",
+    )
+    parser.add_argument(
+        "--redis-url",
+        help="Redis server to use instead of fakeredis. Its database is flushed.",
+    )
+    parser.add_argument(
+        "--dummy-models",
+        action="store_true",
+        help="Classify with stand-ins instead of the models in http_service/models.",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the generated requests."
+    )
+
+    args = parser.parse_args()
+
+    # Don't log every request.
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    report = benchmark(
+        model_name=args.model,
+        request_count=args.requests,
+        concurrency=args.concurrency,
+        batch_ratio=args.batch_ratio,
+        batch_size=args.batch_size,
+        cache_hit_ratio=args.cache_hit_ratio,
+        hot_bugs=args.hot_bugs,
+        workers=args.workers,
+        redis_url=args.redis_url,
+        dummy_models=args.dummy_models,
+        seed=args.seed,
+    )
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
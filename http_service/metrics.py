@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Prometheus metrics of the HTTP service and of the classification jobs.
+
+When the PROMETHEUS_MULTIPROC_DIR environment variable is set, the metrics of
+all the processes sharing the directory (e.g. gunicorn workers, or RQ work
+horses) are aggregated when they are scraped.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from rq.registry import StartedJobRegistry
+
+# Jobs can take a lot longer than requests.
+JOB_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, float("inf"))
+
+REQUEST_DURATION = Histogram(
+    "bugbug_http_request_duration_seconds",
+    "Duration of the requests to the service",
+    ["endpoint", "model", "status"],
+)
+CLASSIFICATION_CACHE = Counter(
+    "bugbug_classification_cache_total",
+    "Lookups of classifications in the cache, by result (hit, miss or invalidated)",
+    ["model", "result"],
+)
+LAST_CHANGE_TIME_CACHE = Counter(
+    "bugbug_last_change_time_cache_total",
+    "Lookups of bug last change times in the cache, by result (hit or miss)",
+    ["result"],
+)
+BUGZILLA_REQUEST_DURATION = Histogram(
+    "bugbug_bugzilla_request_duration_seconds",
+    "Duration of the requests to Bugzilla, by caller (service, worker or warmer)",
+    ["caller"],
+)
+JOB_DURATION = Histogram(
+    "bugbug_job_duration_seconds",
+    "Duration of the classification jobs, by step (fetch, classify, store or total)",
+    ["step"],
+    buckets=JOB_BUCKETS,
+)
+MODEL_LOAD_DURATION = Histogram(
+    "bugbug_model_load_duration_seconds",
+    "Duration of the loading of the models",
+    ["model"],
+    buckets=JOB_BUCKETS,
+)
+
+
+def observe_request(endpoint, model_names, status_code, duration):
+    REQUEST_DURATION.labels(
+        endpoint, ",".join(sorted(set(model_names))), str(status_code)
+    ).observe(duration)
+
+
+def count_classification_cache(model_name, hits, misses, invalidated):
+    for result, count in (
+        ("hit", hits),
+        ("miss", misses),
+        ("invalidated", invalidated),
+    ):
+        if count:
+            CLASSIFICATION_CACHE.labels(model_name, result).inc(count)
+
+
+def count_last_change_time_cache(hits, misses):
+    for result, count in (("hit", hits), ("miss", misses)):
+        if count:
+            LAST_CHANGE_TIME_CACHE.labels(result).inc(count)
+
+
+@contextmanager
+def timing(durations, step):
+    """Add the duration of the block to durations[step]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        durations[step] += time.perf_counter() - start
+
+
+def observe_job(durations):
+    for step, duration in durations.items():
+        JOB_DURATION.labels(step).observe(duration)
+
+
+class QueueCollector(object):
+    """Collect the number of jobs of the queues when the metrics are scraped,
+    instead of maintaining it on the request path.
+    """
+
+    def __init__(self, get_queues):
+        self.get_queues = get_queues
+
+    def get_metric(self):
+        return GaugeMetricFamily(
+            "bugbug_queue_jobs",
+            "Number of jobs in the RQ queues, by state (queued or started)",
+            labels=["queue", "state"],
+        )
+
+    def describe(self):
+        # Avoid querying Redis when the collector is registered.
+        return [self.get_metric()]
+
+    def collect(self):
+        jobs = self.get_metric()
+
+        for queue in self.get_queues():
+            jobs.add_metric([queue.name, "queued"], queue.count)
+            jobs.add_metric(
+                [queue.name, "started"], StartedJobRegistry(queue=queue).count
+            )
+
+        yield jobs
+
+
+def is_multiprocess():
+    return bool(
+        os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+        or os.environ.get("prometheus_multiproc_dir")
+    )
+
+
+def get_registry():
+    """Return the registry to expose, which aggregates the metrics of all the
+    processes in multiprocess mode.
+    """
+    if not is_multiprocess():
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def generate(registry):
+    """Return the metrics of registry in the Prometheus text format, and their
+    content type.
+    """
+    return generate_latest(registry), CONTENT_TYPE_LATEST
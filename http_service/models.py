@@ -6,15 +6,19 @@
 import json
 import logging
 import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from urllib.request import urlretrieve
 
 import requests
 from redis import Redis
 
-from bugbug import bugzilla, get_bugbug_version
+from bugbug import bug_features, bugzilla, get_bugbug_version
 from bugbug.models import load_model
 from bugbug.utils import zstd_decompress
 
+from . import metrics
+
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger()
 
@@ -22,10 +26,15 @@ MODELS_NAMES = ["defectenhancementtask", "component", "regression", "stepstorepr
 MODELS_DIR = os.path.join(os.path.dirname(__file__), "models")
 BASE_URL = "https://community-tc.services.mozilla.com/api/index/v1/task/project.relman.bugbug.train_{}.latest/artifacts/public"
 DEFAULT_EXPIRATION_TTL = 7 * 24 * 3600  # A week
+# Number of bugs fetched from Bugzilla and classified at once.
+CLASSIFY_CHUNK_SIZE = 100
 
 
 MODEL_CACHE = {}
 
+# Shared by all the jobs run by a worker, so that connections are pooled.
+REDIS_CONNECTION = None
+
 ALLOW_MISSING_MODELS = bool(int(os.environ.get("BUGBUG_ALLOW_MISSING_MODELS", "0")))
 
 
@@ -37,11 +46,22 @@ def change_time_key(model_name, bug_id):
     return f"bugbug:change_time_{model_name}_{bug_id}"
 
 
+def get_redis_connection():
+    global REDIS_CONNECTION
+
+    if REDIS_CONNECTION is None:
+        redis_url = os.environ.get("REDIS_URL", "redis://localhost/0")
+        REDIS_CONNECTION = Redis.from_url(redis_url)
+
+    return REDIS_CONNECTION
+
+
 def get_model(model_name):
     if model_name not in MODEL_CACHE:
         print("Recreating the %r model in cache" % model_name)
         try:
-            model = load_model(model_name, MODELS_DIR)
+            with metrics.MODEL_LOAD_DURATION.labels(model_name).time():
+                model = load_model(model_name, MODELS_DIR)
         except FileNotFoundError:
             if ALLOW_MISSING_MODELS:
                 print(
@@ -98,67 +118,191 @@ def retrieve_model(name):
     return file_path
 
 
-def classify_bug(
-    model_name, bug_ids, bugzilla_token, expiration=DEFAULT_EXPIRATION_TTL
+def fetch_bugs(bug_ids):
+    with metrics.BUGZILLA_REQUEST_DURATION.labels("worker").time():
+        return bugzilla.get(bug_ids)
+
+
+def store_unavailable(redis, model_name, bug_ids, expiration):
+    # TODO: Find a better error format
+    encoded_data = json.dumps({"available": False})
+
+    with redis.pipeline(transaction=False) as pipeline:
+        for bug_id in bug_ids:
+            pipeline.set(result_key(model_name, bug_id), encoded_data, ex=expiration)
+
+        pipeline.execute()
+
+
+def classify_chunk(
+    redis, model_name, model, model_extra_data, bugs, expiration, durations
 ):
-    # This should be called in a process worker so it should be safe to set
-    # the token here
-    bug_ids_set = set(map(int, bug_ids))
-    bugzilla.set_token(bugzilla_token)
-    bugs = bugzilla.get(bug_ids)
+    with metrics.timing(durations, "classify"):
+        probs = model.classify(list(bugs.values()), True)
+        indexes = probs.argmax(axis=-1)
+        suggestions = model.le.inverse_transform(indexes)
 
-    redis_url = os.environ.get("REDIS_URL", "redis://localhost/0")
-    redis = Redis.from_url(redis_url)
+    probs_list = probs.tolist()
+    indexes_list = indexes.tolist()
+    suggestions_list = suggestions.tolist()
 
-    missing_bugs = bug_ids_set.difference(bugs.keys())
+    with redis.pipeline(transaction=False) as pipeline:
+        for i, bug_id in enumerate(bugs.keys()):
+            data = {
+                "prob": probs_list[i],
+                "index": indexes_list[i],
+                "class": suggestions_list[i],
+                "extra_data": model_extra_data,
+            }
 
-    for bug_id in missing_bugs:
-        redis_key = f"result_{model_name}_{bug_id}"
+            encoded_data = json.dumps(data)
 
-        # TODO: Find a better error format
-        encoded_data = json.dumps({"available": False})
+            pipeline.set(result_key(model_name, bug_id), encoded_data, ex=expiration)
 
-        redis.set(redis_key, encoded_data)
-        redis.expire(redis_key, expiration)
+            # Save the bug last change, it is only useful as long as the result.
+            pipeline.set(
+                change_time_key(model_name, bug_id),
+                bugs[bug_id]["last_change_time"],
+                ex=expiration,
+            )
 
-    if not bugs:
-        return "NOK"
+        with metrics.timing(durations, "store"):
+            pipeline.execute()
 
-    model = get_model(model_name)
 
-    if not model:
-        print("Missing model %r, aborting" % model_name)
-        return "NOK"
+def classify_bug(
+    model_name,
+    bug_ids,
+    bugzilla_token,
+    expiration=DEFAULT_EXPIRATION_TTL,
+    chunk_size=CLASSIFY_CHUNK_SIZE,
+):
+    return classify_bugs({model_name: bug_ids}, bugzilla_token, expiration, chunk_size)
 
-    model_extra_data = model.get_extra_data()
 
-    # TODO: Classify could choke on a single bug which could make the whole
-    # job to fails. What should we do here?
-    probs = model.classify(list(bugs.values()), True)
-    indexes = probs.argmax(axis=-1)
-    suggestions = model.le.inverse_transform(indexes)
+def classify_bugs(
+    model_bug_ids,
+    bugzilla_token,
+    expiration=DEFAULT_EXPIRATION_TTL,
+    chunk_size=CLASSIFY_CHUNK_SIZE,
+):
+    """Classify bugs with several models, given as a dict from model names to
+    the bugs to classify with them.
 
-    probs_list = probs.tolist()
-    indexes_list = indexes.tolist()
-    suggestions_list = suggestions.tolist()
+    Each bug is fetched from Bugzilla only once, and the preprocessing the
+    models have in common (e.g. snapshots, cleanups) is shared between them.
+
+    Bugs are classified in chunks, fetching the next chunk from Bugzilla while
+    the current one is being classified. The results of each chunk are stored
+    as soon as it is classified. If a chunk fails, the error is logged and the
+    other chunks (and models) are still classified; no result is stored for the
+    bugs of the failed chunk, so that they are scheduled again on the next
+    request.
 
-    for i, bug_id in enumerate(bugs.keys()):
-        data = {
-            "prob": probs_list[i],
-            "index": indexes_list[i],
-            "class": suggestions_list[i],
-            "extra_data": model_extra_data,
-        }
+    The time spent waiting for the bugs, classifying them and storing the
+    results is recorded in the job duration metrics.
+    """
+    durations = Counter()
+    with metrics.timing(durations, "total"):
+        result = _classify_bugs(
+            model_bug_ids, bugzilla_token, expiration, chunk_size, durations
+        )
 
-        encoded_data = json.dumps(data)
+    metrics.observe_job(durations)
 
-        redis_key = result_key(model_name, bug_id)
+    return result
 
-        redis.set(redis_key, encoded_data)
-        redis.expire(redis_key, expiration)
 
-        # Save the bug last change
-        change_key = change_time_key(model_name, bug_id)
-        redis.set(change_key, bugs[bug_id]["last_change_time"])
+def _classify_bugs(model_bug_ids, bugzilla_token, expiration, chunk_size, durations):
+    # This should be called in a process worker so it should be safe to set
+    # the token here
+    bugzilla.set_token(bugzilla_token)
+
+    redis = get_redis_connection()
+
+    models = {}
+    for model_name in model_bug_ids:
+        model = get_model(model_name)
+
+        if not model:
+            print("Missing model %r, skipping" % model_name)
+            continue
+
+        models[model_name] = (model, model.get_extra_data())
+
+    if not models:
+        return "NOK"
+
+    # Fetch the bugs in the order they were given, each one once.
+    bug_ids = list(
+        dict.fromkeys(
+            int(bug_id) for model_name in models for bug_id in model_bug_ids[model_name]
+        )
+    )
+    model_bug_ids = {
+        model_name: set(map(int, model_bug_ids[model_name])) for model_name in models
+    }
+
+    chunks = [bug_ids[i : i + chunk_size] for i in range(0, len(bug_ids), chunk_size)]
+
+    classified = 0
+    failed_chunks = 0
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_bugs = executor.submit(fetch_bugs, chunks[0]) if chunks else None
+
+        for i, chunk in enumerate(chunks):
+            bugs_future = next_bugs
+            if i + 1 < len(chunks):
+                next_bugs = executor.submit(fetch_bugs, chunks[i + 1])
+
+            try:
+                with metrics.timing(durations, "fetch"):
+                    bugs = bugs_future.result()
+            except Exception:
+                LOGGER.exception(f"Failed to fetch bugs {chunk[0]} to {chunk[-1]}")
+                failed_chunks += 1
+                continue
+
+            with bug_features.sharing_results(len(chunk)):
+                for model_name, (model, model_extra_data) in models.items():
+                    chunk_bug_ids = model_bug_ids[model_name].intersection(chunk)
+                    if not chunk_bug_ids:
+                        continue
+
+                    try:
+                        missing_bugs = chunk_bug_ids.difference(bugs.keys())
+                        with metrics.timing(durations, "store"):
+                            store_unavailable(
+                                redis, model_name, missing_bugs, expiration
+                            )
+
+                        model_bugs = {
+                            bug_id: bug
+                            for bug_id, bug in bugs.items()
+                            if bug_id in chunk_bug_ids
+                        }
+                        if model_bugs:
+                            classify_chunk(
+                                redis,
+                                model_name,
+                                model,
+                                model_extra_data,
+                                model_bugs,
+                                expiration,
+                                durations,
+                            )
+                            classified += len(model_bugs)
+                    except Exception:
+                        LOGGER.exception(
+                            f"Failed to classify bugs {chunk[0]} to {chunk[-1]} with the {model_name} model"
+                        )
+                        failed_chunks += 1
+
+    if failed_chunks:
+        LOGGER.warning(f"{failed_chunks} chunks failed")
+
+    if not classified:
+        return "NOK"
 
     return "OK"
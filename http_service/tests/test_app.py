@@ -4,13 +4,19 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import json
+import logging
 
+import fakeredis
 import pytest
+import responses
+from prometheus_client import REGISTRY
 
+from http_service import app
 from http_service.app import (  # TODO: Move http_service under bugbug to solve this import name
     API_TOKEN,
     application,
 )
+from http_service.models import change_time_key, classify_bug, classify_bugs, result_key
 
 
 @pytest.fixture
@@ -31,6 +37,19 @@ def test_empty_batch(client):
     assert rv.json == {"errors": {"bugs": ["min length is 1"]}}
 
 
+def test_api_token_not_logged(client, caplog):
+    caplog.set_level(logging.DEBUG)
+
+    rv = client.post(
+        "/component/predict/batch",
+        data=json.dumps({"bugs": []}),
+        headers={API_TOKEN: "secret-token"},
+    )
+
+    assert rv.status_code == 400
+    assert "secret-token" not in caplog.text
+
+
 def test_too_big_batch(client):
     """Start with a blank database."""
 
@@ -69,3 +88,302 @@ def test_non_int_batch(client):
             ]
         }
     }
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(app, "redis_conn", redis)
+    monkeypatch.setattr(app, "queues", app.create_queues(redis))
+    monkeypatch.setattr(app, "batchers", app.create_batchers())
+    return redis
+
+
+def test_batch(client, redis, monkeypatch):
+    def store(bug_id, change_time):
+        redis.set(result_key("component", bug_id), json.dumps({"index": bug_id}))
+        if change_time is not None:
+            redis.set(change_time_key("component", bug_id), change_time)
+
+    # Up to date.
+    store(1, "2019-12-01")
+    # Changed since it was classified.
+    store(2, "2019-12-01")
+    # Classified by an old worker.
+    store(3, None)
+    # Security bug, its change time is unknown.
+    store(6, "2019-11-01")
+    # Being classified.
+    job = app.queues["low"].enqueue(classify_bug, "component", [4], "token")
+    job.set_status("started")
+    redis.set(app.get_mapping_key("component", 4), job.id)
+
+    monkeypatch.setattr(
+        app,
+        "get_bugs_last_change_time",
+        lambda bug_ids: {
+            bug_id: "2019-12-02" if bug_id == 2 else "2019-12-01"
+            for bug_id in bug_ids
+            # Security bugs have no change time.
+            if bug_id != 6
+        },
+    )
+
+    scheduled = []
+    monkeypatch.setattr(
+        app,
+        "schedule_bug_classification",
+        lambda model_name, bug_ids, priority: scheduled.append((bug_ids, priority)),
+    )
+
+    rv = client.post(
+        "/component/predict/batch",
+        data=json.dumps({"bugs": [1, 2, 3, 4, 5, 6]}),
+        headers={API_TOKEN: "test"},
+    )
+
+    assert rv.status_code == 202
+    assert rv.json == {
+        "bugs": {
+            "1": {"index": 1},
+            "2": {"ready": False},
+            "3": {"ready": False},
+            "4": {"ready": False},
+            "5": {"ready": False},
+            "6": {"index": 6},
+        }
+    }
+    assert scheduled == [([2, 3, 5], "low")]
+    assert redis.get(result_key("component", 1)) is not None
+    for bug_id in [2, 3]:
+        assert redis.get(result_key("component", bug_id)) is None
+        assert redis.get(change_time_key("component", bug_id)) is None
+
+
+def test_last_change_time_cache(client, redis):
+    responses.add(
+        responses.GET,
+        app.BUGZILLA_API_URL,
+        json={
+            "bugs": [
+                {"id": 1, "last_change_time": "2019-12-01"},
+                {"id": 2, "last_change_time": "2019-12-02"},
+            ]
+        },
+    )
+
+    # Bug 3 isn't returned by Bugzilla (e.g. a security bug).
+    expected = {1: "2019-12-01", 2: "2019-12-02"}
+    assert app.get_bugs_last_change_time([1, 2, 3]) == expected
+    assert len(responses.calls) == 1
+
+    # Served from the cache, without querying Bugzilla.
+    assert app.get_bugs_last_change_time([1, 2, 3]) == expected
+    assert len(responses.calls) == 1
+    assert redis.ttl(app.get_last_change_time_key(1)) <= app.LAST_CHANGE_TIME_TTL
+
+    rv = client.post(
+        "/bugs/changed", data=json.dumps({"bugs": [2]}), headers={API_TOKEN: "test"}
+    )
+    assert rv.status_code == 200
+
+    responses.replace(
+        responses.GET,
+        app.BUGZILLA_API_URL,
+        json={"bugs": [{"id": 2, "last_change_time": "2019-12-03"}]},
+    )
+
+    expected[2] = "2019-12-03"
+    assert app.get_bugs_last_change_time([1, 2, 3]) == expected
+    assert len(responses.calls) == 2
+    assert "id=2&" in responses.calls[1].request.url
+
+
+def test_models_batch(client, redis, monkeypatch):
+    redis.set(result_key("component", 1), json.dumps({"index": 1}))
+    redis.set(change_time_key("component", 1), "2019-12-01")
+    redis.set(result_key("regression", 2), json.dumps({"index": 2}))
+    redis.set(change_time_key("regression", 2), "2019-12-01")
+
+    monkeypatch.setattr(
+        app,
+        "get_bugs_last_change_time",
+        lambda bug_ids: {bug_id: "2019-12-01" for bug_id in bug_ids},
+    )
+
+    rv = client.post(
+        "/predict/batch?models=component,regression",
+        data=json.dumps({"bugs": [1, 2]}),
+        headers={API_TOKEN: "test"},
+    )
+
+    assert rv.status_code == 202
+    assert rv.json == {
+        "bugs": {
+            "1": {"component": {"index": 1}, "regression": {"ready": False}},
+            "2": {"component": {"ready": False}, "regression": {"index": 2}},
+        }
+    }
+
+    # The job is only enqueued after a short delay.
+    assert len(app.queues["low"]) == 0
+
+    rv = client.post(
+        "/predict/batch?models=regression,component",
+        data=json.dumps({"bugs": [3]}),
+        headers={API_TOKEN: "test"},
+    )
+    assert rv.status_code == 202
+
+    # The bug is already scheduled.
+    rv = client.get("/predict/1?models=regression", headers={API_TOKEN: "test"})
+    assert rv.status_code == 202
+    assert rv.json == {"regression": {"ready": False}}
+
+    app.flush_batches()
+
+    # A single job classifies the missing bugs with all the models.
+    assert len(app.queues["low"]) == 1
+    assert len(app.queues["high"]) == 0
+    job = app.queues["low"].jobs[0]
+    assert job.func == classify_bugs
+    assert job.args[0] == {"component": [2, 3], "regression": [1, 3]}
+    for bug_id in [1, 3]:
+        assert redis.get(app.get_mapping_key("regression", bug_id)) == job.id.encode()
+    job.set_status("started")
+
+    rv = client.get("/predict/1?models=regression", headers={API_TOKEN: "test"})
+    assert rv.status_code == 202
+    # The bug is already being classified.
+    app.flush_batches()
+    assert len(app.queues["low"]) == 1
+    assert len(app.queues["high"]) == 0
+
+    # Single bugs are classified from the high priority queue.
+    rv = client.get("/predict/4?models=regression", headers={API_TOKEN: "test"})
+    assert rv.status_code == 202
+    app.flush_batches()
+    assert len(app.queues["low"]) == 1
+    assert app.queues["high"].jobs[0].args[0] == {"regression": [4]}
+
+
+def test_batch_chunks(client, redis, monkeypatch):
+    monkeypatch.setattr(app, "BATCH_SIZE", 3)
+    monkeypatch.setattr(
+        app,
+        "get_bugs_last_change_time",
+        lambda bug_ids: {bug_id: "2019-12-01" for bug_id in bug_ids},
+    )
+
+    enqueue_bugs_classification = app.enqueue_bugs_classification
+
+    def enqueue(priority, job_id, model_bug_ids):
+        # The bugs are mapped to their job before it is enqueued.
+        for bug_id in model_bug_ids["component"]:
+            assert (
+                redis.get(app.get_mapping_key("component", bug_id)) == job_id.encode()
+            )
+
+        enqueue_bugs_classification(priority, job_id, model_bug_ids)
+
+    monkeypatch.setattr(app, "enqueue_bugs_classification", enqueue)
+    monkeypatch.setattr(app, "batchers", app.create_batchers())
+
+    rv = client.post(
+        "/component/predict/batch",
+        data=json.dumps({"bugs": [1, 2, 3, 4, 5, 6, 7]}),
+        headers={API_TOKEN: "test"},
+    )
+    assert rv.status_code == 202
+
+    # The full chunks are enqueued right away.
+    assert [job.args[0] for job in app.queues["low"].jobs] == [
+        {"component": [1, 2, 3]},
+        {"component": [4, 5, 6]},
+    ]
+
+    app.flush_batches()
+
+    jobs = app.queues["low"].jobs
+    assert jobs[-1].args[0] == {"component": [7]}
+    for job, bug_ids in zip(jobs, [[1, 2, 3], [4, 5, 6], [7]]):
+        for bug_id in bug_ids:
+            assert (
+                redis.get(app.get_mapping_key("component", bug_id)) == job.id.encode()
+            )
+
+
+def test_models_unknown(client):
+    rv = client.get("/predict/1?models=component,unknown", headers={API_TOKEN: "test"})
+
+    assert rv.status_code == 400
+    assert rv.json == {"errors": {"models": [{"1": ["unallowed value unknown"]}]}}
+
+    rv = client.get("/predict/1", headers={API_TOKEN: "test"})
+
+    assert rv.status_code == 400
+    assert rv.json == {"errors": {"models": ["min length is 1"]}}
+
+
+def get_sample_value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics(client, redis, monkeypatch):
+    redis.set(result_key("component", 1), json.dumps({"index": 1}))
+    redis.set(change_time_key("component", 1), "2019-12-01")
+    redis.set(result_key("component", 2), json.dumps({"index": 2}))
+    redis.set(change_time_key("component", 2), "2019-11-01")
+
+    monkeypatch.setattr(
+        app,
+        "get_bugs_last_change_time",
+        lambda bug_ids: {bug_id: "2019-12-01" for bug_id in bug_ids},
+    )
+
+    cache_results = ["hit", "miss", "invalidated"]
+    request_labels = {
+        "endpoint": "/<model_name>/predict/batch",
+        "model": "component",
+        "status": "202",
+    }
+
+    def get_values():
+        return [
+            get_sample_value(
+                "bugbug_classification_cache_total", model="component", result=result
+            )
+            for result in cache_results
+        ] + [
+            get_sample_value(
+                "bugbug_http_request_duration_seconds_count", **request_labels
+            )
+        ]
+
+    before = get_values()
+
+    rv = client.post(
+        "/component/predict/batch",
+        data=json.dumps({"bugs": [1, 2, 3]}),
+        headers={API_TOKEN: "test"},
+    )
+    assert rv.status_code == 202
+
+    # A hit for bug 1, an invalidation for bug 2 and a miss for bug 3.
+    assert [after - before for after, before in zip(get_values(), before)] == [
+        1,
+        1,
+        1,
+        1,
+    ]
+
+    app.flush_batches()
+
+    rv = client.get("/metrics")
+    assert rv.status_code == 200
+    assert rv.content_type.startswith("text/plain")
+
+    text = rv.get_data(as_text=True)
+    assert 'bugbug_queue_jobs{queue="low",state="queued"} 1.0' in text
+    assert 'bugbug_queue_jobs{queue="high",state="queued"} 0.0' in text
+    assert "bugbug_http_request_duration_seconds_bucket{" in text
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+
+import fakeredis
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+from http_service import app, async_app
+from http_service.models import change_time_key, classify_bug, result_key
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    redis = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(app, "redis_conn", redis)
+    monkeypatch.setattr(app, "queues", app.create_queues(redis))
+    monkeypatch.setattr(app, "batchers", app.create_batchers())
+    monkeypatch.setattr(
+        async_app, "redis_conn", fakeredis.aioredis.FakeRedis(server=server)
+    )
+    return redis
+
+
+@pytest.fixture
+def bugzilla_requests(monkeypatch):
+    bugzilla_requests = []
+
+    def handler(request):
+        bugzilla_requests.append(request)
+        bug_ids = request.url.params["id"].split(",")
+        return httpx.Response(
+            200,
+            json={
+                "bugs": [
+                    {"id": int(bug_id), "last_change_time": "2019-12-01"}
+                    for bug_id in bug_ids
+                ]
+            },
+        )
+
+    monkeypatch.setattr(
+        async_app,
+        "BUGBUG_HTTP_CLIENT",
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    return bugzilla_requests
+
+
+@pytest.fixture
+def client(redis, bugzilla_requests):
+    with TestClient(async_app.application) as client:
+        yield client
+
+
+def test_unauthorized(client):
+    rv = client.get("/component/predict/1")
+
+    assert rv.status_code == 401
+    assert rv.json() == {"message": "Error, missing X-API-KEY"}
+
+
+def test_invalid_batch(client):
+    rv = client.post(
+        "/component/predict/batch",
+        content=json.dumps({"bugs": ["1"]}),
+        headers={app.API_TOKEN: "test"},
+    )
+
+    assert rv.status_code == 400
+    assert rv.json() == {"errors": {"bugs": [{"0": ["must be of integer type"]}]}}
+
+
+def test_predict(client, redis, bugzilla_requests):
+    rv = client.get("/component/predict/1", headers={app.API_TOKEN: "test"})
+
+    assert rv.status_code == 202
+    assert rv.json() == {"ready": False}
+    app.flush_batches()
+    assert len(app.queues["high"]) == 1
+
+    # The bug is being classified, it isn't scheduled again.
+    app.queues["high"].jobs[0].set_status("started")
+    rv = client.get("/component/predict/1", headers={app.API_TOKEN: "test"})
+    assert rv.status_code == 202
+    assert len(app.queues["high"]) == 1
+
+    redis.set(result_key("component", 1), json.dumps({"index": 1}))
+    redis.set(change_time_key("component", 1), "2019-12-01")
+
+    rv = client.get("/component/predict/1", headers={app.API_TOKEN: "test"})
+    assert rv.status_code == 200
+    assert rv.json() == {"index": 1}
+
+    # The change time was only fetched once.
+    assert len(bugzilla_requests) == 1
+
+
+def test_batch(client, redis, bugzilla_requests):
+    redis.set(result_key("component", 1), json.dumps({"index": 1}))
+    redis.set(change_time_key("component", 1), "2019-12-01")
+    # Changed since it was classified.
+    redis.set(result_key("component", 2), json.dumps({"index": 2}))
+    redis.set(change_time_key("component", 2), "2019-11-01")
+    job = app.queues["low"].enqueue(classify_bug, "component", [3], "token")
+    job.set_status("started")
+    redis.set(app.get_mapping_key("component", 3), job.id)
+
+    rv = client.post(
+        "/component/predict/batch",
+        content=json.dumps({"bugs": [1, 2, 3, 4]}),
+        headers={app.API_TOKEN: "test"},
+    )
+
+    assert rv.status_code == 202
+    assert rv.json() == {
+        "bugs": {
+            "1": {"index": 1},
+            "2": {"ready": False},
+            "3": {"ready": False},
+            "4": {"ready": False},
+        }
+    }
+    app.flush_batches()
+    assert app.queues["low"].jobs[-1].args == ({"component": [2, 4]}, None)
+
+    rv = client.post(
+        "/bugs/changed",
+        content=json.dumps({"bugs": [1]}),
+        headers={app.API_TOKEN: "test"},
+    )
+    assert rv.status_code == 200
+    assert redis.get(app.get_last_change_time_key(1)) is None
+    assert redis.get(app.get_last_change_time_key(2)) is not None
+
+
+def test_swagger(client):
+    rv = client.get("/swagger")
+
+    assert rv.status_code == 200
+    assert rv.json() == app.application.test_client().get("/swagger").json
+    assert "/{model_name}/predict/batch" in rv.json()["paths"]
+
+    rv = client.get("/doc")
+    assert rv.status_code == 200
+    assert "/swagger" in rv.text
+
+
+def test_models_prediction(client, redis, bugzilla_requests):
+    redis.set(result_key("component", 1), json.dumps({"index": 1}))
+    redis.set(change_time_key("component", 1), "2019-12-01")
+
+    rv = client.get(
+        "/predict/1?models=component,regression", headers={app.API_TOKEN: "test"}
+    )
+
+    assert rv.status_code == 202
+    assert rv.json() == {"component": {"index": 1}, "regression": {"ready": False}}
+    app.flush_batches()
+    assert app.queues["high"].jobs[-1].args == ({"regression": [1]}, None)
+
+    rv = client.post(
+        "/predict/batch?models=component",
+        content=json.dumps({"bugs": [1]}),
+        headers={app.API_TOKEN: "test"},
+    )
+
+    assert rv.status_code == 200
+    assert rv.json() == {"bugs": {"1": {"component": {"index": 1}}}}
+    assert len(bugzilla_requests) == 1
+
+    rv = client.get("/predict/1?models=unknown", headers={app.API_TOKEN: "test"})
+    assert rv.status_code == 400
+
+
+def test_metrics(client, redis):
+    rv = client.get("/component/predict/1", headers={app.API_TOKEN: "test"})
+    assert rv.status_code == 202
+
+    rv = client.get("/metrics")
+    assert rv.status_code == 200
+    assert rv.headers["Content-Type"].startswith("text/plain")
+    assert (
+        'bugbug_http_request_duration_seconds_count{endpoint="/{model_name}/predict/{bug_id:int}",model="component",status="202"}'
+        in rv.text
+    )
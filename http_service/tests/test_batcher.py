@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+
+from http_service.batcher import ClassificationBatcher
+
+
+def get_job_id(job_bug_ids):
+    assert len(job_bug_ids) == 1
+    return next(iter(job_bug_ids))
+
+
+def test_batcher_latency():
+    enqueued = []
+    done = threading.Event()
+
+    def enqueue(job_id, model_bug_ids):
+        enqueued.append((job_id, model_bug_ids))
+        done.set()
+
+    batcher = ClassificationBatcher(0.1, 100, enqueue)
+
+    job_id = get_job_id(batcher.add({"component": [1, 2]}))
+    assert batcher.add({"component": [2, 3], "regression": [1]}) == {
+        job_id: {"component": [2, 3], "regression": [1]}
+    }
+    assert batcher.is_pending(job_id)
+    assert enqueued == []
+
+    assert done.wait(10)
+    assert enqueued == [(job_id, {"component": [1, 2, 3], "regression": [1]})]
+    assert not batcher.is_pending(job_id)
+
+    # A new batch is opened.
+    assert get_job_id(batcher.add({"component": [1]})) != job_id
+
+
+def test_batcher_max_size():
+    enqueued = []
+    batcher = ClassificationBatcher(60, 3, lambda *args: enqueued.append(args))
+
+    job_id = get_job_id(batcher.add({"component": [1, 2]}))
+    assert get_job_id(batcher.add({"regression": [1, 2]})) == job_id
+    assert enqueued == []
+
+    # The batch is submitted as soon as it contains enough bugs.
+    assert get_job_id(batcher.add({"component": [3]})) == job_id
+    assert enqueued == [(job_id, {"component": [1, 2, 3], "regression": [1, 2]})]
+
+    other_job_id = get_job_id(batcher.add({"component": [4]}))
+    assert other_job_id != job_id
+
+    # Flushing a batch which was already submitted does nothing.
+    batcher.flush(job_id)
+    assert len(enqueued) == 1
+
+    batcher.flush()
+    assert enqueued[1] == (other_job_id, {"component": [4]})
+
+
+def test_batcher_split():
+    enqueued = []
+    batcher = ClassificationBatcher(60, 3, lambda *args: enqueued.append(args))
+
+    first_job_id = get_job_id(batcher.add({"component": [1]}))
+
+    # The bugs which don't fit in the current batch are added to the next ones.
+    job_bug_ids = batcher.add(
+        {"component": [2, 3, 4, 5, 6, 7, 8], "regression": [2, 8]}
+    )
+    assert len(job_bug_ids) == 3
+    assert list(job_bug_ids.items())[0] == (
+        first_job_id,
+        {"component": [2, 3], "regression": [2]},
+    )
+    assert list(job_bug_ids.values())[1:] == [
+        {"component": [4, 5, 6]},
+        {"component": [7, 8], "regression": [8]},
+    ]
+
+    assert [job_id for job_id, model_bug_ids in enqueued] == list(job_bug_ids)[:2]
+    assert enqueued[0][1] == {"component": [1, 2, 3], "regression": [2]}
+
+    batcher.flush()
+    assert enqueued[2] == (
+        list(job_bug_ids)[2],
+        {"component": [7, 8], "regression": [8]},
+    )
+
+
+def test_batcher_no_latency():
+    enqueued = []
+    batcher = ClassificationBatcher(0, 2, lambda *args: enqueued.append(args))
+
+    job_bug_ids = batcher.add({"component": [1, 2, 3]})
+    assert enqueued == list(job_bug_ids.items())
+    assert [model_bug_ids for job_id, model_bug_ids in enqueued] == [
+        {"component": [1, 2]},
+        {"component": [3]},
+    ]
+    assert not any(batcher.is_pending(job_id) for job_id in job_bug_ids)
+
+
+def test_batcher_enqueue_failure():
+    def enqueue(job_id, model_bug_ids):
+        raise Exception("Redis is down")
+
+    batcher = ClassificationBatcher(60, 100, enqueue)
+
+    job_id = get_job_id(batcher.add({"component": [1]}))
+    batcher.flush()
+    assert not batcher.is_pending(job_id)
+
+
+def test_batcher_record():
+    events = []
+    batcher = ClassificationBatcher(
+        60, 2, lambda job_id, model_bug_ids: events.append(("enqueue", job_id))
+    )
+
+    def record(job_bug_ids):
+        events.append(("record", list(job_bug_ids)))
+
+    # The jobs of full batches are recorded before they are submitted.
+    job_bug_ids = batcher.add({"component": [1, 2, 3]}, record)
+    first_job_id, second_job_id = job_bug_ids
+    assert events == [
+        ("record", [first_job_id, second_job_id]),
+        ("enqueue", first_job_id),
+    ]
+    assert not batcher.is_pending(first_job_id)
+    assert batcher.is_pending(second_job_id)
+
+
+def test_batcher_flush_while_recording():
+    enqueued = []
+    batcher = ClassificationBatcher(60, 100, lambda *args: enqueued.append(args))
+
+    def record(job_bug_ids):
+        # The batch is flushed (e.g. by its timer) while its jobs are recorded.
+        batcher.flush(job_id)
+        assert enqueued == []
+        assert batcher.is_pending(job_id)
+
+    job_id = get_job_id(batcher.add({"component": [1]}))
+    batcher.add({"component": [2]}, record)
+
+    assert enqueued == [(job_id, {"component": [1, 2]})]
+    assert not batcher.is_pending(job_id)
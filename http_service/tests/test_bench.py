@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import random
+
+import pytest
+from libmozdata.bugzilla import Bugzilla
+
+from bugbug import bugzilla
+from http_service import bench
+
+
+@pytest.mark.withoutresponses
+def test_stub_bugzilla(monkeypatch):
+    fixture_bugs = bench.load_fixture_bugs()
+
+    with bench.serving(bench.get_bugzilla_server(fixture_bugs)) as url:
+        monkeypatch.setattr(Bugzilla, "API_URL", f"{url}/rest/bug")
+        bugs = bugzilla.get([len(fixture_bugs), bench.COLD_BUG_ID])
+
+    assert set(bugs) == {len(fixture_bugs), bench.COLD_BUG_ID}
+
+    bug = bugs[len(fixture_bugs)]
+    assert bug["id"] == len(fixture_bugs)
+    for field in ["summary", "last_change_time", "comments", "history", "attachments"]:
+        assert bug[field] == fixture_bugs[0][field]
+
+
+def test_generate_requests():
+    bench_requests = list(
+        bench.generate_requests(random.Random(0), 200, 0.25, 10, 0.5, [1, 2, 3])
+    )
+    assert len(bench_requests) == 200
+
+    batches = [bug_ids for batch, bug_ids in bench_requests if batch]
+    assert 0 < len(batches) < 100
+    assert all(len(bug_ids) == 1 for batch, bug_ids in bench_requests if not batch)
+
+    bug_ids = [bug_id for batch, bug_ids in bench_requests for bug_id in bug_ids]
+    cold_bug_ids = [bug_id for bug_id in bug_ids if bug_id >= bench.COLD_BUG_ID]
+    assert len(cold_bug_ids) == len(set(cold_bug_ids))
+    assert set(bug_ids) - set(cold_bug_ids) == {1, 2, 3}
+
+
+@pytest.mark.withoutresponses
+def test_benchmark():
+    report = bench.benchmark(
+        request_count=20,
+        concurrency=4,
+        batch_ratio=0.2,
+        batch_size=5,
+        cache_hit_ratio=0.5,
+        hot_bugs=5,
+        dummy_models=True,
+    )
+
+    assert report["requests"] == 20
+    assert sum(report["status_codes"].values()) == 20
+    assert set(report["status_codes"]) <= {200, 202}
+    assert set(report["latency_ms"]) == {"p50", "p95", "p99"}
+    assert report["jobs"] > 0
+    assert report["redis_commands_per_request"] > 0
+    assert report["redis_round_trips_per_request"] > 0
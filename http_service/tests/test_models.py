@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import threading
+from types import SimpleNamespace
+
+import fakeredis
+import numpy as np
+import pytest
+from prometheus_client import REGISTRY
+
+from bugbug import bug_features
+from http_service import models
+
+
+class MockModel(object):
+    def __init__(self):
+        self.le = SimpleNamespace(
+            inverse_transform=lambda indexes: np.array(["no", "yes"])[indexes]
+        )
+        self.classified = []
+
+    def get_extra_data(self):
+        return {"extra": True}
+
+    def classify(self, bugs, probabilities=False):
+        assert probabilities
+        self.classified.append([bug["id"] for bug in bugs])
+
+        if any(bug["id"] == 13 for bug in bugs):
+            raise Exception("Unlucky bug")
+
+        return np.array([[0.1, 0.9] if bug["id"] % 2 else [0.8, 0.2] for bug in bugs])
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(models, "REDIS_CONNECTION", redis)
+    return redis
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = MockModel()
+    monkeypatch.setitem(models.MODEL_CACHE, "test", model)
+    return model
+
+
+def test_classify_bug(monkeypatch, redis, model):
+    fetched = []
+    second_chunk_fetched = threading.Event()
+
+    def bugzilla_get(bug_ids):
+        fetched.append(bug_ids)
+
+        if bug_ids[0] == 4:
+            second_chunk_fetched.set()
+        elif bug_ids[0] == 7:
+            raise Exception("Bugzilla is down")
+
+        # Bug 2 doesn't exist.
+        return {
+            bug_id: {"id": bug_id, "last_change_time": f"2019-12-{bug_id:02}"}
+            for bug_id in bug_ids
+            if bug_id != 2
+        }
+
+    monkeypatch.setattr(models.bugzilla, "get", bugzilla_get)
+
+    classify = model.classify
+
+    def classify_while_fetching(bugs, probabilities=False):
+        # The next chunk is fetched while the current one is classified.
+        if bugs[0]["id"] == 1:
+            assert second_chunk_fetched.wait(10)
+
+        return classify(bugs, probabilities)
+
+    model.classify = classify_while_fetching
+
+    bug_ids = [1, 2, 3, 4, 5, 6, 7, 8, 9, 12, 13, 14]
+    assert models.classify_bug("test", bug_ids, "token", chunk_size=3) == "OK"
+
+    assert fetched == [[1, 2, 3], [4, 5, 6], [7, 8, 9], [12, 13, 14]]
+    assert model.classified == [[1, 3], [4, 5, 6], [12, 13, 14]]
+
+    assert json.loads(redis.get(models.result_key("test", 1))) == {
+        "prob": [0.1, 0.9],
+        "index": 1,
+        "class": "yes",
+        "extra_data": {"extra": True},
+    }
+    assert redis.get(models.change_time_key("test", 6)) == b"2019-12-06"
+    assert redis.ttl(models.result_key("test", 6)) > 0
+    assert redis.ttl(models.change_time_key("test", 6)) > 0
+    assert json.loads(redis.get(models.result_key("test", 2))) == {"available": False}
+
+    # Nothing is stored for the bugs of the chunks which failed, so they can be
+    # classified again.
+    for bug_id in [7, 8, 9, 12, 13, 14]:
+        assert redis.get(models.result_key("test", bug_id)) is None
+        assert redis.get(models.change_time_key("test", bug_id)) is None
+
+
+def test_classify_bug_all_failed(monkeypatch, redis, model):
+    def bugzilla_get(bug_ids):
+        raise Exception("Bugzilla is down")
+
+    monkeypatch.setattr(models.bugzilla, "get", bugzilla_get)
+
+    assert models.classify_bug("test", [1, 2], "token") == "NOK"
+    assert redis.keys() == []
+
+
+def test_classify_bugs(monkeypatch, redis, model):
+    other_model = MockModel()
+    monkeypatch.setitem(models.MODEL_CACHE, "other", other_model)
+
+    fetched = []
+
+    def bugzilla_get(bug_ids):
+        fetched.append(bug_ids)
+        return {
+            bug_id: {"id": bug_id, "last_change_time": "2019-12-01"}
+            for bug_id in bug_ids
+        }
+
+    monkeypatch.setattr(models.bugzilla, "get", bugzilla_get)
+
+    shared_results = []
+    classify = other_model.classify
+
+    def classify_sharing(bugs, probabilities=False):
+        shared_results.append(bug_features.shared_results)
+        return classify(bugs, probabilities)
+
+    other_model.classify = classify_sharing
+
+    def get_job_counts():
+        return [
+            REGISTRY.get_sample_value(
+                "bugbug_job_duration_seconds_count", {"step": step}
+            )
+            or 0
+            for step in ["fetch", "classify", "store", "total"]
+        ]
+
+    job_counts = get_job_counts()
+
+    result = models.classify_bugs(
+        {"test": [1, 2, 3, 4], "other": [3, 4, 13, 14, 15]}, "token", chunk_size=2
+    )
+    assert result == "OK"
+
+    # The duration of each step of the job is recorded once.
+    assert [after - before for after, before in zip(get_job_counts(), job_counts)] == [
+        1,
+        1,
+        1,
+        1,
+    ]
+
+    # Each bug is fetched once, even when classified by several models.
+    assert fetched == [[1, 2], [3, 4], [13, 14], [15]]
+    assert model.classified == [[1, 2], [3, 4]]
+    assert other_model.classified == [[3, 4], [13, 14], [15]]
+
+    # The models share the results computed from the bugs.
+    assert all(shared is not None for shared in shared_results)
+    assert bug_features.shared_results is None
+
+    for bug_id in [1, 2, 3, 4]:
+        assert redis.get(models.result_key("test", bug_id)) is not None
+    for bug_id in [3, 4, 15]:
+        assert redis.get(models.result_key("other", bug_id)) is not None
+    for bug_id in [13, 14]:
+        assert redis.get(models.result_key("other", bug_id)) is None
+    assert redis.get(models.result_key("test", 15)) is None
+
+
+def test_classify_bugs_missing_model(monkeypatch, redis, model):
+    def load_model(model_name, models_dir):
+        raise FileNotFoundError()
+
+    monkeypatch.setattr(models, "ALLOW_MISSING_MODELS", True)
+    monkeypatch.setattr(models, "load_model", load_model)
+    monkeypatch.setattr(
+        models.bugzilla,
+        "get",
+        lambda bug_ids: {
+            bug_id: {"id": bug_id, "last_change_time": ""} for bug_id in bug_ids
+        },
+    )
+
+    assert models.classify_bugs({"missing": [1], "test": [2]}, "token") == "OK"
+    assert model.classified == [[2]]
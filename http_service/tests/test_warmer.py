@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import fakeredis
+import pytest
+import responses
+
+from http_service import app, warmer
+from http_service.models import change_time_key
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(app, "redis_conn", redis)
+    monkeypatch.setattr(app, "queues", app.create_queues(redis))
+    monkeypatch.setattr(app, "batchers", app.create_batchers())
+    monkeypatch.setattr(warmer, "MODELS_NAMES", ["component", "regression"])
+    return redis
+
+
+def add_changed_bugs(change_times, add=responses.add):
+    add(
+        responses.GET,
+        app.BUGZILLA_API_URL,
+        json={
+            "bugs": [
+                {"id": bug_id, "last_change_time": change_time}
+                for bug_id, change_time in change_times.items()
+            ]
+        },
+    )
+
+
+def test_warm(redis, monkeypatch):
+    monkeypatch.setattr(app, "BATCH_SIZE", 2)
+    monkeypatch.setattr(app, "batchers", app.create_batchers())
+
+    # Bug 1 is already classified by the component model for its last change.
+    redis.set(change_time_key("component", 1), "2019-12-01T10:00:00Z")
+    # Bug 2 was classified before its last change.
+    redis.set(change_time_key("component", 2), "2019-12-01T09:00:00Z")
+
+    add_changed_bugs(
+        {
+            1: "2019-12-01T10:00:00Z",
+            2: "2019-12-01T10:00:00Z",
+            3: "2019-12-01T11:00:00Z",
+        }
+    )
+
+    assert warmer.warm() == 3
+
+    assert "last_change_time=" in responses.calls[0].request.url
+    # Each job classifies its bugs with all the models.
+    assert [
+        {model_name: sorted(bug_ids) for model_name, bug_ids in job.args[0].items()}
+        for job in app.queues["low"].jobs
+    ] == [
+        {"component": [2], "regression": [1, 2]},
+        {"component": [3], "regression": [3]},
+    ]
+    assert app.queues["high"].count == 0
+
+    # The last change times are cached for the requests for these bugs.
+    assert redis.get(app.get_last_change_time_key(3)) == b"2019-12-01T11:00:00Z"
+
+    # The next poll starts from the most recent change.
+    add_changed_bugs({3: "2019-12-01T11:00:00Z"}, responses.replace)
+    assert redis.get(warmer.CURSOR_KEY) == b"2019-12-01T11:00:00Z"
+
+    for model_name in ("component", "regression"):
+        redis.set(change_time_key(model_name, 3), "2019-12-01T11:00:00Z")
+
+    assert warmer.warm() == 0
+    assert "last_change_time=2019-12-01T11%3A00%3A00Z" in responses.calls[1].request.url
+    assert len(app.queues["low"].jobs) == 2
+
+
+def test_warm_queue_busy(redis, monkeypatch):
+    monkeypatch.setattr(warmer, "WARMER_MAX_QUEUED_JOBS", 0)
+    redis.set(warmer.CURSOR_KEY, "2019-12-01T10:00:00Z")
+    app.enqueue_bugs_classification(app.LOW_PRIORITY, "job", {"component": [1]})
+
+    assert warmer.warm() is None
+    assert len(responses.calls) == 0
+    assert redis.get(warmer.CURSOR_KEY) == b"2019-12-01T10:00:00Z"
+
+
+def test_warm_bugzilla_error(redis):
+    redis.set(warmer.CURSOR_KEY, "2019-12-01T10:00:00Z")
+    responses.add(responses.GET, app.BUGZILLA_API_URL, status=500)
+
+    with pytest.raises(Exception):
+        warmer.warm()
+
+    # The cursor doesn't move, the bugs will be polled again.
+    assert redis.get(warmer.CURSOR_KEY) == b"2019-12-01T10:00:00Z"
+    assert app.queues["low"].count == 0
+
+
+def test_get_next_cursor():
+    cursor = "2019-12-01T10:00:00Z"
+
+    assert warmer.get_next_cursor(cursor, {}, 2) == cursor
+    assert (
+        warmer.get_next_cursor(
+            cursor, {1: "2019-12-01T10:00:00Z", 2: "2019-12-01T10:30:00Z"}, 2
+        )
+        == "2019-12-01T10:30:00Z"
+    )
+    # Bugs changed at the cursor are returned again, unless there are too many
+    # of them to ever get past it.
+    assert warmer.get_next_cursor(cursor, {1: cursor}, 2) == cursor
+    assert (
+        warmer.get_next_cursor(cursor, {1: cursor, 2: cursor}, 2)
+        == "2019-12-01T10:00:01Z"
+    )
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Warm the cache of classifications with the recently changed bugs, so that
+they are ready by the time they are requested.
+
+Bugzilla is polled every WARMER_INTERVAL seconds for the bugs changed since the
+cursor stored in Redis, up to WARMER_MAX_BUGS bugs at a time. The bugs which
+aren't classified for their last change yet are scheduled with the low
+priority, in batches classified by all the models at once. A single warmer
+should run at a time:
+
+    python -m http_service.warmer
+"""
+
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from bugbug.bugzilla import PRODUCTS
+
+from . import app, metrics
+from .models import MODELS_NAMES, change_time_key
+
+LOGGER = logging.getLogger()
+
+WARMER_INTERVAL = int(os.environ.get("BUGBUG_WARMER_INTERVAL", "60"))
+WARMER_MAX_BUGS = int(os.environ.get("BUGBUG_WARMER_MAX_BUGS", "500"))
+# Polls are skipped while more jobs than this wait in the low priority queue,
+# so that the warmer doesn't pile up work faster than the workers do it.
+WARMER_MAX_QUEUED_JOBS = int(os.environ.get("BUGBUG_WARMER_MAX_QUEUED_JOBS", "10"))
+# How far back to look for changed bugs when there is no cursor yet.
+WARMER_LOOKBACK = timedelta(hours=1)
+
+CURSOR_KEY = "bugbug:warmer_cursor"
+BUGZILLA_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def get_initial_cursor():
+    return (datetime.utcnow() - WARMER_LOOKBACK).strftime(BUGZILLA_DATE_FORMAT)
+
+
+def get_changed_bugs_query(cursor, limit):
+    return {
+        "last_change_time": cursor,
+        "product": PRODUCTS,
+        "include_fields": ["id", "last_change_time"],
+        "order": "changeddate,bug_id",
+        "limit": limit,
+    }
+
+
+def fetch_changed_bugs(cursor, limit):
+    """Return the last change time of the bugs changed at cursor or later, up to
+    limit bugs, starting from the least recently changed.
+    """
+    headers = dict(app.BUGZILLA_HEADERS)
+    if app.BUGZILLA_TOKEN:
+        headers["X-Bugzilla-API-Key"] = app.BUGZILLA_TOKEN
+
+    # Requests which are rate limited by Bugzilla are retried by the client,
+    # after the delay it asks for.
+    with metrics.BUGZILLA_REQUEST_DURATION.labels("warmer").time():
+        response = app.BUGBUG_HTTP_CLIENT.get(
+            app.BUGZILLA_API_URL,
+            params=get_changed_bugs_query(cursor, limit),
+            headers=headers,
+            timeout=30,
+        )
+    response.raise_for_status()
+
+    return app.parse_bugs_last_change_time(response.json())
+
+
+def get_next_cursor(cursor, bugs, limit):
+    if not bugs:
+        return cursor
+
+    # The change times have the same format, they can be compared as strings.
+    next_cursor = max(bugs.values())
+
+    # Bugzilla returns the bugs changed at the cursor or later, so a full page
+    # of bugs changed at the same time as the cursor would be polled forever.
+    if len(bugs) >= limit and next_cursor == cursor:
+        next_cursor = (
+            datetime.strptime(cursor, BUGZILLA_DATE_FORMAT) + timedelta(seconds=1)
+        ).strftime(BUGZILLA_DATE_FORMAT)
+        LOGGER.warning(
+            f"More than {limit} bugs were changed at {cursor}, skipping to {next_cursor}"
+        )
+
+    return next_cursor
+
+
+def get_model_bug_ids(bugs):
+    """Return the bugs which aren't classified for their last change yet, for
+    each model.
+    """
+    bug_ids = list(bugs)
+    change_times = app.redis_conn.mget(
+        [
+            change_time_key(model_name, bug_id)
+            for model_name in MODELS_NAMES
+            for bug_id in bug_ids
+        ]
+    )
+
+    model_bug_ids = {}
+    for i, model_name in enumerate(MODELS_NAMES):
+        model_change_times = change_times[i * len(bug_ids) : (i + 1) * len(bug_ids)]
+
+        missing_bug_ids = [
+            bug_id
+            for bug_id, change_time in zip(bug_ids, model_change_times)
+            if change_time is None or change_time.decode("utf-8") != bugs[bug_id]
+        ]
+        if missing_bug_ids:
+            model_bug_ids[model_name] = missing_bug_ids
+
+    return model_bug_ids
+
+
+def warm(limit=WARMER_MAX_BUGS):
+    """Schedule the classification of the bugs changed since the cursor, and
+    move it forward.
+
+    Return the number of bugs which were scheduled, or None if the workers are
+    too busy for the bugs to be polled.
+    """
+    queued_jobs = len(app.queues[app.LOW_PRIORITY])
+    if queued_jobs > WARMER_MAX_QUEUED_JOBS:
+        LOGGER.info(f"{queued_jobs} jobs are queued, not polling the changed bugs")
+        return None
+
+    cursor = app.redis_conn.get(CURSOR_KEY)
+    cursor = cursor.decode("utf-8") if cursor is not None else get_initial_cursor()
+
+    bugs = fetch_changed_bugs(cursor, limit)
+
+    # The requests for these bugs won't need to query Bugzilla either.
+    with app.redis_conn.pipeline(transaction=False) as pipeline:
+        app.cache_last_change_times(pipeline, bugs.keys(), bugs)
+        pipeline.execute()
+
+    model_bug_ids = get_model_bug_ids(bugs)
+    scheduled_bug_ids = [
+        bug_id
+        for bug_id in bugs
+        if any(bug_id in ids for ids in model_bug_ids.values())
+    ]
+
+    # Schedule the bugs by chunks of a batch, so that each bug is fetched by a
+    # single job for all the models.
+    for i in range(0, len(scheduled_bug_ids), app.BATCH_SIZE):
+        chunk = set(scheduled_bug_ids[i : i + app.BATCH_SIZE])
+        chunk_model_bug_ids = {
+            model_name: [bug_id for bug_id in bug_ids if bug_id in chunk]
+            for model_name, bug_ids in model_bug_ids.items()
+        }
+        app.schedule_bugs_classification(
+            {
+                model_name: bug_ids
+                for model_name, bug_ids in chunk_model_bug_ids.items()
+                if bug_ids
+            },
+            app.LOW_PRIORITY,
+        )
+    app.flush_batches()
+
+    # The cursor is only moved once the bugs are scheduled, so that none is
+    # missed if the warmer is interrupted.
+    app.redis_conn.set(CURSOR_KEY, get_next_cursor(cursor, bugs, limit))
+
+    LOGGER.info(
+        f"{len(bugs)} bugs changed since {cursor}, {len(scheduled_bug_ids)} scheduled"
+    )
+
+    return len(scheduled_bug_ids)
+
+
+def main():
+    while True:
+        start = time.monotonic()
+
+        try:
+            warm()
+        except Exception:
+            LOGGER.exception("Failed to warm the cache")
+
+        time.sleep(max(0, WARMER_INTERVAL - (time.monotonic() - start)))
+
+
+if __name__ == "__main__":
+    main()
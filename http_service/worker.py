@@ -6,6 +6,7 @@
 
 import os
 import sys
+import tempfile
 from os.path import abspath, dirname, join
 
 from redis import Redis
@@ -13,22 +14,37 @@ from rq import Connection, Worker
 
 sys.path.insert(0, abspath(join(dirname(__file__), "..")))
 
+# The jobs are run in forked processes, which share their metrics through
+# files. This has to be set before the metrics are created.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="bugbug_metrics_")
+)
+
 # We need to make sure that the models.py file is imported with the same name
 # than in the HTTP docker container or the cache will not match. If we import
 # it as models, the cache will be located at
 # `sys.modules['models'].MODEL_CACHE` while the job will look the models in
 # `sys.modules['http_service.models'].MODEL_CACHE`
 import http_service.models  # noqa: E402 isort:skip
+from http_service import metrics  # noqa: E402 isort:skip
+from prometheus_client import start_http_server  # noqa: E402 isort:skip
 
 # Preload libraries
 http_service.models.preload_models()
 
+# Expose the metrics of the jobs, when a port is given
+metrics_port = os.environ.get("BUGBUG_WORKER_METRICS_PORT")
+if metrics_port:
+    start_http_server(int(metrics_port), registry=metrics.get_registry())
+
 # Provide queue names to listen to as arguments to this script,
 # similar to rq worker
 redis_url = os.environ.get("REDIS_URL", "redis://localhost/0")
 redis_conn = Redis.from_url(redis_url)
 with Connection(connection=redis_conn):
-    qs = sys.argv[1:] or ["default"]
+    # Jobs are taken from the first queue which isn't empty, so the high
+    # priority one is drained first.
+    qs = sys.argv[1:] or ["high", "default", "low"]
 
     w = Worker(qs)
     w.work()
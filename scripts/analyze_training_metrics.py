@@ -29,6 +29,15 @@ ABSOLUTE_THRESHOLD = 0.1
 
 REPORT_METRICS = ["accuracy", "precision", "recall"]
 
+# The time and memory used by the training stages are compared to the median of
+# the previous runs: if the latest one is 50% higher, show a warning and exit
+# with 1. Increases smaller than the minimum ones (in seconds or MB) are
+# ignored, as short stages are noisy.
+PERFORMANCE_THRESHOLD = 1.5
+PERFORMANCE_RUNS = 5
+PERFORMANCE_MIN_TIME_INCREASE = 30
+PERFORMANCE_MIN_MEMORY_INCREASE = 100
+
 
 def plot_graph(
     model_name: str,
@@ -110,12 +119,18 @@ def analyze_metrics(
     output_directory: str,
     relative_threshold: float,
     absolute_threshold: float,
+    performance_threshold: float,
+    performance_min_time_increase: float = PERFORMANCE_MIN_TIME_INCREASE,
+    performance_min_memory_increase: float = PERFORMANCE_MIN_MEMORY_INCREASE,
 ):
     root = Path(metrics_directory)
 
     metrics: Dict[str, Dict[str, Dict[datetime, float]]] = defaultdict(
         lambda: defaultdict(dict)
     )
+    performance_metrics: Dict[str, Dict[str, Dict[datetime, float]]] = defaultdict(
+        lambda: defaultdict(dict)
+    )
 
     clean = True
 
@@ -139,6 +154,11 @@ def analyze_metrics(
             metrics[model_name][f"{key}_mean"][date] = value["mean"]
             metrics[model_name][f"{key}_std"][date] = value["std"]
 
+        # And the time and memory used by the training stages
+        for stage, measures in metric.get("stages", {}).items():
+            for key, value in measures.items():
+                performance_metrics[model_name][f"stage_{stage}_{key}"][date] = value
+
     # Then analyze them
     for model_name in metrics:
         for metric_name, values in metrics[model_name].items():
@@ -202,6 +222,51 @@ def analyze_metrics(
                 metric_threshold,
             )
 
+    # Then analyze the performance metrics, for which lower is better
+    for model_name in performance_metrics:
+        for metric_name, values in performance_metrics[model_name].items():
+            df = DataFrame.from_dict(values, orient="index", columns=["value"])
+            df = df.sort_index()
+
+            if len(df["value"]) >= 2:
+                previous_value = df["value"][-PERFORMANCE_RUNS - 1 : -1].median()
+            else:
+                previous_value = df["value"][-1]
+
+            if metric_name.endswith("_time"):
+                min_increase = performance_min_time_increase
+            else:
+                min_increase = performance_min_memory_increase
+
+            metric_threshold = max(
+                previous_value * performance_threshold, previous_value + min_increase
+            )
+
+            if df.value[-1] > metric_threshold:
+                diff = (performance_threshold - 1) * 100
+                LOGGER.warning(
+                    "Last metric %r for model %s is more than %f%% (and %f) higher than the median of the previous ones",
+                    metric_name,
+                    model_name,
+                    diff,
+                    min_increase,
+                )
+
+                clean = False
+
+            title = f"{model_name} {metric_name}"
+            file_path = f"{model_name}_{metric_name}.svg"
+
+            plot_graph(
+                model_name,
+                metric_name,
+                df,
+                title,
+                Path(output_directory),
+                file_path,
+                metric_threshold,
+            )
+
     if not clean:
         sys.exit(1)
 
@@ -232,6 +297,25 @@ def main():
         help="If the last metric value is below the max value - absolute_threshod, fails. Default to 0.1",
     )
 
+    parser.add_argument(
+        "--performance_threshold",
+        default=PERFORMANCE_THRESHOLD,
+        type=float,
+        help="If the last time or memory used by a training stage is above the median of the previous ones * performance_threshold, fails. Default to 1.5",
+    )
+    parser.add_argument(
+        "--performance_min_time_increase",
+        default=PERFORMANCE_MIN_TIME_INCREASE,
+        type=float,
+        help="Increases of the time used by a training stage below this number of seconds never fail. Default to 30",
+    )
+    parser.add_argument(
+        "--performance_min_memory_increase",
+        default=PERFORMANCE_MIN_MEMORY_INCREASE,
+        type=float,
+        help="Increases of the memory used by a training stage below this number of MB never fail. Default to 100",
+    )
+
     args = parser.parse_args()
 
     analyze_metrics(
@@ -239,6 +323,9 @@ def main():
         args.output_directory,
         args.relative_threshold,
         args.absolute_threshold,
+        args.performance_threshold,
+        args.performance_min_time_increase,
+        args.performance_min_memory_increase,
     )
 
 
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+from collections import Counter
 from datetime import datetime
 from logging import getLogger
 
@@ -109,16 +110,21 @@ class Retriever(object):
         bugzilla.download_bugs(regressed_by_bug_ids)
 
         # Try to re-download inconsistent bugs, up to three times.
-        inconsistent_bugs = bugzilla.get_bugs()
+        inconsistent_bug_ids = None
         for i in range(3):
             # We look for inconsistencies in all bugs first, then, on following passes,
             # we only look for inconsistencies in bugs that were found to be inconsistent in the first pass
-            inconsistent_bugs = bug_snapshot.get_inconsistencies(inconsistent_bugs)
-            inconsistent_bug_ids = set(bug["id"] for bug in inconsistent_bugs)
+            inconsistencies = bug_snapshot.get_inconsistencies(inconsistent_bug_ids)
+            inconsistent_bug_ids = set(
+                inconsistency.bug_id for inconsistency in inconsistencies
+            )
 
             if len(inconsistent_bug_ids) == 0:
                 break
 
+            fields = Counter(inconsistency.field for inconsistency in inconsistencies)
+            logger.info(f"Inconsistencies by field: {dict(fields.most_common())}")
+
             logger.info(
                 f"Re-downloading {len(inconsistent_bug_ids)} bugs, as they were inconsistent"
             )
@@ -31,9 +31,7 @@ def generate_sheet(model_name, token, days, threshold):
 
     rows = [["Bug", f"{model_name}(model)", model_name, "Title"]]
 
-    for bug in bugs.values():
-        p = model.classify(bug, probabilities=True)
-        probability = p[0]
+    for bug, probability in model.classify_iter(bugs.values(), probabilities=True):
         if len(probability) > 2:
             index = np.argmax(probability)
             prediction = model.class_names[index]
@@ -53,8 +53,7 @@ def run_untriaged(untriaged_bugs):
     for (model_class, model_file_name) in models:
         rows = []
         model = model_class.load(model_file_name)
-        for bug in untriaged_bugs:
-            p = model.classify(bug, probabilities=True)
+        for bug, p in model.classify_iter(untriaged_bugs, probabilities=True):
             url = f'https://bugzilla.mozilla.org/show_bug.cgi?id={bug["id"]}'
 
             classifiable = p[p >= 0.7].size >= 1
@@ -69,7 +68,7 @@ def run_untriaged(untriaged_bugs):
 
             if classifiable:
                 print("Classifying bug with ID: {}".format(bug["id"]))
-                classification = model.classify(bug)[0]
+                classification = model.le.inverse_transform([p.argmax()])[0]
                 print("Classified bug as: {}".format(classification))
 
             else:
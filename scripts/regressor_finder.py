@@ -251,33 +251,43 @@ class RegressorFinder(object):
             for commit in commit_map[bug_id]:
                 bug_fixing_commits.append({"rev": commit, "type": type_})
 
-        for bug in tqdm(get_relevant_bugs(), total=bug_count):
-            # Ignore bugs which are not linked to the commits we care about.
-            if bug["id"] not in commit_map:
-                continue
+        def get_unlabelled_bugs():
+            for bug in tqdm(get_relevant_bugs(), total=bug_count):
+                # Ignore bugs which are not linked to the commits we care about.
+                if bug["id"] not in commit_map:
+                    continue
+
+                # If we know the label already, we don't need to apply the model.
+                if (
+                    bug["id"] in known_regression_labels
+                    and known_regression_labels[bug["id"]] == 1
+                ):
+                    append_bug_fixing_commits(bug["id"], "r")
+                    continue
 
-            # If we know the label already, we don't need to apply the model.
-            if (
-                bug["id"] in known_regression_labels
-                and known_regression_labels[bug["id"]] == 1
-            ):
-                append_bug_fixing_commits(bug["id"], "r")
-                continue
+                if bug["id"] in known_defect_labels:
+                    if known_defect_labels[bug["id"]] == "defect":
+                        append_bug_fixing_commits(bug["id"], "d")
+                    else:
+                        append_bug_fixing_commits(bug["id"], "e")
+                    continue
 
-            if bug["id"] in known_defect_labels:
-                if known_defect_labels[bug["id"]] == "defect":
-                    append_bug_fixing_commits(bug["id"], "d")
+                yield bug
+
+        def get_defects():
+            for bug, prediction in defect_model.classify_iter(get_unlabelled_bugs()):
+                if prediction == "defect":
+                    yield bug
                 else:
                     append_bug_fixing_commits(bug["id"], "e")
-                continue
 
-            if defect_model.classify(bug)[0] == "defect":
-                if regression_model.classify(bug)[0] == 1:
-                    append_bug_fixing_commits(bug["id"], "r")
-                else:
-                    append_bug_fixing_commits(bug["id"], "d")
+        # The bugs are classified in batches, the regression model only gets the
+        # bugs which were classified as defects.
+        for bug, prediction in regression_model.classify_iter(get_defects()):
+            if prediction == 1:
+                append_bug_fixing_commits(bug["id"], "r")
             else:
-                append_bug_fixing_commits(bug["id"], "e")
+                append_bug_fixing_commits(bug["id"], "d")
 
         db.append(BUG_FIXING_COMMITS_DB, bug_fixing_commits)
         zstd_compress(BUG_FIXING_COMMITS_DB)
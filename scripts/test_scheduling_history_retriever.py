@@ -108,10 +108,32 @@ file = {{ driver = "file", path = "{os.path.abspath(cache_path)}" }}
         HISTORY_DATE_START = datetime.now() - relativedelta(months=TRAINING_MONTHS)
 
         db.download(test_scheduling.TEST_SCHEDULING_DB, support_files_too=True)
+        push_commits_available = db.download(test_scheduling.PUSH_COMMITS_DB)
 
         last_node = None
+        history_pushes = {}
         for test_data in test_scheduling.get_test_scheduling_history():
             last_node = test_data["revs"][0]
+            if not push_commits_available:
+                history_pushes[last_node] = test_data["revs"]
+
+        if push_commits_available:
+            previous_push_commits = list(db.read(test_scheduling.PUSH_COMMITS_DB))
+        else:
+            # The push commits DB isn't published yet, backfill it once with the
+            # pushes which are already in the history.
+            logger.info(
+                f"Backfilling the merged commits of {len(history_pushes)} pushes"
+            )
+            previous_push_commits = list(
+                test_scheduling.merge_push_commits(
+                    list(history_pushes.values()), repository.get_commits()
+                )
+            )
+
+        # Merged commits of the pushes we add to the history, so the models
+        # don't need to merge them again for every task.
+        push_commits = []
 
         def generate_all_data():
             past_failures = test_scheduling.get_past_failures()
@@ -213,6 +235,10 @@ file = {{ driver = "file", path = "{os.path.abspath(cache_path)}" }}
 
                 pushdate = dateutil.parser.parse(merged_commits["pushdate"])
 
+                if pushdate > HISTORY_DATE_START:
+                    merged_commits["revs"] = revisions
+                    push_commits.append(merged_commits)
+
                 for data in test_scheduling.generate_data(
                     past_failures,
                     merged_commits,
@@ -235,8 +261,17 @@ file = {{ driver = "file", path = "{os.path.abspath(cache_path)}" }}
             past_failures.close()
 
         db.append(test_scheduling.TEST_SCHEDULING_DB, generate_all_data())
+        # Only the pushes used for training are kept, so the DB doesn't grow
+        # forever.
+        db.write(
+            test_scheduling.PUSH_COMMITS_DB,
+            test_scheduling.prune_push_commits(
+                previous_push_commits + push_commits, HISTORY_DATE_START
+            ),
+        )
 
         zstd_compress(test_scheduling.TEST_SCHEDULING_DB)
+        zstd_compress(test_scheduling.PUSH_COMMITS_DB)
 
         with open_tar_zst("data/past_failures.lmdb.tar.zst") as tar:
             tar.add("data/past_failures.lmdb")
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import functools
 import json
 import os
 import sys
 from logging import INFO, basicConfig, getLogger
 
-from bugbug import db
+from bugbug import bug_features, db
 from bugbug.models import get_model_class
+from bugbug.profiler import StageProfiler
 from bugbug.utils import CustomJsonEncoder, zstd_compress
 
 MODELS_WITH_TYPE = ("component",)
@@ -23,65 +25,172 @@ logger = getLogger(__name__)
 
 
 class Trainer(object):
-    def go(self, args):
-        # Download datasets that were built by bugbug_data.
-        os.makedirs("data", exist_ok=True)
-
+    def get_model(self, model, args):
         if args.classifier != "default":
             assert (
-                args.model in MODELS_WITH_TYPE
-            ), f"{args.classifier} is not a valid classifier type for {args.model}"
+                model in MODELS_WITH_TYPE
+            ), f"{args.classifier} is not a valid classifier type for {model}"
 
-            model_name = f"{args.model}_{args.classifier}"
+            model_name = f"{model}_{args.classifier}"
         else:
-            model_name = args.model
+            model_name = model
 
         model_class = get_model_class(model_name)
-        if args.model in HISTORICAL_SUPPORTED_TASKS:
+        if model in HISTORICAL_SUPPORTED_TASKS:
             model_obj = model_class(args.lemmatization, args.historical)
-        elif args.model == "regressor":
+        elif model == "regressor":
             model_obj = model_class(args.lemmatization, args.interpretable)
-        elif args.model == "duplicate":
+        elif model == "duplicate":
             model_obj = model_class(
                 args.training_set_size, args.lemmatization, args.cleanup_urls
             )
         else:
             model_obj = model_class(args.lemmatization)
 
-        if args.download_db:
-            for required_db in model_obj.required_dbs:
-                assert db.download(required_db)
-        else:
-            logger.info("Skipping download of the databases")
+        if args.feature_cache_dir is not None:
+            model_obj.feature_cache_dir = args.feature_cache_dir
 
-        logger.info(f"Training *{model_name}* model")
-        metrics = model_obj.train(limit=args.limit)
+        if args.out_of_core:
+            model_obj.out_of_core = True
+            if args.memory_budget is not None:
+                model_obj.memory_budget = args.memory_budget * 1024 ** 2
 
-        # Save the metrics as a file that can be uploaded as an artifact.
-        metric_file_path = "metrics.json"
-        with open(metric_file_path, "w") as metric_file:
-            json.dump(metrics, metric_file, cls=CustomJsonEncoder)
+        if args.cpu_budget is not None:
+            model_obj.cpu_budget = args.cpu_budget
 
-        logger.info(f"Training done")
+        if args.trace_memory:
+            model_obj.trace_memory = True
+
+        return model_name, model_obj
+
+    def save(self, model_name, model_obj, metrics, stages, metric_file_path):
+        profiler = StageProfiler(model_obj.trace_memory)
 
         model_file_name = f"{model_name}model"
         assert os.path.exists(model_file_name)
-        zstd_compress(model_file_name)
+
+        with profiler.stage("compress"):
+            zstd_compress(model_file_name)
+
+            if model_obj.store_dataset:
+                assert os.path.exists(f"{model_file_name}_data_X")
+                zstd_compress(f"{model_file_name}_data_X")
+                assert os.path.exists(f"{model_file_name}_data_y")
+                zstd_compress(f"{model_file_name}_data_y")
 
         logger.info(f"Model compressed")
 
-        if model_obj.store_dataset:
-            assert os.path.exists(f"{model_file_name}_data_X")
-            zstd_compress(f"{model_file_name}_data_X")
-            assert os.path.exists(f"{model_file_name}_data_y")
-            zstd_compress(f"{model_file_name}_data_y")
+        # Save the metrics as a file that can be uploaded as an artifact, along
+        # with the time and memory used by each stage.
+        metrics["stages"] = {**stages, **metrics.get("stages", {}), **profiler.stages}
+        with open(metric_file_path, "w") as metric_file:
+            json.dump(metrics, metric_file, cls=CustomJsonEncoder)
+
+    def go(self, args):
+        # Download datasets that were built by bugbug_data.
+        os.makedirs("data", exist_ok=True)
+
+        if args.models is not None:
+            models = [self.get_model(model, args) for model in args.models.split(",")]
+        else:
+            models = [self.get_model(args.model, args)]
+
+        profiler = StageProfiler(args.trace_memory)
+
+        if args.download_db:
+            required_dbs = dict.fromkeys(
+                required_db
+                for _, model_obj in models
+                for required_db in model_obj.required_dbs
+            )
+            with profiler.stage("download"):
+                for required_db in required_dbs:
+                    assert db.download(required_db)
+        else:
+            logger.info("Skipping download of the databases")
+
+        if len(models) == 1:
+            model_name, model_obj = models[0]
+            self.train(model_name, model_obj, args, profiler.stages, "metrics.json")
+            return
+
+        # Extract the features for all the models together, so that the DBs are
+        # read only once and the results of the bug feature extractors which are
+        # used by several models are computed only once. Tracing memory isn't
+        # possible while the models run concurrently.
+        shared_models = [
+            (model_name, model_obj)
+            for model_name, model_obj in models
+            if not model_obj.out_of_core
+        ]
+        other_models = [
+            (model_name, model_obj)
+            for model_name, model_obj in models
+            if model_obj.out_of_core
+        ]
+        del models
+
+        logger.info(
+            f"Extracting features for {', '.join(name for name, _ in shared_models)}"
+        )
+        extraction_profilers = [StageProfiler() for _ in shared_models]
+        with bug_features.sharing_results():
+            results = db.SharedScan().as_completed(
+                [
+                    functools.partial(
+                        model_obj.extract_features, extraction_profilers[i], args.limit
+                    )
+                    for i, (_, model_obj) in enumerate(shared_models)
+                ]
+            )
+
+            # Each model is trained as soon as its features are extracted, and
+            # released once it is saved, so that the features of all the models
+            # are not kept in memory until the last one is trained.
+            for i, features in results:
+                model_name, model_obj = shared_models[i]
+                shared_models[i] = None
+
+                self.train(
+                    model_name,
+                    model_obj,
+                    args,
+                    {**profiler.stages, **extraction_profilers[i].stages},
+                    f"metrics_{model_name}.json",
+                    features,
+                )
+                del model_obj, features
+
+        for model_name, model_obj in other_models:
+            self.train(
+                model_name,
+                model_obj,
+                args,
+                profiler.stages,
+                f"metrics_{model_name}.json",
+            )
+
+    def train(
+        self, model_name, model_obj, args, stages, metric_file_path, features=None
+    ):
+        logger.info(f"Training *{model_name}* model")
+        metrics = model_obj.train(limit=args.limit, features=features)
+
+        logger.info(f"Training done")
+
+        self.save(model_name, model_obj, metrics, stages, metric_file_path)
 
 
 def parse_args(args):
     description = "Train the models"
     parser = argparse.ArgumentParser(description=description)
 
-    parser.add_argument("model", help="Which model to train.")
+    parser.add_argument("model", nargs="?", help="Which model to train.")
+    parser.add_argument(
+        "--models",
+        help="""Comma-separated list of models to train together, sharing the
+                reads of the DBs and the feature extraction.""",
+    )
     parser.add_argument(
         "--limit",
         type=int,
@@ -129,7 +238,39 @@ def parse_args(args):
         help="""Only use human-interpretable features. Only used for regressor task.""",
         action="store_true",
     )
-    return parser.parse_args(args)
+    parser.add_argument(
+        "--feature-cache-dir",
+        help="""Cache the extracted features in this directory, to skip the
+                extraction when the DBs, labels and features didn't change.""",
+    )
+    parser.add_argument(
+        "--out-of-core",
+        help="""Extract features in chunks spilled to disk and train with XGBoost's
+                external memory, to train on datasets which don't fit in memory.""",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="Memory budget in MB for out-of-core training.",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        help="""Record the peak memory allocated by Python during each training
+                stage, using tracemalloc (slows down training).""",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cpu-budget",
+        type=int,
+        help="Number of CPUs to use for cross validation (all of them by default).",
+    )
+    args = parser.parse_args(args)
+
+    if (args.model is None) == (args.models is None):
+        parser.error("Either a model or --models must be specified")
+
+    return args
 
 
 def main():
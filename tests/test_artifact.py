@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.pipeline import Pipeline
+
+from bugbug import artifact
+from bugbug.artifact import LazyBooster, MappedVocabulary
+from bugbug.model import Model
+
+
+def test_mapped_vocabulary():
+    vocabulary = {
+        "crash": 3,
+        "crashes": 0,
+        "crashed_in_startup": 4,
+        "é": 1,
+        "": 2,
+        "firefox": 5,
+    }
+
+    mapped = MappedVocabulary(vocabulary)
+
+    assert len(mapped) == len(vocabulary)
+    assert dict(mapped.items()) == vocabulary
+    assert sorted(mapped) == sorted(vocabulary)
+    for term, index in vocabulary.items():
+        assert mapped[term] == index
+
+    for term in ["cras", "crashe", "crashes2", "e", "zzz"]:
+        assert term not in mapped
+        with pytest.raises(KeyError):
+            mapped[term]
+
+    assert 1 not in mapped
+
+    assert dict(pickle.loads(pickle.dumps(mapped)).items()) == vocabulary
+
+
+def test_mapped_vocabulary_empty():
+    mapped = MappedVocabulary({})
+
+    assert len(mapped) == 0
+    assert "crash" not in mapped
+
+
+def test_dump_load():
+    items = pd.DataFrame(
+        [
+            {
+                "data": {"severity": i % 3, "product": f"product{i % 4}"},
+                "title": f"crash number {i} in firefox ({'é' * (i % 5)})",
+            }
+            for i in range(200)
+        ]
+    )
+    y = np.arange(200) % 2
+
+    model = Model()
+    model.extraction_pipeline = Pipeline(
+        [
+            (
+                "union",
+                ColumnTransformer(
+                    [
+                        ("data", DictVectorizer(), "data"),
+                        ("title", TfidfVectorizer(min_df=0.01), "title"),
+                    ]
+                ),
+            )
+        ]
+    )
+    X = model.extraction_pipeline.fit_transform(items)
+    model.clf = xgboost.XGBClassifier(n_estimators=5).fit(X, y)
+    expected_probas = model.clf.predict_proba(X)
+
+    artifact.dump(model, "testmodel")
+
+    # The model which was dumped is left untouched.
+    title_vectorizer = model.extraction_pipeline.named_steps["union"].transformers_[1][
+        1
+    ]
+    assert isinstance(title_vectorizer.vocabulary_, dict)
+    assert hasattr(title_vectorizer, "stop_words_")
+    assert type(model.clf.get_booster()) is xgboost.Booster
+
+    loaded = Model.load("testmodel")
+
+    union = loaded.extraction_pipeline.named_steps["union"]
+    for _, vectorizer, _ in union.transformers_[:2]:
+        assert isinstance(vectorizer.vocabulary_, MappedVocabulary)
+        assert isinstance(vectorizer.vocabulary_.data, np.memmap)
+    assert not hasattr(union.transformers_[1][1], "stop_words_")
+
+    booster = loaded.clf.get_booster()
+    assert isinstance(booster, LazyBooster)
+    assert booster._handle is None
+
+    assert (
+        union.get_feature_names()
+        == model.extraction_pipeline.named_steps["union"].get_feature_names()
+    )
+
+    loaded_X = loaded.extraction_pipeline.transform(items)
+    assert abs(loaded_X - X).sum() == 0
+    assert np.allclose(loaded.clf.predict_proba(loaded_X), expected_probas)
+    assert booster._handle is not None
+
+    assert np.allclose(
+        pickle.loads(pickle.dumps(loaded.clf)).predict_proba(loaded_X), expected_probas
+    )
+
+    # The vocabularies are still memory-mapped after being used.
+    for _, vectorizer, _ in union.transformers_[:2]:
+        assert isinstance(vectorizer.vocabulary_, MappedVocabulary)
@@ -8,7 +8,9 @@ import os
 
 import pytest
 
+from bugbug import bug_features
 from bugbug.bug_features import (
+    SharedResults,
     blocked_bugs_number,
     bug_reporter,
     comment_count,
@@ -266,3 +268,52 @@ FIRST_AFFECTED_PARAMS = [
 @pytest.mark.parametrize("test_data, expected", FIRST_AFFECTED_PARAMS)
 def test_is_first_affected_same(test_data, expected):
     assert is_first_affected_same()(test_data) == expected
+
+
+def test_shared_results():
+    shared_results = SharedResults(max_bugs=2)
+
+    computed = []
+
+    def compute(value):
+        def _compute():
+            computed.append(value)
+            return value
+
+        return _compute
+
+    bug = {"id": 1, "last_change_time": "2019-01-01T00:00:00Z"}
+    assert shared_results.get(bug, "a", compute(1)) == 1
+    assert shared_results.get(dict(bug), "a", compute(2)) == 1
+    assert shared_results.get(bug, "b", compute(3)) == 3
+    # A bug with its commits is not the same input.
+    assert shared_results.get(dict(bug, commits=[]), "a", compute(4)) == 4
+    # Nor is a bug which changed since.
+    updated = dict(bug, last_change_time="2019-01-02T00:00:00Z")
+    assert shared_results.get(updated, "a", compute(5)) == 5
+    assert computed == [1, 3, 4, 5]
+
+    # Only the results for the most recently used bugs are kept.
+    assert shared_results.get(bug, "a", compute(6)) == 6
+
+    # Partial bugs are supported.
+    assert shared_results.get({"id": 2}, "a", compute(7)) == 7
+    assert shared_results.get({"id": 2}, "a", compute(8)) == 7
+    assert shared_results.get({}, "a", compute(9)) == 9
+    assert shared_results.get({}, "a", compute(10)) == 10
+
+
+def test_sharing_results():
+    assert bug_features.shared_results is None
+
+    with bug_features.sharing_results() as shared_results:
+        assert bug_features.shared_results is shared_results
+
+        bug = {"id": 1, "last_change_time": "2019-01-01T00:00:00Z"}
+        assert bug_features.get_shared_result(bug, ("a",), lambda: 1) == 1
+        assert bug_features.get_shared_result(bug, ("a",), lambda: 2) == 1
+        # Results with an unknown key are not shared.
+        assert bug_features.get_shared_result(bug, ("a", None), lambda: 3) == 3
+
+    assert bug_features.shared_results is None
+    assert bug_features.get_sharing_key(lambda x: x) is None
@@ -3,9 +3,12 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import copy
 
-from bugbug import bugzilla
-from bugbug.bug_snapshot import rollback
+import dateutil.parser
+
+from bugbug import bug_snapshot, bugzilla, db
+from bugbug.bug_snapshot import rollback, snapshot_at
 
 
 def test_bug_snapshot():
@@ -14,3 +17,83 @@ def test_bug_snapshot():
         print(i)
 
         rollback(bug, do_assert=True)
+
+
+def test_snapshot_at():
+    def assigned(change):
+        return change["field_name"].startswith("assigned_to")
+
+    def status(change):
+        return change["field_name"] == "status"
+
+    for bug in bugzilla.get_bugs():
+        original = copy.deepcopy(bug)
+
+        for when in [None, assigned, status]:
+            assert snapshot_at(bug, when) == rollback(copy.deepcopy(bug), when)
+
+        assert bug == original
+
+
+def test_snapshot_at_modified():
+    for bug in bugzilla.get_bugs():
+        timeline = bug_snapshot.BugTimeline(bug)
+
+        # Modifying a snapshot, including its nested values, doesn't change the
+        # following ones.
+        snapshot = timeline.snapshot_at()
+        for attachment in snapshot["attachments"]:
+            attachment["flags"].append({"name": "review", "status": "+"})
+        for comment in snapshot["comments"]:
+            comment["text"] = ""
+        snapshot["flags"].clear()
+        snapshot["cc"].append("someone@example.org")
+        snapshot["history"].clear()
+
+        assert timeline.snapshot_at() == rollback(copy.deepcopy(bug))
+
+
+def test_snapshot_at_date():
+    for bug in bugzilla.get_bugs():
+        histories = bug["history"]
+
+        for i, history in enumerate(histories):
+            if i + 1 < len(histories) and histories[i + 1]["when"] == history["when"]:
+                continue
+
+            expected_bug = copy.deepcopy(bug)
+            change_to_return = expected_bug["history"][i]["changes"][0]
+            expected = rollback(expected_bug, lambda change: change is change_to_return)
+
+            assert snapshot_at(bug, dateutil.parser.parse(history["when"])) == expected
+
+
+def test_get_inconsistencies(mock_data, monkeypatch):
+    # The bugs are dealt to the workers in several chunks.
+    monkeypatch.setattr(bug_snapshot, "INCONSISTENCIES_CHUNK_SIZE", 3)
+
+    bugs = list(bugzilla.get_bugs())
+
+    assert bug_snapshot.get_inconsistencies(processes=2) == []
+
+    bug1, bug2 = [
+        bug
+        for bug in bugs
+        if any(
+            change["field_name"] == "keywords" and change["added"]
+            for history in bug["history"]
+            for change in history["changes"]
+        )
+    ][:2]
+    bug1["keywords"] = []
+    bug2["keywords"] = []
+    db.write(bugzilla.BUGS_DB, bugs)
+
+    inconsistencies = bug_snapshot.get_inconsistencies(processes=2)
+    assert inconsistencies == sorted(inconsistencies)
+    assert [(i.bug_id, i.field) for i in inconsistencies] == sorted(
+        [(bug1["id"], "keywords"), (bug2["id"], "keywords")]
+    )
+
+    inconsistencies = bug_snapshot.get_inconsistencies({bug2["id"]}, processes=2)
+    assert [i.bug_id for i in inconsistencies] == [bug2["id"]]
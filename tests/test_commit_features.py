@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import copy
+
+import numpy as np
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.pipeline import Pipeline
+
+from bugbug import commit_features, feature_cleanup
+from bugbug.utils import to_array
+
+
+def get_commits():
+    commits = []
+    for i, (types, components) in enumerate(
+        [
+            ([".cpp", ".h"], ["Core::DOM"]),
+            ([".js"], []),
+            ([".cpp"], ["Core::DOM", "Firefox::General"]),
+        ]
+    ):
+        commit = {
+            "desc": f"Bug {i} - Fix crash in https://example.org/{i}",
+            "types": types,
+            "components": components,
+            "reviewers": ["reviewer"] * i,
+            "total_source_code_file_size": i * 10,
+            "average_source_code_file_size": i * 2.5,
+            "maximum_source_code_file_size": i * 5,
+            "minimum_source_code_file_size": 0,
+            "source_code_added": i,
+        }
+        for exp_type in ("reviewer", "component"):
+            for prefix in (
+                f"touched_prev_total_{exp_type}",
+                f"touched_prev_total_{exp_type}_backout",
+                f"touched_prev_90_days_{exp_type}",
+                f"touched_prev_90_days_{exp_type}_backout",
+            ):
+                commit[f"{prefix}_sum"] = i * 3
+                commit[f"{prefix}_max"] = i * 2
+                commit[f"{prefix}_min"] = i
+
+        commits.append(commit)
+
+    return commits
+
+
+def get_feature_extractors():
+    return [
+        commit_features.source_code_file_size(),
+        commit_features.source_code_added(),
+        commit_features.reviewer_experience(),
+        commit_features.reviewers_num(),
+        commit_features.component_touched_prev(),
+        commit_features.types(),
+        commit_features.components(),
+    ]
+
+
+def test_commit_matrix_extractor():
+    cleanup_functions = [feature_cleanup.url()]
+
+    pipeline = Pipeline(
+        [
+            (
+                "commit_extractor",
+                commit_features.CommitExtractor(
+                    get_feature_extractors(), cleanup_functions
+                ),
+            ),
+            (
+                "union",
+                ColumnTransformer(
+                    [
+                        ("data", DictVectorizer(), "data"),
+                        ("desc", TfidfVectorizer(), "desc"),
+                    ]
+                ),
+            ),
+        ]
+    )
+    extractor = commit_features.CommitMatrixExtractor(
+        get_feature_extractors(), cleanup_functions, TfidfVectorizer()
+    )
+
+    commits = get_commits()
+    expected = pipeline.fit_transform(lambda: copy.deepcopy(commits))
+    result = extractor.fit_transform(lambda: copy.deepcopy(commits))
+
+    assert np.array_equal(to_array(result), to_array(expected))
+    assert (
+        extractor.get_feature_names()
+        == pipeline.named_steps["union"].get_feature_names()
+    )
+
+    new_commit = get_commits()[2]
+    new_commit["types"].append(".unknown")
+    expected = pipeline.transform(lambda: [copy.deepcopy(new_commit)])
+    result = extractor.transform(lambda: [copy.deepcopy(new_commit)])
+
+    assert np.array_equal(to_array(result), to_array(expected))
+
+
+def test_commit_matrix_extractor_repeated_features():
+    pipeline = Pipeline(
+        [
+            (
+                "commit_extractor",
+                commit_features.CommitExtractor(get_feature_extractors(), []),
+            ),
+            ("union", ColumnTransformer([("data", DictVectorizer(), "data")])),
+        ]
+    )
+    extractor = commit_features.CommitMatrixExtractor(get_feature_extractors(), [])
+
+    commits = get_commits()
+    commits[0]["types"] = [".cpp", ".h", ".cpp"]
+    commits[2]["components"] = ["Core::DOM", "Core::DOM", "Firefox::General"]
+
+    expected = pipeline.fit_transform(lambda: copy.deepcopy(commits))
+    result = extractor.fit_transform(lambda: copy.deepcopy(commits))
+
+    assert np.array_equal(to_array(result), to_array(expected))
+    # Repeated list items are indicators, they aren't counted.
+    index = extractor.get_feature_names().index("data__.cpp in file types=True")
+    assert to_array(result)[0, index] == 1
+
+    # The commits aren't modified by the extraction.
+    desc = commits[0]["desc"]
+    extractor = commit_features.CommitMatrixExtractor(
+        get_feature_extractors(), [feature_cleanup.url()], TfidfVectorizer()
+    )
+    extractor.fit_transform(lambda: commits)
+    assert commits[0]["desc"] == desc
+
+
+def test_commit_matrix_extractor_hashing():
+    extractor = commit_features.CommitMatrixExtractor(
+        get_feature_extractors(), [], n_features=1024, sparse_threshold=1.0
+    )
+
+    result = extractor.fit_transform(get_commits)
+    assert result.shape == (3, 1024)
+    assert (extractor.transform(get_commits) != result).nnz == 0
+
+
+def test_merge_commits():
+    commits = get_commits()
+    for i, commit in enumerate(commits):
+        commit["node"] = f"node{i}"
+        commit["pushdate"] = "2019-10-01 00:00:00"
+        commit["files"] = [f"dom/file{i}.cpp", "dom/common.cpp"]
+        commit["directories"] = ["dom"]
+        for type_ in ("source_code", "other", "test"):
+            commit[f"{type_}_files_modified_num"] = 1
+            commit[f"{type_}_added"] = i
+            commit[f"{type_}_deleted"] = 1
+            for aggregation in ("total", "average", "maximum", "minimum"):
+                commit[f"{aggregation}_{type_}_file_size"] = i * 10
+
+    merged = commit_features.merge_commits(commits)
+
+    assert merged["nodes"] == ["node0", "node1", "node2"]
+    assert merged["pushdate"] == "2019-10-01 00:00:00"
+    assert set(merged["types"]) == {".cpp", ".h", ".js"}
+    assert set(merged["components"]) == {"Core::DOM", "Firefox::General"}
+    assert set(merged["files"]) == {
+        "dom/common.cpp",
+        "dom/file0.cpp",
+        "dom/file1.cpp",
+        "dom/file2.cpp",
+    }
+    assert merged["directories"] == ["dom"]
+    assert merged["reviewers"] == ["reviewer"]
+    assert merged["source_code_added"] == 3
+    assert merged["total_test_file_size"] == 30
+    assert merged["average_test_file_size"] == 10
+    assert merged["maximum_other_file_size"] == 20
+    assert merged["minimum_other_file_size"] == 0
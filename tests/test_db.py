@@ -6,6 +6,8 @@
 import json
 import os
 import pickle
+import threading
+import time
 from datetime import datetime
 from urllib.parse import urljoin
 
@@ -41,6 +43,176 @@ def test_write_read(mock_db, db_format, db_compression):
     assert list(db.read(db_path)) == [1, 2, 3, 4, 5, 6, 7]
 
 
+@pytest.mark.parametrize("db_compression", [None, "gz", "zstd"])
+def test_read_lines(mock_db, db_compression):
+    db_path = mock_db("json", db_compression)
+
+    db.write(db_path, [{"a": 1}, [2], "3"])
+
+    assert list(db.read_lines(db_path)) == ['{"a":1}\n', "[2]\n", '"3"\n']
+
+
+def test_shared_scan(mock_db, monkeypatch):
+    db_path = mock_db("json", None)
+    other_db_path = mock_db("pickle", None)
+    db.write(db_path, range(1, 2000))
+    db.write(other_db_path, ["a", "b"])
+
+    opened = []
+    original_db_open = db._db_open
+
+    def _db_open(path, mode):
+        opened.append(path)
+        return original_db_open(path, mode)
+
+    monkeypatch.setattr(db, "_db_open", _db_open)
+
+    def read_all():
+        return list(db.read(db_path))
+
+    def read_twice():
+        return sum(db.read(db_path)), list(db.read(other_db_path))
+
+    def read_some():
+        for elem in db.read(db_path):
+            if elem == 10:
+                break
+
+        return [json.loads(line) for line in db.read_lines(db_path)][::1000]
+
+    def read_nothing():
+        return 42
+
+    results = db.SharedScan(queue_size=10).run(
+        [read_all, read_twice, read_some, read_nothing]
+    )
+    assert results[0] == list(range(1, 2000))
+    assert results[1] == (sum(range(1, 2000)), ["a", "b"])
+    assert results[2] == [1, 1001]
+    assert results[3] == 42
+
+    # The DBs are read once, besides the read of the lines.
+    assert sorted(opened) == sorted([db_path, db_path, other_db_path])
+
+
+def test_shared_scan_nested_read(mock_db):
+    db_path = mock_db("json", None)
+    other_db_path = mock_db("pickle", None)
+    db.write(db_path, range(1, 100))
+    db.write(other_db_path, ["a", "b"])
+
+    def read_all():
+        return list(db.read(db_path))
+
+    def read_nested():
+        # The other DB is read while the first one is being read.
+        return [(elem, list(db.read(other_db_path))) for elem in db.read(db_path)]
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.extend(
+            db.SharedScan(queue_size=2).run([read_all, read_nested])
+        ),
+        daemon=True,
+    )
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "The shared scan is deadlocked"
+
+    assert results[0] == list(range(1, 100))
+    assert results[1] == [(elem, ["a", "b"]) for elem in range(1, 100)]
+
+
+def test_shared_scan_stalled_read(mock_db):
+    db_path = mock_db("json", None)
+    db.write(db_path, range(1, 100))
+
+    read_all_done = threading.Event()
+
+    def read_all():
+        elems = list(db.read(db_path))
+        read_all_done.set()
+        return elems
+
+    def read_first():
+        # The read is left unfinished while the thread keeps running.
+        elems = db.read(db_path)
+        first = next(elems)
+
+        # The other thread isn't blocked by this one.
+        assert read_all_done.wait(10)
+
+        with pytest.raises(Exception, match="Stopped reading"):
+            list(elems)
+
+        return first
+
+    results = db.SharedScan(queue_size=2, stall_timeout=0.5).run([read_all, read_first])
+    assert results == [list(range(1, 100)), 1]
+
+
+def test_shared_scan_unfinished_read(mock_db):
+    db_path = mock_db("json", None)
+    db.write(db_path, range(1, 100))
+
+    unfinished = []
+
+    def read_all():
+        return list(db.read(db_path))
+
+    def read_first():
+        elems = db.read(db_path)
+        # The read is still referenced when the function returns.
+        unfinished.append(elems)
+        return next(elems)
+
+    start = time.monotonic()
+    results = db.SharedScan(queue_size=2, stall_timeout=30).run([read_all, read_first])
+    assert results == [list(range(1, 100)), 1]
+    # The read was closed when the function returned, the other thread didn't
+    # wait for it to be considered stalled.
+    assert time.monotonic() - start < 10
+
+
+def test_shared_scan_as_completed(mock_db):
+    db_path = mock_db("json", None)
+    db.write(db_path, range(1, 8))
+
+    first_done = threading.Event()
+
+    def read_first():
+        for elem in db.read(db_path):
+            return elem
+
+    def read_all():
+        elems = list(db.read(db_path))
+        # Only returns once the result of the other function was received.
+        assert first_done.wait(10)
+        return elems
+
+    scan = db.SharedScan()
+    for i, result in scan.as_completed([read_all, read_first]):
+        if i == 1:
+            assert result == 1
+            first_done.set()
+        else:
+            assert result == list(range(1, 8))
+
+
+def test_shared_scan_error(mock_db):
+    db_path = mock_db("json", None)
+    db.write(db_path, range(1, 8))
+
+    def read():
+        return list(db.read(db_path))
+
+    def fail():
+        raise ValueError("Failure")
+
+    with pytest.raises(ValueError, match="Failure"):
+        db.SharedScan().run([read, fail])
+
+
 @pytest.mark.parametrize("db_format", ["json", "pickle"])
 @pytest.mark.parametrize("db_compression", [None, "gz", "zstd"])
 def test_append(mock_db, db_format, db_compression):
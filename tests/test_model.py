@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import inspect
+
+import numpy as np
+import pytest
+import shap
+import xgboost
+from imblearn.under_sampling import RandomUnderSampler
+from scipy import sparse
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer
+
+from bugbug import utils
+from bugbug.model import (
+    Model,
+    get_stratified_sample,
+    get_threshold_curve,
+    get_threshold_predictions,
+)
+from bugbug.models.qaneeded import QANeededModel
+from bugbug.models.regressor import RegressorModel
+from bugbug.models.testselect import TestSelectModel
+from bugbug.profiler import StageProfiler
+
+
+def test_get_threshold_predictions():
+    y_pred_probas = np.array([[0.9, 0.1], [0.3, 0.7], [0.55, 0.45]])
+
+    argmax, classified = get_threshold_predictions(y_pred_probas, 0.6, True)
+    assert argmax.tolist() == [0, 1, 0]
+    assert classified.tolist() == [True, True, False]
+
+    argmax, classified = get_threshold_predictions(y_pred_probas, 0.4, True)
+    assert argmax.tolist() == [0, 1, 1]
+    assert classified.tolist() == [True, True, True]
+
+    y_pred_probas = np.array([[0.2, 0.5, 0.3], [0.8, 0.1, 0.1]])
+    argmax, classified = get_threshold_predictions(y_pred_probas, 0.6, False)
+    assert argmax.tolist() == [1, 0]
+    assert classified.tolist() == [False, True]
+
+
+def test_get_threshold_curve():
+    y_true = np.array([0, 1, 1, 0])
+    y_pred_probas = np.array([[0.9, 0.1], [0.3, 0.7], [0.55, 0.45], [0.4, 0.6]])
+
+    curve = get_threshold_curve(y_true, y_pred_probas, [0.5, 0.8], True, ["0", "1"])
+
+    assert curve["thresholds"] == [0.5, 0.8]
+    assert curve["classified"] == [4, 1]
+    assert curve["coverage"] == [1.0, 0.25]
+    assert curve["classes"]["1"]["precision"] == [0.5, 0.0]
+    assert curve["classes"]["1"]["recall"] == [0.5, 0.0]
+    assert curve["classes"]["0"]["precision"] == [0.5, 1.0]
+    assert curve["classes"]["0"]["recall"] == [0.5, 0.5]
+
+
+def test_get_stratified_sample():
+    y = np.array([0] * 90 + [1] * 10)
+
+    sample = get_stratified_sample(y, 20)
+    assert len(sample) == 20
+    assert np.all(np.diff(sample) > 0)
+    assert (y[sample] == 1).sum() == 2
+
+    assert np.array_equal(get_stratified_sample(y, None), np.arange(100))
+    assert np.array_equal(get_stratified_sample(y, 1000), np.arange(100))
+
+
+@pytest.mark.parametrize("n_classes", [2, 3])
+def test_get_shap_values(n_classes):
+    rng = np.random.RandomState(0)
+    X = sparse.random(300, 200, density=0.05, format="csr", random_state=0)
+    y = rng.randint(0, n_classes, 300)
+
+    model = Model()
+    model.clf = xgboost.XGBClassifier(n_estimators=10).fit(X, y)
+
+    shap_values, columns = model.get_shap_values(X, batch_size=64)
+    expected = shap.TreeExplainer(model.clf).shap_values(X)
+
+    assert len(columns) < X.shape[1]
+    if n_classes == 2:
+        assert np.allclose(shap_values, expected[:, columns])
+        assert np.allclose(np.delete(expected, columns, axis=1), 0)
+    else:
+        for values, expected_values in zip(shap_values, expected):
+            assert np.allclose(values, expected_values[:, columns])
+            assert np.allclose(np.delete(expected_values, columns, axis=1), 0)
+
+
+@pytest.mark.parametrize(
+    "cpu_budget, expected", [(1, (1, 1)), (4, (4, 1)), (16, (5, 3)), (5, (5, 1))]
+)
+def test_get_cross_validation_jobs(cpu_budget, expected):
+    model = Model()
+    model.cpu_budget = cpu_budget
+
+    assert model.get_cross_validation_jobs(5) == expected
+
+
+@pytest.mark.parametrize("cpu_budget", [1, 2])
+def test_run_cross_validation(cpu_budget):
+    rng = np.random.RandomState(0)
+    X = sparse.random(200, 50, density=0.1, format="csr", random_state=0)
+    y = rng.randint(0, 2, 200)
+
+    model = Model()
+    model.cpu_budget = cpu_budget
+    model.clf = xgboost.XGBClassifier(n_estimators=5, n_jobs=16)
+
+    scores = model.run_cross_validation(model.clf, X, y, ["accuracy"])
+
+    assert len(scores["test_accuracy"]) == 5
+    assert model.clf.n_jobs == 16
+
+
+def test_classify_iter():
+    model = Model()
+
+    batches = []
+
+    def classify(items, probabilities=False):
+        batches.append(items)
+        return np.array([item * 2 for item in items])
+
+    model.classify = classify
+
+    results = model.classify_iter(iter(range(10)), batch_size=4)
+    assert next(results) == (0, 0)
+    assert batches == [[0, 1, 2, 3]]
+
+    assert list(results) == [(i, i * 2) for i in range(1, 10)]
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+    assert list(model.classify_iter([], batch_size=4)) == []
+
+
+def test_sample_labels():
+    labels = [i % 7 == 0 for i in range(100)]
+    classes = {f"item{i}": int(label) for i, label in enumerate(labels)}
+
+    model = Model()
+    model.sampler = RandomUnderSampler(random_state=0)
+
+    sampled = model.sample_labels(classes)
+
+    assert sum(sampled.values()) == sum(labels)
+    assert len(sampled) == 2 * sum(labels)
+    # The order of the items is kept.
+    assert list(sampled) == [key for key in classes if key in sampled]
+
+    # The same items are selected as when sampling their features.
+    X = np.arange(100).reshape(-1, 1) * 10
+    X_resampled, _ = RandomUnderSampler(random_state=0).fit_resample(
+        X, list(classes.values())
+    )
+    assert sorted(sampled) == sorted(f"item{x // 10}" for x in X_resampled[:, 0])
+
+    assert model.sample_labels(classes) == sampled
+
+
+class ExtractionModel(Model):
+    def __init__(self):
+        Model.__init__(self)
+
+        self.extracted = []
+
+        self.extraction_pipeline = Pipeline(
+            [
+                # Extraction pipelines are given a generator function.
+                (
+                    "items",
+                    FunctionTransformer(
+                        lambda items_gen: list(items_gen()), validate=False
+                    ),
+                ),
+                ("vectorizer", DictVectorizer()),
+            ]
+        )
+
+    def get_labels(self):
+        return {i: int(i % 5 == 0) for i in range(50)}, [0, 1]
+
+    def items_gen(self, classes):
+        for i in range(60):
+            if i in classes:
+                self.extracted.append(i)
+                yield {"value": i}, classes[i]
+
+
+class TimeSplitExtractionModel(ExtractionModel):
+    def train_test_split(self, X, y):
+        return TestSelectModel.train_test_split(self, X, y)
+
+
+def test_extract_features_pushdown():
+    model = ExtractionModel()
+    X, y, train_size = model.extract_features(StageProfiler(), limit=20)
+    assert X.shape == (20, 1)
+    assert train_size is None
+    assert model.extracted == list(range(20))
+
+    model = ExtractionModel()
+    model.sampler = RandomUnderSampler(random_state=0)
+    X, y, train_size = model.extract_features(StageProfiler())
+    assert X.shape == (50, 1)
+    assert train_size is None
+
+    model = ExtractionModel()
+    model.sampler = RandomUnderSampler(random_state=0)
+    model.sample_before_extraction = True
+    X, y, train_size = model.extract_features(StageProfiler(), limit=10)
+    assert X.shape == (10, 1)
+    assert train_size == 10
+    assert len(model.extracted) == 10
+
+
+@pytest.mark.parametrize("model_class", [ExtractionModel, TimeSplitExtractionModel])
+def test_sample_before_extraction(model_class):
+    assert TestSelectModel().sample_before_extraction
+    assert RegressorModel().sample_before_extraction
+
+    def get_values(X):
+        return X[:, 0].toarray().ravel().tolist()
+
+    model = model_class()
+    model.sampler = RandomUnderSampler(random_state=0)
+    X, y, _ = model.extract_features(StageProfiler())
+    X_train, X_test, y_train, y_test = model.train_test_split(X, y)
+    X_train, y_train = model.sampler.fit_resample(X_train, y_train)
+
+    model = model_class()
+    model.sampler = RandomUnderSampler(random_state=0)
+    model.sample_before_extraction = True
+    X, y, train_size = model.extract_features(StageProfiler())
+
+    # The training and test sets are the same as when sampling the features,
+    # only the test set isn't sampled.
+    assert sorted(get_values(X[:train_size])) == sorted(get_values(X_train))
+    assert sorted(get_values(X[train_size:])) == sorted(get_values(X_test))
+    assert sorted(y[:train_size].tolist()) == sorted(y_train.tolist())
+    assert sorted(y[train_size:].tolist()) == sorted(y_test.tolist())
+
+    # Only the features of these items are extracted, in their original order.
+    assert model.extracted == get_values(X)
+    assert get_values(X[:train_size]) == sorted(get_values(X[:train_size]))
+    assert get_values(X[train_size:]) == sorted(get_values(X[train_size:]))
+
+
+def test_get_feature_cache_path(monkeypatch):
+    classes = {1: 0, 2: 1}
+
+    def get_feature_cache_path():
+        model = QANeededModel()
+        model.feature_cache_dir = "feature_cache"
+        return model.get_feature_cache_path(classes)
+
+    path = get_feature_cache_path()
+    assert get_feature_cache_path() == path
+
+    # Editing the code defining the items (e.g. items_gen of the base model)
+    # invalidates the cached features.
+    getsource = inspect.getsource
+
+    def edited_getsource(module):
+        source = getsource(module)
+        if module.__name__ == "bugbug.model":
+            source += "\n# Edited"
+        return source
+
+    monkeypatch.setattr(utils.inspect, "getsource", edited_getsource)
+    assert get_feature_cache_path() != path
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import numpy as np
+import pytest
+import xgboost
+from imblearn.under_sampling import RandomUnderSampler
+from scipy import sparse
+from sklearn.pipeline import Pipeline
+
+from bugbug import commit_features, out_of_core
+from bugbug.model import Model
+
+
+class DummyModel(Model):
+    def __init__(self):
+        Model.__init__(self)
+
+        self.sampler = RandomUnderSampler(random_state=0)
+        self.entire_dataset_training = True
+
+        self.extraction_pipeline = Pipeline(
+            [
+                (
+                    "commit_extractor",
+                    commit_features.CommitMatrixExtractor(
+                        [
+                            commit_features.source_code_added(),
+                            commit_features.types(),
+                            commit_features.files(min_freq=0.1),
+                        ],
+                        [],
+                    ),
+                )
+            ]
+        )
+
+        self.clf = xgboost.XGBClassifier(n_estimators=10)
+
+    def get_labels(self):
+        return {i: 1 if i % 3 == 0 else 0 for i in range(300)}, [0, 1]
+
+    def items_gen(self, classes):
+        for i, label in classes.items():
+            commit = {
+                "source_code_added": i % 7,
+                "types": [".cpp"] if label == 1 else [".js"],
+                # Only the first chunks touch this file.
+                "files": ["early.cpp"] if i < 100 else ["late.cpp"],
+            }
+            yield commit, label
+
+
+def test_chunk_store(tmp_path):
+    chunks = out_of_core.ChunkStore(str(tmp_path))
+    chunks.append(sparse.csr_matrix(np.arange(6).reshape(3, 2)))
+    chunks.append(np.arange(4).reshape(2, 2))
+
+    assert len(chunks) == 2
+    assert chunks.rows == 5
+    assert np.array_equal(
+        sparse.vstack(list(chunks)).toarray(),
+        np.concatenate([np.arange(6), np.arange(4)]).reshape(5, 2),
+    )
+
+    mask = np.array([True, False, True, False, True])
+    rows = sparse.vstack(list(chunks.iter_rows(mask))).toarray()
+    assert np.array_equal(rows, [[0, 1], [4, 5], [2, 3]])
+
+
+def test_get_chunk_size():
+    X = sparse.csr_matrix(np.ones((10, 10)))
+    size = X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+
+    assert out_of_core.get_chunk_size(X, size, budget_fraction=1) == 10
+    assert out_of_core.get_chunk_size(X, size, budget_fraction=0.5) == 5
+    assert out_of_core.get_chunk_size(X, 1) == 1
+
+
+def test_train_out_of_core(monkeypatch, tmp_path):
+    # The model and its chunks are dumped in the current directory.
+    monkeypatch.chdir(tmp_path)
+
+    monkeypatch.setattr(out_of_core, "INITIAL_CHUNK_SIZE", 50)
+
+    chunk_sizes = []
+    orig_append = out_of_core.ChunkStore.append
+
+    def append(self, X):
+        chunk_sizes.append(X.shape[0])
+        orig_append(self, X)
+
+    monkeypatch.setattr(out_of_core.ChunkStore, "append", append)
+
+    model = DummyModel()
+    model.out_of_core = True
+    model.memory_budget = 64 * 1024
+    model.hashing_n_features = 1024
+
+    metrics = model.train()
+
+    assert len(chunk_sizes) > 1
+    assert sum(chunk_sizes) == 300
+
+    extractor = model.extraction_pipeline.named_steps["commit_extractor"]
+    assert extractor.n_features == 1024
+    assert metrics["report"]["average"]["precision"] == 1.0
+
+    # The stateful extractors are fit on all the items, not on the first chunk.
+    files_extractor = extractor.feature_extractors[2]
+    assert files_extractor.total_commits == 300
+    assert set(files_extractor.count) == {"early.cpp", "late.cpp"}
+
+    assert isinstance(model.clf, out_of_core.BoosterClassifier)
+    # The names of the hashed features are not known.
+    assert not model.calculate_importance
+
+    loaded = Model.load("dummymodel")
+    probabilities = loaded.classify(
+        [{"source_code_added": 1, "types": [".cpp"], "files": []}], probabilities=True
+    )
+    assert probabilities[0][1] > 0.5
+    assert loaded.classify(
+        [{"source_code_added": 1, "types": [".js"], "files": []}]
+    ).tolist() == [0]
+
+    with pytest.raises(AssertionError):
+        loaded.classify(
+            [{"source_code_added": 1, "types": [".cpp"], "files": []}],
+            importances=True,
+        )
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import sys
+import time
+import tracemalloc
+
+import pytest
+
+from bugbug.profiler import StageProfiler
+
+
+def test_stage_profiler():
+    profiler = StageProfiler()
+
+    with profiler.stage("sleep"):
+        time.sleep(0.1)
+
+    assert {"wall_time", "cpu_time", "process_max_rss"} <= set(profiler.stages["sleep"])
+    assert profiler.stages["sleep"]["wall_time"] >= 0.1
+    assert profiler.stages["sleep"]["cpu_time"] < 0.1
+    assert profiler.stages["sleep"]["process_max_rss"] > 0
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="The RSS peak is reset on Linux"
+)
+def test_stage_profiler_max_rss():
+    profiler = StageProfiler()
+
+    with profiler.stage("outer"):
+        with profiler.stage("allocate"):
+            data = b"x" * (100 * 1024 ** 2)
+            del data
+
+        with profiler.stage("nothing"):
+            pass
+
+    stages = profiler.stages
+    assert stages["allocate"]["max_rss"] >= 100
+    # The peak of a stage isn't the peak of the process.
+    assert stages["nothing"]["max_rss"] < stages["allocate"]["max_rss"] - 50
+    assert stages["nothing"]["process_max_rss"] >= stages["allocate"]["max_rss"]
+    # Nested stages don't hide the peak from the stages running them.
+    assert stages["outer"]["max_rss"] >= stages["allocate"]["max_rss"]
+
+
+def test_stage_profiler_trace_memory():
+    profiler = StageProfiler(trace_memory=True)
+
+    with profiler.stage("allocate"):
+        data = bytearray(50 * 1024 ** 2)
+        del data
+
+    with profiler.stage("nothing"):
+        pass
+
+    assert profiler.stages["allocate"]["tracemalloc_peak"] >= 50
+    assert profiler.stages["nothing"]["tracemalloc_peak"] < 1
+    assert not tracemalloc.is_tracing()
+
+
+def test_stage_profiler_exception():
+    profiler = StageProfiler()
+
+    with pytest.raises(ValueError):
+        with profiler.stage("failure"):
+            raise ValueError()
+
+    assert "failure" in profiler.stages
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from datetime import datetime
+
+from bugbug import db, test_scheduling
+
+
+def test_push_commits(mock_data):
+    db.write(
+        test_scheduling.PUSH_COMMITS_DB,
+        [{"revs": ["rev1", "rev2"], "nodes": ["rev1", "rev2"], "files": ["a.cpp"]}],
+    )
+
+    push_commits = test_scheduling.PushCommits()
+
+    merged_commits = push_commits.get(["rev1", "rev2"])
+    assert merged_commits["nodes"] == ["rev1", "rev2"]
+    assert merged_commits["files"] == ["a.cpp"]
+
+    # The push is not in the DB and none of its commits are in the commits DB.
+    assert push_commits.get(["unknown1", "unknown2"]) is None
+    assert push_commits.get(["unknown1"]) is None
+
+
+def test_merge_push_commits():
+    commits = []
+    for i, pushdate in enumerate(
+        ["2019-01-01 10:00:00", "2019-01-01 10:00:00", "2019-03-01 10:00:00"]
+    ):
+        commit = {
+            "node": f"rev{i}",
+            "pushdate": pushdate,
+            "types": [".cpp"],
+            "files": [f"dom/file{i}.cpp"],
+            "directories": ["dom"],
+            "components": ["Core::DOM"],
+            "reviewers": ["reviewer"],
+        }
+        for type_ in ("source_code", "other", "test"):
+            commit[f"{type_}_files_modified_num"] = 1
+            commit[f"{type_}_added"] = i
+            commit[f"{type_}_deleted"] = 1
+            for aggregation in ("total", "average", "maximum", "minimum"):
+                commit[f"{aggregation}_{type_}_file_size"] = i * 10
+
+        commits.append(commit)
+
+    pushes = list(
+        test_scheduling.merge_push_commits(
+            [["rev0", "rev1"], ["rev2"], ["unknown"]], commits
+        )
+    )
+    assert [push["revs"] for push in pushes] == [["rev0", "rev1"], ["rev2"]]
+    assert sorted(pushes[0]["files"]) == ["dom/file0.cpp", "dom/file1.cpp"]
+
+    # Only the pushes in the training window are kept.
+    pruned = test_scheduling.prune_push_commits(pushes, datetime(2019, 2, 1))
+    assert [push["revs"] for push in pruned] == [["rev2"]]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from bugbug import test_scheduling_features
+
+
+def test_task_name_attributes():
+    for name, platform, arch, chunk, suite in [
+        (
+            "test-linux64/debug-mochitest-browser-chrome-e10s-3",
+            "linux",
+            "64",
+            "mochitest-browser-chrome-3",
+            "mochitest-browser-chrome",
+        ),
+        (
+            "test-windows10-aarch64/opt-xpcshell-1",
+            "windows",
+            "aarch64",
+            "xpcshell-1",
+            "xpcshell",
+        ),
+        (
+            "test-android-em-7.0-x86/pgo-web-platform-tests-2",
+            "android",
+            "32",
+            "web-platform-tests-2",
+            "web-platform-tests",
+        ),
+    ]:
+        test_job = {"name": name}
+
+        # Twice, to exercise the cached values too.
+        for _ in range(2):
+            assert test_scheduling_features.platform()(test_job) == platform
+            assert test_scheduling_features.arch()(test_job) == arch
+            assert test_scheduling_features.chunk()(test_job) == chunk
+            assert test_scheduling_features.suite()(test_job) == suite
+
+    build_job = {"name": "build-linux64/opt"}
+    assert test_scheduling_features.chunk()(build_job) == "build"
+    assert test_scheduling_features.arch()(build_job) == []
+    test_scheduling_features.arch()(build_job).append("x86")
+    assert test_scheduling_features.arch()(build_job) == []
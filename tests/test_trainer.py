@@ -3,13 +3,17 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import json
+import os
+
 import responses
 
 from bugbug import bugzilla, db
+from bugbug.models.defect import DefectModel
 from scripts import trainer
 
 
-def test_trainer():
+def mock_bugs_db():
     # Pretend the DB was already downloaded and no new DB is available.
 
     url = "https://community-tc.services.mozilla.com/api/index/v1/task/project.relman.bugbug.data_bugs.latest/artifacts/public/bugs.json"
@@ -25,4 +29,84 @@ def test_trainer():
         responses.HEAD, f"{url}.zst", status=200, headers={"ETag": "etag"},
     )
 
+
+def test_trainer():
+    mock_bugs_db()
+
     trainer.Trainer().go(trainer.parse_args(["defect"]))
+
+
+def test_trainer_feature_cache(monkeypatch):
+    mock_bugs_db()
+
+    args = trainer.parse_args(["defect", "--feature-cache-dir", "feature_cache"])
+
+    trainer.Trainer().go(args)
+    assert len(os.listdir("feature_cache")) == 1
+
+    def items_gen(self, classes):
+        assert False, "The features should have been loaded from the cache"
+
+    monkeypatch.setattr(DefectModel, "items_gen", items_gen)
+
+    trainer.Trainer().go(args)
+    assert len(os.listdir("feature_cache")) == 1
+
+
+def test_trainer_stages():
+    mock_bugs_db()
+
+    trainer.Trainer().go(trainer.parse_args(["defect", "--trace-memory"]))
+
+    with open("metrics.json") as f:
+        stages = json.load(f)["stages"]
+
+    for stage in [
+        "download",
+        "get_labels",
+        "extraction",
+        "cross_validation",
+        "sampling",
+        "fit",
+        "importance",
+        "evaluation",
+        "dump",
+        "compress",
+    ]:
+        assert set(stages[stage]) == {
+            "wall_time",
+            "cpu_time",
+            "max_rss",
+            "process_max_rss",
+            "tracemalloc_peak",
+        }
+        assert stages[stage]["wall_time"] >= 0
+
+
+def test_trainer_multiple_models(monkeypatch):
+    mock_bugs_db()
+
+    opened = []
+    original_db_open = db._db_open
+
+    def _db_open(path, mode):
+        opened.append(path)
+        return original_db_open(path, mode)
+
+    monkeypatch.setattr(db, "_db_open", _db_open)
+
+    trainer.Trainer().go(trainer.parse_args(["--models", "defect,regression"]))
+
+    for model_name in ["defect", "regression"]:
+        assert os.path.exists(f"{model_name}model.zst")
+
+        with open(f"metrics_{model_name}.json") as f:
+            metrics = json.load(f)
+
+        assert "report" in metrics
+        assert {"download", "get_labels", "extraction", "fit", "compress"} <= set(
+            metrics["stages"]
+        )
+
+    # Both models read the bugs DB in get_labels and in items_gen.
+    assert opened.count(bugzilla.BUGS_DB) == 2
@@ -11,6 +11,7 @@ import requests
 import responses
 
 from bugbug import utils
+from bugbug.models.qaneeded import QANeededModel
 
 
 def test_split_tuple_iterator():
@@ -239,3 +240,14 @@ def test_get_last_modified_missing():
     )
 
     assert utils.get_last_modified(url) is None
+
+
+def test_get_config_fingerprint():
+    assert utils.get_config_fingerprint(
+        QANeededModel().extraction_pipeline
+    ) == utils.get_config_fingerprint(QANeededModel().extraction_pipeline)
+
+    model = QANeededModel()
+    fingerprint = utils.get_config_fingerprint(model.extraction_pipeline)
+    model.extraction_pipeline.set_params(union__title__min_df=0.1)
+    assert utils.get_config_fingerprint(model.extraction_pipeline) != fingerprint